@@ -0,0 +1,116 @@
+import os
+import json
+import socket
+import subprocess
+import openmc
+
+from barc_blanket.models.barc_model_final import make_model
+from barc_blanket.utilities import machine_profile_path, change_directory
+
+def total_memory():
+    """Total physical memory of this machine [bytes]"""
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+def measure_throughput(model_config, particles, threads, batches=5):
+    """Run a few batches of the final model in a separate OpenMC process
+    and measure its speed and peak memory
+
+    Parameters:
+    ----------
+    model_config : dict
+        Configuration to build the final model with
+    particles : int
+        Particles per batch
+    threads : int
+        Number of OpenMP threads
+    batches : int, optional
+        Number of batches to run. Default = 5
+
+    Returns:
+    -------
+    measurement : dict
+        'particles', 'threads', 'particles_per_second' and 'max_memory' [bytes]
+    """
+
+    model = make_model({**model_config,
+                        'particles': int(particles),
+                        'batches': batches,
+                        'inactive_batches': 0,
+                        'machine_profile': False})
+
+    with change_directory(tmpdir=True):
+        model.export_to_xml()
+        process = subprocess.Popen(['openmc', '-s', str(threads)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # wait4 gives the resource usage of just this process
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            raise RuntimeError(f"OpenMC failed with {int(particles)} particles and {threads} threads (exit code {process.returncode})")
+
+        with openmc.StatePoint(f"statepoint.{batches}.h5") as statepoint:
+            transport_time = statepoint.runtime['transport']
+
+    return {'particles': int(particles),
+            'threads': threads,
+            'particles_per_second': particles * batches / transport_time,
+            'max_memory': rusage.ru_maxrss * 1024} # ru_maxrss is in kB on Linux
+
+def autotune(model_config=None, particles_options=(1e4, 1e5, 1e6), threads_options=None, batches=5, memory_fraction=0.8):
+    """Find the fastest particles per batch and thread count for this machine, and save them as its profile.
+    make_model uses the particles per batch (keeping the total histories) with 'machine_profile': True,
+    and the threads are passed to OpenMC by barc_blanket.orchestrator, or by hand with recommended_threads.
+
+    Parameters:
+    ----------
+    model_config : dict, optional
+        Configuration to calibrate with. Default is the default final model.
+    particles_options : list of int, optional
+        Particles per batch to try
+    threads_options : list of int, optional
+        Thread counts to try. Default is 1, half and all of the cores.
+    batches : int, optional
+        Number of batches in each trial run. Default = 5
+    memory_fraction : float, optional
+        Settings that use more than this fraction of the machine's memory are not recommended. Default = 0.8
+
+    Returns:
+    -------
+    profile : dict
+        The machine profile that was written, with 'recommended' settings and all the 'measurements'
+    """
+
+    if model_config is None:
+        model_config = {}
+
+    cpu_count = os.cpu_count()
+    if threads_options is None:
+        threads_options = sorted(set([1, max(cpu_count//2, 1), cpu_count]))
+
+    measurements = []
+    for threads in threads_options:
+        for particles in particles_options:
+            measurement = measure_throughput(model_config, particles, threads, batches)
+            print(f"{measurement['particles']:>10d} particles, {threads:>3d} threads: "
+                  f"{measurement['particles_per_second']:0.1f} particles/s, {measurement['max_memory']/1e9:0.2f} GB")
+            measurements.append(measurement)
+
+    memory_limit = memory_fraction * total_memory()
+    usable = [measurement for measurement in measurements if measurement['max_memory'] < memory_limit]
+    if len(usable) == 0:
+        raise ValueError(f"Every setting tried used more than {memory_fraction*100:0.0f}% of the memory")
+    best = max(usable, key=lambda measurement: measurement['particles_per_second'])
+
+    profile = {'hostname': socket.gethostname(),
+               'cpu_count': cpu_count,
+               'total_memory': total_memory(),
+               'recommended': {'particles': best['particles'],
+                               'threads': best['threads']},
+               'measurements': measurements}
+
+    path = machine_profile_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    print(f"Recommended {best['particles']} particles and {best['threads']} threads, saved to {path}")
+
+    return profile
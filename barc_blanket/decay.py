@@ -0,0 +1,163 @@
+import warnings
+import numpy as np
+import scipy.sparse as sp
+import openmc
+import openmc.stats
+import openmc.deplete
+from openmc.deplete.cram import CRAM48
+
+from barc_blanket.utilities import CHAIN_FILE
+
+JOULES_PER_EV = 1.602176634e-19
+
+class DecaySolver:
+    """Decay any number of compositions (no neutrons) to a set of cooling times at once.
+
+    The decay matrix is built once from the chain, keeping only the nuclides that can be reached
+    by decay from the starting nuclides, which is usually a few hundred instead of thousands.
+    Every composition is a column of the right hand side, so each cooling time is one CRAM48 solve
+    for all of them together, without ever forming the (dense) matrix exponential.
+
+    Parameters:
+    ----------
+    nuclides : list of str
+        Nuclides present at the start of cooling, e.g. every nuclide in the activated materials.
+        Nuclides that aren't in the chain are treated as stable and left out.
+    chain_file : str, optional
+        Depletion chain to take the decay data from. Default is CHAIN_FILE.
+    """
+
+    def __init__(self, nuclides, chain_file=CHAIN_FILE):
+        chain = openmc.deplete.Chain.from_xml(chain_file)
+
+        self.nuclides = _decay_reachable(chain, nuclides)
+        self.index = {name: i for i, name in enumerate(self.nuclides)}
+        chain_nuclides = [chain[name] for name in self.nuclides]
+
+        self.decay_constants = np.array([nuclide.decay_constant for nuclide in chain_nuclides])
+        # Recoverable energy per decay [eV]
+        self.decay_energies = np.array([nuclide.decay_energy for nuclide in chain_nuclides])
+        # Photons emitted per second by one atom, by energy
+        self.photon_sources = [nuclide.sources.get('photon') for nuclide in chain_nuclides]
+        self.matrix = self._decay_matrix(chain_nuclides)
+
+    def _decay_matrix(self, chain_nuclides):
+        """Sparse decay matrix of the kept nuclides [1/s], laid out like openmc's Chain.form_matrix"""
+        matrix = sp.dok_matrix((len(self.nuclides), len(self.nuclides)))
+        for i, nuclide in enumerate(chain_nuclides):
+            decay_constant = nuclide.decay_constant
+            if decay_constant == 0:
+                continue
+            matrix[i, i] -= decay_constant
+            for decay_type, target, branching_ratio in nuclide.decay_modes:
+                branch_rate = branching_ratio * decay_constant
+                if target in self.index:
+                    matrix[self.index[target], i] += branch_rate
+                # Alpha and proton decays also make He4 and H1
+                if 'alpha' in decay_type and 'He4' in self.index:
+                    matrix[self.index['He4'], i] += decay_type.count('alpha') * branch_rate
+                elif 'p' in decay_type and 'H1' in self.index:
+                    matrix[self.index['H1'], i] += decay_type.count('p') * branch_rate
+        return matrix.tocsc()
+
+    def atoms_array(self, compositions):
+        """Stack compositions into a (compositions x nuclides) array of atoms
+
+        Parameters:
+        ----------
+        compositions : list of dict or openmc.Material
+            Atoms of each nuclide, or materials with volumes set
+        """
+        atoms = np.zeros((len(compositions), len(self.nuclides)))
+        for i, composition in enumerate(compositions):
+            if isinstance(composition, openmc.Material):
+                composition = composition.get_nuclide_atoms()
+            for nuclide, count in composition.items():
+                if nuclide in self.index:
+                    atoms[i, self.index[nuclide]] = count
+        return atoms
+
+    def decay(self, compositions, times):
+        """Atoms of every nuclide in every composition at every cooling time
+
+        Parameters:
+        ----------
+        compositions : list of dict or openmc.Material
+            Starting atoms of each nuclide, or materials with volumes set
+        times : list of float
+            Cooling times [s]
+
+        Returns:
+        -------
+        numpy.ndarray
+            Atoms, compositions x times x nuclides (ordered as self.nuclides)
+        """
+        initial_atoms = self.atoms_array(compositions)
+        return np.stack([initial_atoms if time == 0 else CRAM48(self.matrix, initial_atoms.T, time).T
+                         for time in times], axis=1)
+
+    def activity(self, atoms):
+        """Activity [Bq] of atoms from decay, summed over nuclides"""
+        return atoms @ self.decay_constants
+
+    def decay_heat(self, atoms):
+        """Decay heat [W] of atoms from decay, summed over nuclides"""
+        return atoms @ (self.decay_constants * self.decay_energies * JOULES_PER_EV)
+
+    def photon_spectra(self, atoms, energy_bins):
+        """Decay photon emission rate [photons/s] in energy bins
+
+        Parameters:
+        ----------
+        atoms : numpy.ndarray
+            Atoms from decay, ... x nuclides
+        energy_bins : list of float
+            Edges of the energy bins [eV]
+
+        Returns:
+        -------
+        numpy.ndarray
+            Photons per second, ... x bins
+        """
+        # The chain's photon sources are already emission rates per atom [photons/s], with the decay constant in them
+        photons_per_atom = np.zeros((len(self.nuclides), len(energy_bins) - 1))
+        for i, source in enumerate(self.photon_sources):
+            if source is not None:
+                photons_per_atom[i] = _binned_emission_rate(source, np.asarray(energy_bins))
+        return atoms @ photons_per_atom
+
+def _decay_reachable(chain, nuclides):
+    """Every nuclide in the chain that the given nuclides can turn into by decay, including themselves"""
+    reachable = set()
+    to_visit = [name for name in nuclides if name in chain]
+    while len(to_visit) > 0:
+        name = to_visit.pop()
+        if name in reachable:
+            continue
+        reachable.add(name)
+        for decay_type, target, _ in chain[name].decay_modes:
+            if target is not None and target in chain:
+                to_visit.append(target)
+            if 'alpha' in decay_type and 'He4' in chain:
+                to_visit.append('He4')
+            elif 'p' in decay_type and 'H1' in chain:
+                to_visit.append('H1')
+    # Keep the chain order, so the matrix is in the same order as openmc's
+    return [nuclide.name for nuclide in chain.nuclides if nuclide.name in reachable]
+
+def _binned_emission_rate(distribution, energy_bins):
+    """Emission rate per atom [photons/s] of a decay photon source in each energy bin"""
+    if isinstance(distribution, openmc.stats.Discrete):
+        return np.histogram(distribution.x, energy_bins, weights=distribution.p)[0]
+    if isinstance(distribution, openmc.stats.Tabular):
+        x, p = np.asarray(distribution.x), np.asarray(distribution.p)
+        if distribution.interpolation == 'histogram':
+            cumulative = np.concatenate([[0], np.cumsum(p[:-1] * np.diff(x))])
+        else:
+            cumulative = np.concatenate([[0], np.cumsum(0.5 * (p[:-1] + p[1:]) * np.diff(x))])
+        return np.diff(np.interp(energy_bins, x, cumulative))
+    if isinstance(distribution, openmc.stats.Mixture):
+        return sum(probability * _binned_emission_rate(component, energy_bins)
+                   for probability, component in zip(distribution.probability, distribution.distribution))
+    warnings.warn(f"Can't bin a {type(distribution).__name__} photon distribution, leaving it out")
+    return np.zeros(len(energy_bins) - 1)
@@ -0,0 +1,148 @@
+import os
+import h5py
+import hashlib
+import functools
+import numpy as np
+from pathlib import Path
+import xml.etree.ElementTree as ET
+import openmc
+import openmc.deplete
+
+from barc_blanket.utilities import CACHE_DIRECTORY, CHAIN_FILE, config_hash, model_hash
+
+# Fluxes and microscopic cross sections of every model that has been run through get_microxs_and_flux,
+# so activation and depletion runs on the same model never repeat the transport
+FLUX_CACHE_FILE = CACHE_DIRECTORY / 'flux_microxs.h5'
+
+def depletable_cells(model:openmc.Model):
+    """Every cell of a model filled with a depletable material
+
+    Parameters:
+    ----------
+    model : openmc.Model
+        Model to look in
+
+    Returns:
+    -------
+    list of openmc.Cell
+    """
+    return [cell for cell in model.geometry.get_all_material_cells().values() if cell.fill.depletable]
+
+def flux_cache_key(model:openmc.Model, energies=None):
+    """Key of a model's entry in the cache, from what the model physically is, how it is run
+    (so a quick or multi-group run doesn't stand in for a production one),
+    the energy groups and the contents of the depletion chain the cross sections are for"""
+    settings = model.settings
+    return config_hash({'model': model_hash(model),
+                        'particles': settings.particles,
+                        'batches': settings.batches,
+                        'source': [ET.tostring(source.to_xml_element()).decode() for source in settings.source],
+                        'energy_mode': settings.energy_mode,
+                        'energies': energies,
+                        'chain': chain_hash(CHAIN_FILE)})
+
+def chain_hash(chain_file):
+    """Hash of the contents of a depletion chain file"""
+    path = Path(chain_file).resolve()
+    return _file_hash(path, os.path.getmtime(path))
+
+@functools.lru_cache()
+def _file_hash(path, modified_time):
+    """Hash of a file, remembered until it is modified"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+def cached_flux_and_microxs(model:openmc.Model, energies=None, cache_file=FLUX_CACHE_FILE):
+    """Look up the fluxes and microscopic cross sections already calculated for a model
+
+    Parameters:
+    ----------
+    model : openmc.Model
+        Model to look up
+    energies : str or list of float, optional
+        Energy groups, as passed to get_microxs_and_flux. Default is one group.
+    cache_file : path-like, optional
+        Cache to look in. Default = FLUX_CACHE_FILE
+
+    Returns:
+    -------
+    dict
+        Cell name to (flux [n-cm/source particle], openmc.deplete.MicroXS) for every cell in the cache.
+        Empty if the model hasn't been run.
+    """
+
+    key = flux_cache_key(model, energies)
+    cache_file = Path(cache_file)
+    if not cache_file.exists():
+        return {}
+
+    cached = {}
+    with h5py.File(cache_file, 'r') as f:
+        if key not in f:
+            return {}
+        for cell_name, group in f[key].items():
+            micro = openmc.deplete.MicroXS(group['microxs'][()],
+                                           [nuclide.decode() for nuclide in group.attrs['nuclides']],
+                                           [reaction.decode() for reaction in group.attrs['reactions']])
+            cached[cell_name] = (group['flux'][()], micro)
+    return cached
+
+def flux_and_microxs(model:openmc.Model, cells=None, energies=None, run_kwargs=None, use_cache=True, cache_file=FLUX_CACHE_FILE):
+    """Get the flux and microscopic cross sections in cells of a model, from the cache if they have been calculated before.
+    Otherwise transport is run with get_microxs_and_flux for the cells that are missing and the results are cached.
+
+    Parameters:
+    ----------
+    model : openmc.Model
+        Model to get the fluxes and cross sections of
+    cells : list of openmc.Cell, optional
+        Cells to get them for. Default is every depletable cell.
+    energies : str or list of float, optional
+        Energy groups, passed to get_microxs_and_flux. Default is one group.
+    run_kwargs : dict, optional
+        Passed to model.run if transport has to be run
+    use_cache : bool, optional
+        Whether to look in and add to the cache. Default = True
+    cache_file : path-like, optional
+        Cache to use. Default = FLUX_CACHE_FILE
+
+    Returns:
+    -------
+    fluxes : list of numpy.ndarray
+        Group fluxes of each cell [n-cm/source particle]
+    micros : list of openmc.deplete.MicroXS
+        Microscopic cross sections of each cell
+    """
+
+    if cells is None:
+        cells = depletable_cells(model)
+
+    cached = cached_flux_and_microxs(model, energies, cache_file) if use_cache else {}
+    missing = [cell for cell in cells if cell.name not in cached]
+
+    if len(missing) > 0:
+        print(f"Running transport for the flux and cross sections of {', '.join(cell.name for cell in missing)}")
+        fluxes, micros = openmc.deplete.get_microxs_and_flux(model, missing, energies=energies, run_kwargs=run_kwargs)
+        for cell, flux, micro in zip(missing, fluxes, micros):
+            cached[cell.name] = (flux, micro)
+        if use_cache:
+            _save(flux_cache_key(model, energies), missing, fluxes, micros, cache_file)
+
+    fluxes = [cached[cell.name][0] for cell in cells]
+    micros = [cached[cell.name][1] for cell in cells]
+    return fluxes, micros
+
+def _save(key, cells, fluxes, micros, cache_file):
+    """Add the fluxes and cross sections of cells to the cache"""
+    cache_file = Path(cache_file)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with h5py.File(cache_file, 'a') as f:
+        model_group = f.require_group(key)
+        for cell, flux, micro in zip(cells, fluxes, micros):
+            if cell.name in model_group:
+                del model_group[cell.name]
+            group = model_group.create_group(cell.name)
+            group.create_dataset('flux', data=np.asarray(flux))
+            group.create_dataset('microxs', data=micro.data)
+            group.attrs['nuclides'] = np.array(micro.nuclides, dtype='S')
+            group.attrs['reactions'] = np.array(micro.reactions, dtype='S')
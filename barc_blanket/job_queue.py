@@ -0,0 +1,321 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+
+from barc_blanket.utilities import config_hash
+
+# Default place to keep the queue, in the directory the campaign is run from
+QUEUE_FILE = "job_queue.sqlite"
+
+STATUSES = ['pending', 'running', 'done', 'failed']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    command TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    config TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    outputs TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_retries INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    return_code INTEGER,
+    cpu_time REAL,
+    max_memory INTEGER,
+    log TEXT
+);
+CREATE TABLE IF NOT EXISTS dependencies (
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    depends_on INTEGER NOT NULL REFERENCES jobs(id),
+    PRIMARY KEY (job_id, depends_on)
+);
+"""
+
+class JobQueue:
+    """Queue of simulation jobs kept in a SQLite file, so any number of local workers
+    (threads or separate processes) can pull jobs from it at the same time.
+
+    A job is a command run in its own directory, e.g. `python run_all_cases.py --case pure_flibe`.
+    For every job the queue records its config hash, status, start and end times,
+    CPU time and peak memory, log file and output files.
+    Failed jobs are retried up to max_retries times, and a job only starts once
+    every job it depends on is done (e.g. activation -> decay -> dose).
+    """
+
+    def __init__(self, path=QUEUE_FILE):
+        self.path = Path(path).resolve()
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit, so claiming a job can take the write lock itself with BEGIN IMMEDIATE
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            yield connection
+        finally:
+            # Closing rolls back anything that wasn't committed
+            connection.close()
+
+    def submit(self, name, command, directory='.', config=None, outputs=(), depends_on=(), max_retries=0):
+        """Add a job to the queue.
+        If the same job (command, directory and config) was already submitted and hasn't failed,
+        its id is returned instead, so a campaign script can be rerun without duplicating work.
+
+        Parameters:
+        ----------
+        name : str
+            Short description to show in the status table
+        command : list of str
+            Command to run, e.g. ['python', 'run_all_cases.py', '--case', 'pure_flibe']
+        directory : str, optional
+            Directory to run the command in, relative to where the worker is started. Default is '.'
+        config : dict, optional
+            JSON-serializable configuration the job runs, recorded and included in the hash
+        outputs : list of str, optional
+            Files (relative to directory) the job must produce to count as done
+        depends_on : list of int, optional
+            Ids of jobs that must be done before this one starts
+        max_retries : int, optional
+            Number of times to rerun the job if it fails. Default = 0
+
+        Returns:
+        -------
+        int
+            Id of the job
+        """
+
+        if config is None:
+            config = {}
+        command = [str(argument) for argument in command]
+        job_hash = config_hash({'command': command, 'directory': str(directory), 'config': config})
+
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            existing = connection.execute("SELECT id FROM jobs WHERE config_hash = ? AND status != 'failed'", (job_hash,)).fetchone()
+            if existing is not None:
+                connection.execute("COMMIT")
+                return existing['id']
+
+            for dependency in depends_on:
+                if connection.execute("SELECT id FROM jobs WHERE id = ?", (dependency,)).fetchone() is None:
+                    connection.execute("ROLLBACK")
+                    raise ValueError(f"Job {name} depends on job {dependency}, which doesn't exist")
+
+            cursor = connection.execute(
+                "INSERT INTO jobs (name, command, directory, config, config_hash, outputs, max_retries, submitted) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, json.dumps(command), str(directory), json.dumps(config), job_hash, json.dumps(list(outputs)), max_retries, time.time()))
+            job_id = cursor.lastrowid
+            connection.executemany("INSERT INTO dependencies (job_id, depends_on) VALUES (?, ?)",
+                                   [(job_id, dependency) for dependency in depends_on])
+            connection.execute("COMMIT")
+
+        return job_id
+
+    def claim(self, worker):
+        """Mark the oldest pending job whose dependencies are all done as running
+
+        Parameters:
+        ----------
+        worker : str
+            Name of the worker taking the job
+
+        Returns:
+        -------
+        sqlite3.Row or None
+            The job, or None if nothing can be started right now
+        """
+
+        with self._connect() as connection:
+            # Take the write lock before looking, so two workers can't claim the same job
+            connection.execute("BEGIN IMMEDIATE")
+            job = connection.execute("""
+                SELECT * FROM jobs WHERE status = 'pending' AND NOT EXISTS (
+                    SELECT 1 FROM dependencies JOIN jobs AS dependency ON dependency.id = dependencies.depends_on
+                    WHERE dependencies.job_id = jobs.id AND dependency.status != 'done')
+                ORDER BY id LIMIT 1""").fetchone()
+            if job is not None:
+                connection.execute("UPDATE jobs SET status = 'running', worker = ?, started = ?, finished = NULL WHERE id = ?",
+                                   (worker, time.time(), job['id']))
+            connection.execute("COMMIT")
+
+        return job
+
+    def finish(self, job_id, return_code, cpu_time=None, max_memory=None, log=None):
+        """Record the result of a job. Failed jobs go back in the queue if they have retries left."""
+
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            job = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            attempts = job['attempts'] + 1
+            if return_code == 0:
+                status = 'done'
+            elif attempts <= job['max_retries']:
+                status = 'pending'
+            else:
+                status = 'failed'
+            connection.execute("""UPDATE jobs SET status = ?, attempts = ?, finished = ?, return_code = ?, cpu_time = ?, max_memory = ?, log = ?
+                                  WHERE id = ?""",
+                               (status, attempts, time.time(), return_code, cpu_time, max_memory, log, job_id))
+            connection.execute("COMMIT")
+
+        return status
+
+    def retry(self, job_id):
+        """Put a failed job back in the queue with a fresh set of retries"""
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET status = 'pending', attempts = 0 WHERE id = ? AND status = 'failed'", (job_id,))
+
+    def requeue_dead(self):
+        """Put jobs back in the queue whose worker process on this machine is gone, e.g. after a crash or reboot
+
+        Returns:
+        -------
+        int
+            Number of jobs put back
+        """
+
+        hostname = socket.gethostname()
+        requeued = 0
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for job in connection.execute("SELECT id, worker FROM jobs WHERE status = 'running'").fetchall():
+                # Only workers named the default way can be checked
+                worker_parts = job['worker'].split(':')
+                if len(worker_parts) != 3 or worker_parts[0] != hostname or _process_alive(int(worker_parts[1])):
+                    continue
+                connection.execute("UPDATE jobs SET status = 'pending', worker = NULL WHERE id = ?", (job['id'],))
+                requeued += 1
+            connection.execute("COMMIT")
+
+        return requeued
+
+    def jobs(self, status=None):
+        """Get every job in the queue, optionally only those with a given status, as a list of dicts"""
+        with self._connect() as connection:
+            if status is None:
+                rows = connection.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+            else:
+                rows = connection.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,)).fetchall()
+            dependencies = connection.execute("SELECT job_id, depends_on FROM dependencies").fetchall()
+
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            for key in ['command', 'config', 'outputs']:
+                job[key] = json.loads(job[key])
+            job['depends_on'] = [dependency['depends_on'] for dependency in dependencies if dependency['job_id'] == job['id']]
+            jobs.append(job)
+        return jobs
+
+    def run_job(self, job, worker, threads=None):
+        """Run a claimed job in its directory, logging to job_<id>.log there, and record the result
+
+        Returns:
+        -------
+        str
+            New status of the job
+        """
+
+        directory = Path(job['directory'])
+        directory.mkdir(parents=True, exist_ok=True)
+        log_path = directory / f"job_{job['id']}.log"
+        environment = dict(os.environ)
+        if threads is not None:
+            environment['OMP_NUM_THREADS'] = str(threads)
+
+        print(f"[{worker}] Starting job {job['id']} ({job['name']})")
+        with open(log_path, 'a') as log:
+            process = subprocess.Popen(json.loads(job['command']), cwd=directory, stdout=log, stderr=subprocess.STDOUT, env=environment)
+            # wait4 gives the resource usage of just this job
+            _, exit_status, rusage = os.wait4(process.pid, 0)
+        return_code = os.waitstatus_to_exitcode(exit_status)
+
+        missing = [output for output in json.loads(job['outputs']) if not (directory / output).exists()]
+        if return_code == 0 and len(missing) > 0:
+            print(f"[{worker}] Job {job['id']} ({job['name']}) didn't produce {', '.join(missing)}")
+            return_code = -1
+
+        status = self.finish(job['id'], return_code,
+                             cpu_time=rusage.ru_utime + rusage.ru_stime,
+                             max_memory=rusage.ru_maxrss * 1024, # ru_maxrss is in kB on Linux
+                             log=str(log_path.resolve()))
+        print(f"[{worker}] Job {job['id']} ({job['name']}) {status}")
+        return status
+
+    def work(self, worker=None, threads=None, poll_interval=10):
+        """Run jobs until there are none left that can be started.
+        While other workers are still running jobs, keep waiting in case they unblock something.
+
+        Parameters:
+        ----------
+        worker : str, optional
+            Name of this worker. Default is made from the hostname, process id and thread.
+        threads : int, optional
+            OpenMP threads for each job. Default leaves OMP_NUM_THREADS as it is.
+        poll_interval : float, optional
+            Seconds between checks for new jobs while waiting on other workers. Default = 10
+        """
+
+        if worker is None:
+            worker = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+        while True:
+            job = self.claim(worker)
+            if job is not None:
+                self.run_job(job, worker, threads)
+                continue
+            if len(self.jobs('running')) == 0:
+                return
+            time.sleep(poll_interval)
+
+def run_workers(queue_path=QUEUE_FILE, workers=1, threads=None):
+    """Work through a queue with several workers in this process, each running one job at a time
+
+    Parameters:
+    ----------
+    queue_path : str, optional
+        Path to the queue file. Default = QUEUE_FILE
+    workers : int, optional
+        Number of jobs to run at the same time. Default = 1
+    threads : int, optional
+        OpenMP threads for each job. Default splits the cores evenly between the workers.
+    """
+
+    if threads is None:
+        threads = max(os.cpu_count() // workers, 1)
+
+    queue = JobQueue(queue_path)
+    requeued = queue.requeue_dead()
+    if requeued > 0:
+        print(f"Put {requeued} jobs from dead workers back in the queue")
+
+    worker_threads = [threading.Thread(target=queue.work, kwargs={'threads': threads}) for _ in range(workers)]
+    for worker_thread in worker_threads:
+        worker_thread.start()
+    for worker_thread in worker_threads:
+        worker_thread.join()
+
+def _process_alive(pid):
+    """Check if a process with this id is running on this machine"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
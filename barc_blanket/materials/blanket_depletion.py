@@ -1,10 +1,22 @@
+import os
+import json
+import shutil
 import numpy as np
 import pickle as pkl
 import matplotlib.pyplot as plt
 
+import openmc
+import openmc.data
 import openmc.deplete
-from barc_blanket.materials.waste_classification import sum_of_fractions, remove_flibe, remove_tritium
-from barc_blanket.models.barc_model_final import SECTION_CORRECTION
+from openmc.deplete.cram import CRAM48
+from barc_blanket.materials.waste_classification import sum_of_fractions, remove_flibe, remove_tritium, vitrification_waste_loading
+from barc_blanket.models.barc_model_final import SECTION_CORRECTION, model_section_correction
+from barc_blanket.utilities import model_hash, CROSS_SECTIONS, CHAIN_FILE
+from barc_blanket.flux_cache import flux_and_microxs
+
+RESULTS_FILE = "depletion_results.h5"
+# What the results in RESULTS_FILE were run for, so a restart can check it is continuing the same run
+STATE_FILE = "depletion_state.json"
 
 def gw_to_neutron_rate(gw, section_correction=SECTION_CORRECTION):
     """Convert GW of fusion power to neutron rate in n/s
@@ -15,7 +27,8 @@ def gw_to_neutron_rate(gw, section_correction=SECTION_CORRECTION):
         Fusion power in GW
     section_correction : float, optional
         Fraction of total torus that the section takes up to adjust total neutron rate.
-        Default is using the section correction from barc_model_final.py
+        Default is the default section of barc_model_final.py. Use section_correction(model_config)
+        or model_section_correction(model) for other section angles.
     """
 
     efus = 17.6e6  # eV
@@ -28,6 +41,10 @@ def run_coupled_depletion(model, timesteps_years, fusion_power):
     """ Run coupled depletion for a given model and timesteps
     Results are saved in 'depletion_results.h5' file in whatever directory called this function
 
+    If the directory already has results from an earlier run of the same model and timesteps
+    that was stopped part way, depletion continues from the last completed step.
+    If every step is already done, nothing is run.
+
     Parameters
     ----------
     model : openmc.model.Model
@@ -40,14 +57,580 @@ def run_coupled_depletion(model, timesteps_years, fusion_power):
 
     timesteps_days = np.array(timesteps_years) * 365  # convert to days
 
-    source_rates = np.ones_like(timesteps_years) * gw_to_neutron_rate(fusion_power)
+    source_rates = np.ones_like(timesteps_days) * gw_to_neutron_rate(fusion_power, model_section_correction(model))
 
-    op = openmc.deplete.CoupledOperator(model, 
-                                    reduce_chain=True, 
-                                    reduce_chain_level=5, 
-                                    normalization_mode='source-rate')
-    
-    openmc.deplete.CECMIntegrator(op, timesteps_days, source_rates=source_rates, timestep_units='d').integrate()
+    completed_steps, prev_results = _previous_depletion(model, timesteps_days, source_rates)
+    if completed_steps == len(timesteps_days):
+        print(f"All {completed_steps} depletion steps are already in {RESULTS_FILE}, skipping")
+        return
+    if completed_steps > 0:
+        print(f"Resuming depletion from step {completed_steps} of {len(timesteps_days)}")
+
+    _write_state(model, 'coupled', timesteps_days, source_rates)
+
+    # Integrate one step at a time so the results file always ends on a finished step that can be restarted from.
+    # The end of step transport is reused at the start of the next step, so this doesn't cost any extra transport runs.
+    for step in range(completed_steps, len(timesteps_days)):
+        if prev_results is not None:
+            # The first thing a restart does is overwrite the last result, so keep a copy in case it dies part way
+            shutil.copy(RESULTS_FILE, f"{RESULTS_FILE}.bak")
+
+        op = openmc.deplete.CoupledOperator(model,
+                                        prev_results=prev_results,
+                                        reduce_chain=True,
+                                        reduce_chain_level=5,
+                                        normalization_mode='source-rate')
+
+        openmc.deplete.CECMIntegrator(op, timesteps_days[step:step+1], source_rates=source_rates[step:step+1], timestep_units='d').integrate()
+
+        prev_results = openmc.deplete.Results(RESULTS_FILE)
+
+    if os.path.exists(f"{RESULTS_FILE}.bak"):
+        os.remove(f"{RESULTS_FILE}.bak")
+
+def run_independent_depletion(model, timesteps_years, fusion_power, drift_threshold=0.02, tracked_nuclides=('Li6',), run_kwargs=None):
+    """ Faster alternative to run_coupled_depletion that only runs transport when the compositions have changed enough to matter.
+    The flux and microscopic cross sections of every depletable cell come from get_microxs_and_flux
+    (through barc_blanket.flux_cache, so a rerun of the same case doesn't repeat any transport),
+    and each step is depleted with an IndependentOperator using the most recent ones.
+    After every step the compositions are compared to the ones the transport was run with,
+    and transport is only rerun once the drift (see composition_drift) is over drift_threshold.
+    Results are saved in 'depletion_results.h5' file in whatever directory called this function.
+    Earlier results of this function there are overwritten, but not ones from the other depletion methods.
+
+    Parameters
+    ----------
+    model : openmc.model.Model
+        Model to run depletion for
+    timesteps_years : numpy.ndarray
+        Array of timesteps to run depletion for (in years)
+    fusion_power : float
+        Fusion power in GW
+    drift_threshold : float, optional
+        Relative change in the tracked nuclides or reaction rate that triggers a new transport run. Default = 0.02
+    tracked_nuclides : list of str, optional
+        Nuclides whose depletion is watched. Default is Li6, which sets the tritium breeding.
+    run_kwargs : dict, optional
+        Passed on to model.run for each transport run, e.g. {'threads': 16}
+
+    Returns
+    -------
+    transport_steps : list of int
+        The steps before which transport was run
+    """
+
+    timesteps_days = np.array(timesteps_years) * 365  # convert to days
+
+    source_rates = np.ones_like(timesteps_days) * gw_to_neutron_rate(fusion_power, model_section_correction(model))
+
+    cells = [cell for cell in model.geometry.get_all_material_cells().values() if cell.fill.depletable]
+    materials = openmc.Materials([cell.fill for cell in cells])
+
+    # Depleted materials have nuclides with no cross sections, which have to be left out of transport
+    library = openmc.data.DataLibrary.from_xml(CROSS_SECTIONS)
+    transport_nuclides = {name for entry in library.libraries if entry['type'] == 'neutron' for name in entry['materials']}
+
+    if os.path.exists(RESULTS_FILE):
+        # Always starts over, but don't throw away a coupled run
+        _read_state(model, 'independent')
+    _write_state(model, 'independent', timesteps_days, source_rates)
+
+    prev_results = None
+    drift = np.inf
+    transport_steps = []
+    try:
+        for step in range(len(timesteps_days)):
+            if drift > drift_threshold:
+                if prev_results is not None:
+                    for cell, material in zip(cells, materials):
+                        cell.fill = _transport_material(prev_results[-1].get_material(str(material.id)), material, transport_nuclides)
+                fluxes, micros = flux_and_microxs(model, cells, run_kwargs=run_kwargs)
+                reference = [cell.fill.get_nuclide_atom_densities() for cell in cells]
+                transport_steps.append(step)
+                print(f"Ran transport before step {step}")
+
+            op = openmc.deplete.IndependentOperator(materials,
+                                                    fluxes,
+                                                    micros,
+                                                    prev_results=prev_results,
+                                                    normalization_mode='source-rate',
+                                                    reduce_chain=True,
+                                                    reduce_chain_level=5)
+
+            # The flux and cross sections are fixed within a step, so predictor is all that's needed
+            openmc.deplete.PredictorIntegrator(op, timesteps_days[step:step+1], source_rates=source_rates[step:step+1], timestep_units='d').integrate()
+
+            prev_results = openmc.deplete.Results(RESULTS_FILE)
+            current = [prev_results[-1].get_material(str(material.id)).get_nuclide_atom_densities() for material in materials]
+            drift = composition_drift(reference, current, fluxes, micros, tracked_nuclides)
+    finally:
+        # Put the original materials back in the model
+        for cell, material in zip(cells, materials):
+            cell.fill = material
+
+    print(f"Ran transport {len(transport_steps)} times for {len(timesteps_days)} steps")
+    return transport_steps
+
+def deplete_ensemble(compositions, flux, micro, timesteps_years, flux_scales=None, chain_file=CHAIN_FILE):
+    """ Deplete many variants of a material together, e.g. a sweep over slurry ratio or Li6 enrichment,
+    when they all see (nearly) the same flux and cross sections.
+    Members with the same flux scale share one burnup matrix, and all of them are depleted
+    with one CRAM48 solve per timestep, so a whole sweep costs about as much as a single material.
+
+    The flux and cross sections can come from barc_blanket.flux_cache.flux_and_microxs for one cell of the
+    reference design, with the flux converted to n/cm2-s by multiplying by the source rate and dividing by the cell volume.
+
+    Parameters
+    ----------
+    compositions : list of dict or openmc.Material
+        Starting atoms of each nuclide in each member, or materials with their volumes set
+    flux : numpy.ndarray
+        Group flux [n/cm2-s]
+    micro : openmc.deplete.MicroXS
+        Microscopic cross sections in the same groups
+    timesteps_years : numpy.ndarray
+        Array of timesteps to deplete for (in years)
+    flux_scales : list of float, optional
+        Multiplier on the flux of each member, e.g. to account for self-shielding. Default is 1 for all.
+    chain_file : str, optional
+        Depletion chain. Default is CHAIN_FILE. It is reduced to 5 levels below the starting nuclides, like the other depletion runs.
+        Starting nuclides that aren't in the chain are left out of the results.
+
+    Returns
+    -------
+    atoms : numpy.ndarray
+        Atoms of each nuclide, members x (timesteps + 1) x nuclides, starting with the initial compositions
+    nuclides : list of str
+        Names of the nuclides in the last axis of atoms
+    """
+
+    if flux_scales is None:
+        flux_scales = np.ones(len(compositions))
+    flux_scales = np.asarray(flux_scales, dtype=float)
+    if len(flux_scales) != len(compositions):
+        raise ValueError(f"Got {len(flux_scales)} flux scales for {len(compositions)} compositions")
+
+    compositions = [composition.get_nuclide_atoms() if isinstance(composition, openmc.Material) else composition
+                    for composition in compositions]
+    # Chain.reduce fails on nuclides it doesn't know, so leave out anything that isn't in the chain (it can't deplete anyway)
+    full_chain = openmc.deplete.Chain.from_xml(chain_file)
+    initial_nuclides = sorted(nuclide for nuclide in set().union(*compositions) if nuclide in full_chain)
+    chain = full_chain.reduce(initial_nuclides, 5)
+    nuclides = [nuclide.name for nuclide in chain.nuclides]
+
+    timesteps_seconds = np.array(timesteps_years) * 365 * 24 * 3600
+    atoms = np.zeros((len(compositions), len(timesteps_seconds) + 1, len(nuclides)))
+    for member, composition in enumerate(compositions):
+        for nuclide, count in composition.items():
+            if nuclide in chain.nuclide_dict:
+                atoms[member, 0, chain.nuclide_dict[nuclide]] = count
+
+    # One group reaction rates per atom [1/s] at a flux scale of 1
+    rates = openmc.deplete.ReactionRates(['0'], nuclides, chain.reactions)
+    one_group = (micro.data @ flux) * 1e-24 # barns to cm2
+    for i, nuclide in enumerate(micro.nuclides):
+        if nuclide not in rates.index_nuc:
+            continue
+        for j, reaction in enumerate(micro.reactions):
+            if reaction in rates.index_rx:
+                rates[0, rates.index_nuc[nuclide], rates.index_rx[reaction]] = one_group[i, j]
+
+    for flux_scale in np.unique(flux_scales):
+        members = np.flatnonzero(flux_scales == flux_scale)
+        matrix = chain.form_matrix(rates[0] * flux_scale)
+        for step, dt in enumerate(timesteps_seconds):
+            # Every member is a column of the right hand side
+            atoms[members, step + 1] = CRAM48(matrix, atoms[members, step].T, dt).T
+
+    return atoms, nuclides
+
+def composition_drift(reference, current, fluxes, micros, tracked_nuclides=('Li6',)):
+    """ How much the compositions have changed since transport was run, in terms of what the depletion sees:
+    the relative change in the atom density of each tracked nuclide,
+    and in the total reaction rate from the one group flux and cross sections of each material.
+
+    Parameters
+    ----------
+    reference : list of dict
+        Atom densities of each material [atom/b-cm] when transport was run
+    current : list of dict
+        Atom densities of each material now
+    fluxes : list of numpy.ndarray
+        Group fluxes of each material, from get_microxs_and_flux
+    micros : list of openmc.deplete.MicroXS
+        Microscopic cross sections of each material, from get_microxs_and_flux
+    tracked_nuclides : list of str, optional
+        Nuclides to watch. Default is Li6.
+
+    Returns
+    -------
+    float
+        Largest relative change in any material
+    """
+
+    drift = 0.0
+    for reference_densities, current_densities, flux, micro in zip(reference, current, fluxes, micros):
+        for nuclide in tracked_nuclides:
+            if reference_densities.get(nuclide, 0) > 0:
+                drift = max(drift, abs(current_densities.get(nuclide, 0) / reference_densities[nuclide] - 1))
+
+        reference_rate = _reaction_rate(reference_densities, flux, micro)
+        if reference_rate > 0:
+            drift = max(drift, abs(_reaction_rate(current_densities, flux, micro) / reference_rate - 1))
+
+    return drift
+
+def _reaction_rate(densities, flux, micro):
+    """Total rate of every reaction in the cross sections, per unit volume and source particle"""
+    # micro.data is nuclide x reaction x group
+    return sum(densities.get(nuclide, 0) * np.sum(micro.data[i] @ flux) for i, nuclide in enumerate(micro.nuclides))
+
+def _transport_material(depleted, original, transport_nuclides):
+    """Get a depleted material ready for transport, removing the nuclides without cross sections
+    and giving it back the temperature and S(a,b) tables of the original, which the results don't keep"""
+    for nuclide in depleted.get_nuclides():
+        if nuclide not in transport_nuclides:
+            depleted.remove_nuclide(nuclide)
+    depleted.temperature = original.temperature
+    for name, fraction in original._sab:
+        depleted.add_s_alpha_beta(name, fraction)
+    return depleted
+
+def run_adaptive_depletion(model, end_time_years, fusion_power, tolerance=1e-3, first_step_days=1.0, max_step_years=10,
+                           min_step_days=0.01, max_rejections=5, tracked_nuclides=('Li6', 'H3', 'C14', 'Tc99'), atol=1e-12):
+    """ Run coupled depletion to an end time, choosing the timesteps so the error in each step stays under a tolerance.
+    Short steps are taken while the compositions change quickly (e.g. at the start, as short lived nuclides build up)
+    and long ones once they settle, instead of a fixed list of timesteps.
+
+    Each step is integrated with CE/LI, which first depletes with the reaction rates at the start of the step (the predictor)
+    and then again with the rates interpolated to the end of the step (the corrector).
+    The relative difference between them in the tracked nuclides estimates the error of the step.
+    A step with too much error is thrown away and retried shorter, and the next step is grown or shrunk to aim for the tolerance.
+    Each try costs two transport runs. The statistical noise in the reaction rates shows up in the error whatever the step,
+    so a tolerance below the noise can't be met. The run stops with an error once a step at min_step_days
+    or max_rejections tries in a row are rejected.
+    Results are saved in 'depletion_results.h5' file in whatever directory called this function,
+    and a run that was stopped part way continues from the last accepted step.
+
+    Parameters
+    ----------
+    model : openmc.model.Model
+        Model to run depletion for
+    end_time_years : float
+        Time to deplete to (in years)
+    fusion_power : float
+        Fusion power in GW
+    tolerance : float, optional
+        Largest relative difference between predictor and corrector allowed in a step. Default = 1e-3
+    first_step_days : float, optional
+        Length of the first step to try (in days). Default = 1
+    max_step_years : float, optional
+        Longest step allowed (in years). Default = 10
+    min_step_days : float, optional
+        Shortest step allowed (in days). Default = 0.01
+    max_rejections : int, optional
+        Number of rejected tries of one step to give up after. Default = 5
+    tracked_nuclides : list of str, optional
+        Nuclides whose error is controlled. Default is Li6 (breeding), H3, C14 and Tc99.
+    atol : float, optional
+        Differences smaller than this fraction of a material's atoms are ignored, see step_error. Default = 1e-12
+
+    Returns
+    -------
+    timesteps_days : numpy.ndarray
+        The accepted timesteps (in days)
+    """
+
+    end_time_days = end_time_years * 365
+    max_step_days = max_step_years * 365
+    source_rate = gw_to_neutron_rate(fusion_power, model_section_correction(model))
+
+    prev_results, timesteps_days = _previous_adaptive_depletion(model, end_time_days, source_rate, tolerance)
+    time_days = np.sum(timesteps_days)
+    if len(timesteps_days) > 0:
+        print(f"Resuming adaptive depletion at {time_days:0.1f} of {end_time_days:0.1f} days")
+    else:
+        # Written before the first step, so a run stopped during it can still be matched to this model
+        _write_state(model, 'adaptive', [], [], end_time_days=end_time_days, tolerance=tolerance)
+
+    step_days = max(first_step_days, min_step_days)
+    rejections = 0
+    while time_days < end_time_days * (1 - 1e-9):
+        step_days = min(step_days, max_step_days, end_time_days - time_days)
+        if prev_results is not None:
+            shutil.copy(RESULTS_FILE, f"{RESULTS_FILE}.bak")
+
+        op = openmc.deplete.CoupledOperator(model,
+                                        prev_results=prev_results,
+                                        reduce_chain=True,
+                                        reduce_chain_level=5,
+                                        normalization_mode='source-rate')
+
+        openmc.deplete.CELIIntegrator(op, [step_days], source_rates=[source_rate], timestep_units='d').integrate()
+
+        results = openmc.deplete.Results(RESULTS_FILE)
+        # The step keeps its start and predictor compositions, the corrector is the start of the final result
+        error = step_error(results[-2].data[1], results[-1].data[0], results[-1].index_nuc, tracked_nuclides, atol)
+
+        if error > tolerance:
+            print(f"Rejected a {step_days:0.3g} day step at {time_days:0.1f} days with error {error:0.2e}")
+            # Go back to the end of the last accepted step first, so the results can be continued even if we give up here
+            if prev_results is not None:
+                shutil.copy(f"{RESULTS_FILE}.bak", RESULTS_FILE)
+            else:
+                os.remove(RESULTS_FILE)
+
+        accepted, next_step_days = control_step(step_days, error, tolerance, min_step_days)
+        if not accepted:
+            rejections += 1
+            if rejections >= max_rejections:
+                raise RuntimeError(f"{rejections} tries in a row at {time_days:0.1f} days had more than {tolerance} error, "
+                                   "the tolerance may be below the statistical noise in the reaction rates")
+            step_days = next_step_days
+            continue
+
+        print(f"Accepted a {step_days:0.3g} day step at {time_days:0.1f} days with error {error:0.2e}")
+        time_days += step_days
+        timesteps_days.append(step_days)
+        _write_state(model, 'adaptive', timesteps_days, [source_rate] * len(timesteps_days),
+                     end_time_days=end_time_days, tolerance=tolerance)
+        prev_results = results
+        rejections = 0
+        step_days = next_step_days
+
+    if os.path.exists(f"{RESULTS_FILE}.bak"):
+        os.remove(f"{RESULTS_FILE}.bak")
+
+    print(f"Depleted to {end_time_days:0.1f} days in {len(timesteps_days)} steps")
+    return np.array(timesteps_days)
+
+def control_step(step_days, error, tolerance, min_step_days=0.01):
+    """Decide whether to keep a step of run_adaptive_depletion and how long to make the next try
+
+    Parameters
+    ----------
+    step_days : float
+        Length of the step that was tried (in days)
+    error : float
+        Error of the step, from step_error
+    tolerance : float
+        Largest error allowed
+    min_step_days : float, optional
+        Shortest step allowed (in days). Default = 0.01
+
+    Returns
+    -------
+    accepted : bool
+        Whether the step is kept
+    next_step_days : float
+        Length of the next step (or the retry of this one) to try, no shorter than min_step_days
+    """
+
+    # CE/LI is second order, so the error goes as the step squared
+    if error > 0:
+        factor = min(max(0.9 * (tolerance / error)**0.5, 0.2), 4)
+    else:
+        factor = 4
+
+    accepted = error <= tolerance
+    if not accepted and step_days <= min_step_days:
+        raise RuntimeError(f"A step of the minimum {min_step_days} days has {error:0.2e} error, more than the tolerance of {tolerance}. "
+                           "The tolerance may be below the statistical noise in the reaction rates.")
+
+    return accepted, max(step_days * factor, min_step_days)
+
+def step_error(predictor, corrector, index_nuc, tracked_nuclides=('Li6', 'H3', 'C14', 'Tc99'), atol=1e-12):
+    """Relative difference between the predictor and corrector compositions at the end of a CE/LI step
+
+    Parameters
+    ----------
+    predictor : numpy.ndarray
+        Atoms of each nuclide in each material from the predictor, materials x nuclides
+    corrector : numpy.ndarray
+        Atoms from the corrector, in the same layout
+    index_nuc : dict
+        Nuclide name to its index in the last axis, e.g. StepResult.index_nuc
+    tracked_nuclides : list of str, optional
+        Nuclides to compare. Nuclides not in index_nuc are ignored.
+    atol : float, optional
+        Differences are compared to at least this fraction of all the atoms in the material,
+        so nuclides that have barely been made yet don't control the step. Default = 1e-12
+
+    Returns
+    -------
+    float
+        Largest relative difference in any tracked nuclide of any material
+    """
+
+    predictor = np.asarray(predictor)
+    corrector = np.asarray(corrector)
+    total_atoms = corrector.sum(axis=-1)
+
+    error = 0
+    for nuclide in tracked_nuclides:
+        if nuclide not in index_nuc:
+            continue
+        i = index_nuc[nuclide]
+        difference = np.abs(corrector[:, i] - predictor[:, i])
+        scale = np.maximum(np.abs(corrector[:, i]), atol * total_atoms)
+        relative_difference = np.divide(difference, scale, out=np.zeros_like(difference, dtype=float), where=scale > 0)
+        error = max(error, np.max(relative_difference, initial=0))
+    return error
+
+def _previous_adaptive_depletion(model, end_time_days, source_rate, tolerance):
+    """Find the steps of an adaptive depletion already accepted in the current directory
+    and check they were run for the same model, end time, source rate and tolerance
+
+    Returns
+    -------
+    prev_results : openmc.deplete.Results or None
+        Results to restart from, None if starting from the beginning
+    timesteps_days : list of float
+        Steps already accepted (in days)
+    """
+
+    if not os.path.exists(RESULTS_FILE):
+        return None, []
+
+    state = _read_state(model, 'adaptive')
+    if state.get('end_time_days') != end_time_days or state.get('tolerance') != tolerance:
+        raise ValueError(f"{RESULTS_FILE} wasn't run adaptively to the same end time and tolerance. Delete it or run in a different directory.")
+    if not np.allclose(state['source_rates'], source_rate):
+        raise ValueError(f"{RESULTS_FILE} was run with a different fusion power")
+
+    # The state is written after a step is accepted, so anything in the results past its steps
+    # was stopped part way or never checked. Throw it away and go back to the last accepted step.
+    timesteps_days = state['timesteps_days']
+    if len(timesteps_days) == 0:
+        print(f"{RESULTS_FILE} has no accepted steps, starting over")
+        os.remove(RESULTS_FILE)
+        return None, []
+
+    results = _load_results(RESULTS_FILE)
+    if results is None or len(results) == len(timesteps_days) + 2:
+        print(f"{RESULTS_FILE} has a step that wasn't accepted, going back to the last accepted step")
+        if _load_results(f"{RESULTS_FILE}.bak") is None:
+            raise ValueError(f"{RESULTS_FILE} doesn't end on an accepted step and there is no backup to restart from. Delete it to start over.")
+        shutil.copy(f"{RESULTS_FILE}.bak", RESULTS_FILE)
+        results = _load_results(RESULTS_FILE)
+
+    previous_timesteps_days = np.diff(results.get_times(time_units='d'))
+    if len(previous_timesteps_days) != len(timesteps_days) or not np.allclose(previous_timesteps_days, timesteps_days):
+        raise ValueError(f"The steps in {RESULTS_FILE} don't match the accepted steps in {STATE_FILE}. Delete them to start over.")
+    return results, list(timesteps_days)
+
+def depletion_complete(timesteps_years, directory='.', method='coupled'):
+    """Check if a directory already has the results of every requested depletion step,
+    e.g. to skip finished cases without building their models.
+    Unlike run_coupled_depletion, this doesn't check that the results are for the same model.
+
+    Parameters
+    ----------
+    timesteps_years : numpy.ndarray
+        Timesteps the depletion was run for (in years)
+    directory : str, optional
+        Directory the depletion was run in. Default is the current directory.
+    method : str, optional
+        How the results must have been made, 'coupled' (run_coupled_depletion) or 'independent' (run_independent_depletion).
+        Default = 'coupled'
+
+    Returns
+    -------
+    bool
+        True if the results are complete
+    """
+
+    timesteps_days = np.array(timesteps_years) * 365
+    state_path = os.path.join(directory, STATE_FILE)
+    results_path = os.path.join(directory, RESULTS_FILE)
+    if not os.path.exists(state_path) or not os.path.exists(results_path):
+        return False
+
+    with open(state_path) as f:
+        state = json.load(f)
+    if state.get('method', 'coupled') != method:
+        return False
+    if len(state['timesteps_days']) != len(timesteps_days) or not np.allclose(state['timesteps_days'], timesteps_days):
+        return False
+
+    results = _load_results(results_path)
+    return results is not None and len(results) == len(timesteps_days) + 1
+
+def _write_state(model, method, timesteps_days, source_rates, **details):
+    """Record what the results in RESULTS_FILE are being made for, so a later run can tell whether to continue them"""
+    with open(STATE_FILE, 'w') as f:
+        json.dump({'method': method,
+                   'model_hash': model_hash(model),
+                   'timesteps_days': [float(timestep) for timestep in timesteps_days],
+                   'source_rates': [float(source_rate) for source_rate in source_rates],
+                   **details}, f, indent=2)
+
+def _read_state(model, method):
+    """Load STATE_FILE and check the results were made by the same depletion method for the same model"""
+    if not os.path.exists(STATE_FILE):
+        raise ValueError(f"Can't tell what model {RESULTS_FILE} was run for without {STATE_FILE}. Delete it to start over.")
+    with open(STATE_FILE) as f:
+        state = json.load(f)
+
+    # Only run_coupled_depletion wrote state files before the method was recorded
+    previous_method = state.get('method', 'coupled')
+    if previous_method != method:
+        raise ValueError(f"{RESULTS_FILE} is from {previous_method} depletion, not {method}. Delete it or run in a different directory.")
+    if state['model_hash'] != model_hash(model):
+        raise ValueError(f"{RESULTS_FILE} is from a different model. Delete it or run in a different directory.")
+    return state
+
+def _load_results(path):
+    """Load depletion results if the file is readable and ends on a finished step, otherwise None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        results = openmc.deplete.Results(path)
+    except (OSError, KeyError):
+        # Killed in the middle of writing
+        return None
+    # The result written after a step finishes has the same start and end time
+    start, end = results[-1].time
+    if start != end:
+        return None
+    return results
+
+def _previous_depletion(model, timesteps_days, source_rates):
+    """Find the depletion steps already completed in the current directory
+    and check they were run for the same model, timesteps and source rates
+
+    Returns
+    -------
+    completed_steps : int
+        Number of timesteps already done
+    prev_results : openmc.deplete.Results or None
+        Results to restart from, None if starting from the beginning
+    """
+
+    if not os.path.exists(RESULTS_FILE):
+        return 0, None
+
+    results = _load_results(RESULTS_FILE)
+    if results is None and _load_results(f"{RESULTS_FILE}.bak") is not None:
+        print(f"{RESULTS_FILE} was stopped in the middle of a step, going back to the last completed step")
+        shutil.copy(f"{RESULTS_FILE}.bak", RESULTS_FILE)
+        results = _load_results(RESULTS_FILE)
+    if results is None:
+        raise ValueError(f"{RESULTS_FILE} doesn't end on a completed step and there is no backup to restart from. Delete it to start over.")
+
+    state = _read_state(model, 'coupled')
+
+    completed_steps = len(results) - 1
+    if completed_steps > len(timesteps_days):
+        raise ValueError(f"{RESULTS_FILE} has {completed_steps} steps but only {len(timesteps_days)} were requested")
+
+    expected_times = np.concatenate([[0], np.cumsum(timesteps_days[:completed_steps])])
+    if not np.allclose(results.get_times(time_units='d'), expected_times):
+        raise ValueError(f"The times in {RESULTS_FILE} don't match the requested timesteps")
+    if not np.allclose(state['source_rates'][:completed_steps], source_rates[:completed_steps]):
+        raise ValueError(f"{RESULTS_FILE} was run with a different fusion power")
+
+    return completed_steps, results
 
 def postprocess_coupled_depletion(flibe_material_index, remove_C14=False):
     """Postprocess the results of a coupled depletion run
@@ -70,11 +653,13 @@ def postprocess_coupled_depletion(flibe_material_index, remove_C14=False):
         blanket_composition_at_time.append(materials[flibe_material_index])
 
     blanket_result_dictionary = {}
+    sample_materials = []
     for blanket_material, time in zip(blanket_composition_at_time, times_years):
 
         removed_tritium = remove_tritium(blanket_material, 0.9)
         removed_flibe = remove_flibe(removed_tritium, 0.9)
         sample_material = removed_flibe
+        sample_materials.append(sample_material)
 
 
         table_1_sum_of_fractions, table_1_culprits = sum_of_fractions(sample_material, 1, None, remove_C14=remove_C14)
@@ -88,6 +673,11 @@ def postprocess_coupled_depletion(flibe_material_index, remove_C14=False):
                                     'table_1_culprits': table_1_culprits,
                                     'table_2_sum_of_fractions': table_2_sum_of_fractions,
                                     'table_2_culprits': table_2_culprits}
+
+    # Solve for the minimum amount of glass needed at every timestep at once
+    class_c_waste_loadings = vitrification_waste_loading(sample_materials, waste_classes=["C"], remove_C14=remove_C14)["C"]
+    for time, waste_loading in zip(times_years, class_c_waste_loadings):
+        blanket_result_dictionary[time]['class_c_waste_loading'] = waste_loading
         
     full_result_dictionary = {'blanket': blanket_result_dictionary}
 
@@ -124,8 +714,6 @@ def plot_results(case:str, print_name:str):
 
         # Put a horizontal line at 1 for reference
         ax.axhline(1, color='black', linestyle='--', label='CCLLW', linewidth=2)
-        # Put a horizontal line at 2.33 for reference
-        ax.axhline(2.33, color='purple', linestyle='--', label='CCLLW with Vitrification', linewidth=2)
         ax.set_xlim(0, 100)
         ax.legend()
         ax.set_title(f'{print_name} Sum of Fractions', fontsize=18)
@@ -133,6 +721,21 @@ def plot_results(case:str, print_name:str):
         # Save figure to file
         fig.savefig(f'{case}_sum_of_fractions.png')
 
+        # Waste loading needed to vitrify into CCLLW
+        # Older results files were made before this was calculated
+        if 'class_c_waste_loading' in cell_result_dictionary[times[0]]:
+            class_c_waste_loadings = [cell_result_dictionary[time]['class_c_waste_loading'] for time in times]
+
+            fig, ax = plt.subplots()
+            ax.plot(times, np.array(class_c_waste_loadings)*100)
+            ax.set_xlabel('Time (years)', fontsize=16)
+            ax.set_ylabel('Maximum Waste Loading (wt%)', fontsize=16)
+            ax.set_xlim(0, 100)
+            ax.set_ylim(0, 105)
+            ax.set_title(f'{print_name} CCLLW Vitrification', fontsize=18)
+
+            fig.savefig(f'{case}_vitrification_waste_loading.png')
+
         # Culprits in Table 1
 
         # For the last time step, plot the 6 largest contributors to the sum of fractions
@@ -1,5 +1,9 @@
+import numpy as np
 import openmc
 import openmc.data
+from scipy.optimize import minimize
+
+from barc_blanket.models.materials import borosilicate_glass
 
 CURIES_PER_BECQUEREL = 1/3.7e10 # NRC uses curies, OpenMC uses becquerels
 KG_PER_AMU = 1.66e-27
@@ -53,6 +57,25 @@ TABLE_2_VOLUME_CONCENTRATION = {
     }
 }
 
+# Sum of fractions that must not be exceeded for each waste class, as (table, column, limit)
+# Table 2 only sets the class on its own if the table 1 sum of fractions is below 0.1 (paragraph 5)
+WASTE_CLASS_LIMITS = {
+    "A": [(1, None, 0.1), (2, 1, 1.0)],
+    "B": [(1, None, 0.1), (2, 2, 1.0)],
+    "C": [(1, None, 1.0), (2, 3, 1.0)],
+}
+
+# Groups of nuclides that are separated together, by element symbol or by nuclide name
+SEPARATION_GROUPS = {
+    "H3": ["H3"],
+    "FLiBe": ["F", "Li", "Be"],
+    "Cs": ["Cs"],
+    "Sr": ["Sr"],
+    "Tc": ["Tc"],
+    "C14": ["C14"],
+    "actinides": ["Ac", "Th", "Pa", "U", "Np", "Pu", "Am", "Cm", "Bk", "Cf", "Es", "Fm"],
+}
+
 def sum_of_fractions(material:openmc.Material, table, column, remove_C14=False):
     """Calculate the sum of fractions of a material
     See paragraph 7 on this page:
@@ -331,9 +354,420 @@ def remove_flibe(material:openmc.Material, efficiency):
 
     return separate_nuclides(material, flibe_removal_dict)
 
-def vitrify_waste(material:openmc.Material, weight_percent_ratio):
-    """Vitrify a material by adding a certain amount of borosilicate glass"""
-    
+def material_mass_fractions(materials, nuclides=None):
+    """Convert one or more materials into arrays of nuclide mass fractions and mass densities
+    so that they can be classified and separated without building new openmc.Material objects
+
+    Parameters:
+    -----------
+    materials: openmc.Material or array-like of openmc.Material
+        The material(s) to convert. Nested lists (e.g. cases x timesteps) are allowed.
+    nuclides: list of str, optional
+        The nuclides to include, in order. Default is every nuclide in any of the materials.
+
+    Returns:
+    --------
+    nuclides: list of str
+        The nuclide corresponding to each entry of the last axis of mass_fractions
+    mass_fractions: numpy.ndarray
+        Mass fraction of each nuclide, with shape materials.shape + (len(nuclides),)
+    mass_densities: numpy.ndarray
+        Mass density of each material in g/cm3, with shape materials.shape
+    """
+
+    materials = np.asarray(materials, dtype=object)
+
+    # Same calculation as in separate_nuclides, since get_mass_density is very slow
+    nuclide_mass_densities = []
+    for material in materials.ravel():
+        mass_densities = {}
+        for nuc, atoms_per_bcm in material.get_nuclide_atom_densities().items():
+            mass_densities[nuc] = 1e24 * atoms_per_bcm * openmc.data.atomic_mass(nuc) / openmc.data.AVOGADRO
+        nuclide_mass_densities.append(mass_densities)
+
+    if nuclides is None:
+        nuclides = sorted(set().union(*nuclide_mass_densities))
+
+    partial_densities = np.array([[mass_densities.get(nuc, 0.0) for nuc in nuclides] for mass_densities in nuclide_mass_densities])
+    partial_densities = partial_densities.reshape(materials.shape + (len(nuclides),))
+
+    mass_densities = partial_densities.sum(axis=-1)
+    mass_fractions = partial_densities / mass_densities[..., np.newaxis]
+
+    return nuclides, mass_fractions, mass_densities
+
+def fraction_coefficients(nuclides, table, column=None):
+    """Calculate how much each nuclide contributes to the sum of fractions per unit mass fraction.
+    Uses the same limits as sum_of_fractions, but without modifying the module-level tables.
+
+    The sum of fractions of a material is then
+        mass_density * (mass_fractions @ volume_coefficients) + mass_fractions @ mass_coefficients
+    which is linear in the mass fractions, so it can be evaluated for many compositions at once.
+
+    Parameters:
+    -----------
+    nuclides: list of str
+        The nuclides to calculate coefficients for
+    table: int
+        The table to use for the calculation
+    column: int
+        The column to use for the calculation. Only valid for table 2.
+
+    Returns:
+    --------
+    volume_coefficients: numpy.ndarray
+        Sum of fractions per (g/cm3) of material for each nuclide, from the limits in Ci/m3
+    mass_coefficients: numpy.ndarray
+        Sum of fractions for each nuclide, from the limits in nCi/g
+    """
+
+    if table == 1:
+        volume_concentration = TABLE_1_VOLUME_CONCENTRATION
+        mass_concentration = TABLE_1_MASS_CONCENTRATION
+    elif table == 2:
+        if column is None:
+            raise ValueError("Column must be specified for table 2")
+        volume_concentration = TABLE_2_VOLUME_CONCENTRATION[column]
+        mass_concentration = {}
+    else:
+        raise ValueError("Invalid table number")
+
+    volume_coefficients = np.zeros(len(nuclides))
+    mass_coefficients = np.zeros(len(nuclides))
+
+    for i, nuclide in enumerate(nuclides):
+        decay_constant = openmc.data.decay_constant(nuclide)
+        if decay_constant == 0:
+            continue
+        Ci_per_g = decay_constant * openmc.data.AVOGADRO / openmc.data.atomic_mass(nuclide) * CURIES_PER_BECQUEREL
+        half_life_years = np.log(2) / decay_constant / (365 * 24 * 60 * 60)
+
+        volume_limit = None
+        mass_limit = None
+        if nuclide in volume_concentration.keys():
+            volume_limit = volume_concentration[nuclide]
+        elif nuclide in mass_concentration.keys():
+            mass_limit = mass_concentration[nuclide]
+        elif table == 1:
+            # Alpha-emitting transuranics with half life of greater than 5 years
+            if openmc.data.zam(nuclide)[0] > 92 and half_life_years > 5:
+                mass_limit = mass_concentration["long_lived_transuranic_alphas"]
+        elif half_life_years < 5:
+            volume_limit = volume_concentration["all_short_lived_nuclides"]
+
+        if volume_limit is not None:
+            volume_coefficients[i] = Ci_per_g * CUBIC_CENTIMETERS_PER_CUBIC_METER / volume_limit
+        if mass_limit is not None:
+            mass_coefficients[i] = Ci_per_g * 1e9 / mass_limit
+
+    return volume_coefficients, mass_coefficients
+
+def sum_of_fractions_array(nuclides, mass_fractions, mass_densities, table, column=None):
+    """Vectorized version of sum_of_fractions for compositions given as arrays
+
+    Parameters:
+    -----------
+    nuclides: list of str
+        The nuclide corresponding to each entry of the last axis of mass_fractions
+    mass_fractions: numpy.ndarray
+        Mass fraction of each nuclide, with nuclides along the last axis
+    mass_densities: float or numpy.ndarray
+        Mass density in g/cm3, broadcastable against mass_fractions[..., 0]
+    table: int
+        The table to use for the calculation
+    column: int
+        The column to use for the calculation. Only valid for table 2.
+
+    Returns:
+    --------
+    sum_of_fractions: numpy.ndarray
+        The sum of fractions for each composition
+    """
+
+    volume_coefficients, mass_coefficients = fraction_coefficients(nuclides, table, column)
+    mass_fractions = np.asarray(mass_fractions)
+
+    return np.asarray(mass_densities) * (mass_fractions @ volume_coefficients) + mass_fractions @ mass_coefficients
+
+def separate_mass_fractions(mass_fractions, nuclide_removal_efficiencies):
+    """Vectorized version of separate_nuclides for compositions given as arrays
+
+    With the volume assumption used in separate_nuclides, the mass density does not change
+    and the remaining nuclides are just renormalized.
+
+    Parameters:
+    -----------
+    mass_fractions: numpy.ndarray
+        Mass fraction of each nuclide, with nuclides along the last axis
+    nuclide_removal_efficiencies: numpy.ndarray
+        Removal efficiency of each nuclide (between 0 and 1), broadcastable against mass_fractions
+
+    Returns:
+    --------
+    new_mass_fractions: numpy.ndarray
+        Mass fractions of the remaining material
+    """
+
+    remaining_mass_fractions = np.asarray(mass_fractions) * (1 - np.asarray(nuclide_removal_efficiencies))
+
+    return remaining_mass_fractions / remaining_mass_fractions.sum(axis=-1, keepdims=True)
+
+def group_membership(nuclides, groups=SEPARATION_GROUPS):
+    """Find which nuclides belong to each separation group
+
+    Parameters:
+    -----------
+    nuclides: list of str
+        The nuclides to sort into groups
+    groups: dict, optional
+        key = group name, value = list of element symbols and/or nuclide names
+
+    Returns:
+    --------
+    membership: numpy.ndarray
+        Array of shape (len(groups), len(nuclides)), 1 where the nuclide is in the group and 0 otherwise
+    """
+
+    membership = np.zeros((len(groups), len(nuclides)))
+    for i, members in enumerate(groups.values()):
+        for j, nuclide in enumerate(nuclides):
+            element = openmc.data.ATOMIC_SYMBOL[openmc.data.zam(nuclide)[0]]
+            if nuclide in members or element in members:
+                membership[i, j] = 1
+
+    return membership
+
+def group_removal_efficiencies(nuclides, group_efficiencies:dict, groups=SEPARATION_GROUPS):
+    """Expand removal efficiencies per group into the per-nuclide dictionary used by separate_nuclides
+
+    Parameters:
+    -----------
+    nuclides: list of str
+        The nuclides in the material to separate
+    group_efficiencies: dict
+        key = group name, value = efficiency (float between 0 and 1)
+    groups: dict, optional
+        key = group name, value = list of element symbols and/or nuclide names
+
+    Returns:
+    --------
+    nuclide_removal_efficiencies: dict
+        key = nuclide, value = efficiency (float between 0 and 1)
+    """
+
+    nuclide_removal_efficiencies = {}
+    for group_name, efficiency in group_efficiencies.items():
+        membership = group_membership(nuclides, {group_name: groups[group_name]})[0]
+        for nuclide, is_member in zip(nuclides, membership):
+            if is_member:
+                nuclide_removal_efficiencies[nuclide] = efficiency
+
+    return nuclide_removal_efficiencies
+
+def optimize_separation(material:openmc.Material, groups=SEPARATION_GROUPS, costs=None, max_efficiency=0.9999, waste_class="C", margin=1e-3):
+    """Find the cheapest combination of group removal efficiencies that brings a material under the limits of a waste class
+
+    The cost of separating a group is taken to be proportional to the number of decades of decontamination,
+    cost = -log10(1 - efficiency), weighted by the cost of the group.
+
+    Parameters:
+    -----------
+    material: openmc.Material
+        The material to separate
+    groups: dict, optional
+        key = group name, value = list of element symbols and/or nuclide names.
+        Groups should not overlap. Default is SEPARATION_GROUPS.
+    costs: dict, optional
+        key = group name, value = relative cost of separating that group. Default is 1 for every group.
+    max_efficiency: float, optional
+        The highest removal efficiency any group can reach
+    waste_class: str, optional
+        Which class to meet, any of the keys in WASTE_CLASS_LIMITS. Default is class C.
+    margin: float, optional
+        Fraction below each sum of fractions limit to aim for, so the result passes check_class_c
+
+    Returns:
+    --------
+    group_efficiencies: dict
+        key = group name, value = removal efficiency (float between 0 and 1)
+    """
+
+    if costs is None:
+        costs = {group_name: 1.0 for group_name in groups}
+    group_names = list(groups.keys())
+    group_costs = np.array([costs[group_name] for group_name in group_names])
+
+    nuclides, mass_fractions, mass_density = material_mass_fractions(material)
+    membership = group_membership(nuclides, groups)
+
+    # Sum of fractions per unit mass fraction for each limit, so each evaluation is just a dot product
+    limits = []
+    coefficients = []
+    for table, column, limit in WASTE_CLASS_LIMITS[waste_class]:
+        volume_coefficients, mass_coefficients = fraction_coefficients(nuclides, table, column)
+        coefficients.append(mass_density * volume_coefficients + mass_coefficients)
+        limits.append(limit)
+    coefficients = np.array(coefficients)
+    limits = np.array(limits)
+
+    def headroom(group_efficiencies, limits=limits*(1 - margin)):
+        separated_mass_fractions = separate_mass_fractions(mass_fractions, group_efficiencies @ membership)
+        return limits - coefficients @ separated_mass_fractions
+
+    def cost(group_efficiencies):
+        return np.sum(group_costs * -np.log10(1 - group_efficiencies))
+
+    def cost_gradient(group_efficiencies):
+        return group_costs / ((1 - group_efficiencies) * np.log(10))
+
+    if np.all(headroom(np.zeros(len(group_names))) >= 0):
+        return {group_name: 0.0 for group_name in group_names}
+
+    result = minimize(
+        cost,
+        np.full(len(group_names), 0.5*max_efficiency),
+        jac=cost_gradient,
+        method='SLSQP',
+        bounds=[(0, max_efficiency)] * len(group_names),
+        constraints=[{'type': 'ineq', 'fun': headroom}]
+    )
+
+    if not result.success or np.any(headroom(result.x, limits) < 0):
+        raise ValueError(f"Could not meet class {waste_class} limits with removal efficiencies up to {max_efficiency}: {result.message}")
+
+    group_efficiencies = {group_name: float(efficiency) for group_name, efficiency in zip(group_names, result.x)}
+
+    return group_efficiencies
+
+def max_waste_loading(waste_sum_of_fractions, diluent_sum_of_fractions, limit):
+    """Find the largest mass fraction of waste that can be mixed with a diluent
+    while keeping the sum of fractions at or below a limit.
+
+    At a fixed final density the sum of fractions is linear in the waste loading w:
+        SOF(w) = w * waste_sum_of_fractions + (1 - w) * diluent_sum_of_fractions
+    so the answer comes directly from solving SOF(w) = limit.
+
+    Parameters:
+    -----------
+    waste_sum_of_fractions: float or numpy.ndarray
+        Sum of fractions of the waste evaluated at the final product density
+    diluent_sum_of_fractions: float or numpy.ndarray
+        Sum of fractions of the diluent evaluated at the final product density
+    limit: float
+        Sum of fractions that must not be exceeded
+
+    Returns:
+    --------
+    waste_loading: numpy.ndarray
+        Largest allowed mass fraction of waste (between 0 and 1).
+        1 means no dilution is needed, 0 means the diluent alone already exceeds the limit.
+    """
+
+    waste = np.asarray(waste_sum_of_fractions, dtype=float)
+    diluent = np.asarray(diluent_sum_of_fractions, dtype=float)
+    waste, diluent = np.broadcast_arrays(waste, diluent)
+
+    needs_dilution = waste > limit
+    possible = diluent < limit
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diluted_loading = (limit - diluent) / (waste - diluent)
+
+    waste_loading = np.where(needs_dilution, np.where(possible, diluted_loading, 0.0), 1.0)
+
+    return waste_loading
+
+def vitrification_waste_loading(waste_materials, glass=None, waste_form_density=None, waste_classes=("A", "B", "C"), remove_C14=False):
+    """Find the largest waste loading of a vitrified waste form that still meets each waste class,
+    for a single material or a whole array of materials (e.g. every timestep of every case) at once.
+
+    The waste loading is the mass fraction of the final product that comes from the waste,
+    so the minimum amount of glass needed is (1 - waste_loading).
+
+    Parameters:
+    -----------
+    waste_materials: openmc.Material or array-like of openmc.Material
+        The waste to vitrify
+    glass: openmc.Material, optional
+        The glass (or other diluent) mixed with the waste. Default is borosilicate glass.
+    waste_form_density: float, optional
+        Density of the vitrified product in g/cm3. Default is the density of the glass.
+    waste_classes: iterable of str, optional
+        Which classes to solve for, any of the keys in WASTE_CLASS_LIMITS
+    remove_C14: bool, optional
+        Leave C14 out of the sums of fractions, like sum_of_fractions(..., remove_C14=True)
+
+    Returns:
+    --------
+    waste_loadings: dict
+        key = waste class, value = largest allowed waste loading with the same shape as waste_materials
+    """
+
+    if glass is None:
+        glass = borosilicate_glass()
+    if waste_form_density is None:
+        waste_form_density = glass.get_mass_density()
+
+    waste_materials = np.asarray(waste_materials, dtype=object)
+    nuclides = sorted(set(glass.get_nuclides()).union(*[material.get_nuclides() for material in waste_materials.ravel()]))
+
+    _, waste_fractions, _ = material_mass_fractions(waste_materials, nuclides)
+    _, glass_fractions, _ = material_mass_fractions(glass, nuclides)
+
+    if remove_C14 and "C14" in nuclides:
+        # Same as sum_of_fractions, C14 just doesn't count towards the limits
+        waste_fractions[..., nuclides.index("C14")] = 0
+        glass_fractions[..., nuclides.index("C14")] = 0
+
+    waste_loadings = {}
+    for waste_class in waste_classes:
+        waste_loading = np.ones(waste_materials.shape)
+        for table, column, limit in WASTE_CLASS_LIMITS[waste_class]:
+            waste_sum = sum_of_fractions_array(nuclides, waste_fractions, waste_form_density, table, column)
+            glass_sum = sum_of_fractions_array(nuclides, glass_fractions, waste_form_density, table, column)
+            waste_loading = np.minimum(waste_loading, max_waste_loading(waste_sum, glass_sum, limit))
+        waste_loadings[waste_class] = waste_loading
+
+    return waste_loadings
+
+def vitrify_waste(material:openmc.Material, weight_percent_ratio, glass=None, waste_form_density=None):
+    """Vitrify a material by adding a certain amount of borosilicate glass
+
+    Parameters:
+    -----------
+    material: openmc.Material
+        The waste to vitrify
+    weight_percent_ratio: float
+        The mass fraction of the vitrified product that is waste (between 0 and 1)
+    glass: openmc.Material, optional
+        The glass to mix the waste with. Default is borosilicate glass.
+    waste_form_density: float, optional
+        Density of the vitrified product in g/cm3. Default is the density of the glass.
+
+    Returns:
+    --------
+    vitrified_material: openmc.Material
+        The mixture of waste and glass
+    """
+
+    if weight_percent_ratio < 0 or weight_percent_ratio > 1:
+        raise ValueError(f"Waste loading must be between 0 and 1, but got {weight_percent_ratio}")
+
+    if glass is None:
+        glass = borosilicate_glass()
+    if waste_form_density is None:
+        waste_form_density = glass.get_mass_density()
+
+    vitrified_material = openmc.Material.mix_materials(
+        [material, glass],
+        [weight_percent_ratio, 1 - weight_percent_ratio],
+        'wo',
+        name="vitrified_waste"
+    )
+    vitrified_material.set_density('g/cm3', waste_form_density)
+
+    return vitrified_material
+
 def make_activity_volume_density(nuclide_activities_Ci_per_m3:dict):
     """Create a material with the given nuclides and activity concentrations in Ci/m3
     
@@ -1,6 +1,15 @@
 import copy
+import json
+import shutil
+import warnings
+import h5py
+from collections import OrderedDict
 import openmc
+import openmc.lib
 import numpy as np
+import pandas as pd
+import xml.etree.ElementTree as ET
+from barc_blanket.utilities import CACHE_DIRECTORY, config_hash, material_signature, change_directory, load_machine_profile, recommended_threads
 from .materials import dt_plasma, tungsten, v4cr4ti, flibe, ss316L, shield, magnetmat
 
 DEFAULT_PARAMETERS = {
@@ -9,6 +18,8 @@ DEFAULT_PARAMETERS = {
     'minor_radius': 130,
     'elongation': 1.8,
 
+    'section_angle': 360/14, # Toroidal angle of the modeled section [degrees]
+
     'first_wall_thickness': 0.3,
     'cooling_channel_width': 1.2,
     'cooling_vessel_thickness': 0.3,
@@ -37,17 +48,64 @@ DEFAULT_PARAMETERS = {
     'batches': 100,
     'inactive_batches': 0,
     'particles': int(1e6),
+    # Use the particles per batch from barc_blanket.autotune when 'particles' isn't set,
+    # with the batches changed to keep the same total number of histories
+    'machine_profile': False,
+    'statepoint_interval': 10, # Batches between statepoints
+
+    # Run from a bank of pre-sampled source particles, cached by the source parameters
+    'presampled_source': False,
+    'source_bank_size': int(1e6),
 
     'photon_transport': False,
 
-    'midplane_split': False
+    'midplane_split': False,
+
+    'verify_volumes': False,
+    'cache_model': False,
+
+    'bounding_regions': False,
+
+    'heating_mesh': False,
+    'heating_mesh_dimension': [100, 150], # (r, z) bins
+
+    'variance_reduction': False,
+
+    # key = 'tbr' or a cell name (for heating in that cell), value = target relative error
+    # When set, 'batches' is the minimum number of batches and the run stops once all targets are met
+    'tally_triggers': None,
+    'max_batches': 1000,
+    'trigger_batch_interval': 10,
+
+    # Set to 'multi-group' (with the mgxs.h5 made by barc_blanket.multigroup) for fast screening runs
+    'energy_mode': 'continuous-energy',
+    'mgxs_library': None
 }
 
 BLANKET_MATERIAL_ID = 5
-SECTION_CORRECTION = 1/14 # This model is a section of the torus, so the volume is 1/14 of the total volume
+SECTION_CORRECTION = DEFAULT_PARAMETERS['section_angle']/360 # This model is a section of the torus, so by default the volume is 1/14 of the total volume
 
 MIDPLANE_OFFSET = 20
 
+# Cells filled with the breeding material, which make up the TBR (the midplane cell is only there with 'midplane_split')
+BREEDER_CELLS = ['cooling_channel_cell', 'cooling_channel_midpl', 'blanket_cell']
+
+# Which material in the model configuration fills each cell
+CELL_MATERIALS = {
+    'plasma_cell': 'plasma_material',
+    'first_wall_cell': 'first_wall_material',
+    'cooling_channel_cell': 'blanket_material',
+    'cooling_vessel_cell': 'cooling_vessel_material',
+    'vacuum_vessel_cell': 'vacuum_vessel_material',
+    'blanket_cell': 'blanket_material',
+    'blanket_vessel_cell': 'blanket_vessel_material',
+    'neutron_shield_cell': 'magnetcase_material',
+    'inner_case_cell': 'magnetcase_material',
+    'first_cm_cell': 'magnet_material',
+    'magnet_coil_cell': 'magnet_material',
+    'outer_case_cell': 'magnetcase_material',
+}
+
 def peaking_sector_volume(majorrad,c1,c2,b1,b2,z0=MIDPLANE_OFFSET,theta=2*np.pi*SECTION_CORRECTION):
     """Calculate the volume of the inboard midplane sector from a particluar layer, where the flux and heating peak.
        This is represented by the shaded region below.
@@ -166,6 +224,1051 @@ def total_layer_volume(majorrad,c1,c2,elongation,theta=2*np.pi*SECTION_CORRECTIO
 
     return layer_volume
 
+def section_correction(new_model_config=None):
+    """Fraction of the full torus that the modeled section covers
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    float
+        section_angle / 360
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    return model_config['section_angle'] / 360
+
+def model_section_correction(model:openmc.Model):
+    """Fraction of the full torus that a model covers, read from its periodic planes.
+    Useful for normalizing results of a model loaded from XML, where the config isn't available.
+
+    Parameters:
+    ----------
+    model : openmc.Model
+        Model made by make_model (or loaded from its XML)
+
+    Returns:
+    -------
+    float
+        Section angle / 360
+    """
+
+    for surface in model.geometry.get_all_surfaces().values():
+        # The xz plane has a = 0, the angled plane is (sin(angle), -cos(angle), 0)
+        if isinstance(surface, openmc.Plane) and surface.boundary_type == 'periodic' and not np.isclose(surface.a, 0):
+            return np.arctan2(surface.a, -surface.b) / (2*np.pi)
+
+    raise ValueError("Could not find the angled periodic plane in the model")
+
+def layer_radii(new_model_config=None):
+    """Calculate the poloidal radii of every layer boundary in the model.
+    Only uses arithmetic, so any of the dimensions in the configuration can be numpy arrays
+    and every radius will be broadcast to match.
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    radii : dict
+        Semiminor axis of each layer boundary [cm], along with the major radii
+        ('major_radius' and 'blanket_vessel_major_radius') and 'elongation'
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    R = model_config['major_radius']
+    a = model_config['minor_radius']
+
+    inner_magnet_case_thickness = model_config['thermal_shield_thickness'] + model_config['magnetcase_thickness']
+    # ^ this includes the thermal shield, being of the same material
+
+    radii = {'major_radius': R,
+             'elongation': model_config['elongation']}
+
+    radii['first_wall_inner'] = a
+    radii['first_wall_outer'] = a + model_config['first_wall_thickness']
+    radii['cooling_vessel_inner'] = radii['first_wall_outer'] + model_config['cooling_channel_width']
+    radii['cooling_vessel_outer'] = radii['cooling_vessel_inner'] + model_config['cooling_vessel_thickness']
+    # The vacuum vessel inner surface is in contact with the cooling vessel outer surface
+    radii['vacuum_vessel_outer'] = radii['cooling_vessel_outer'] + model_config['vacuum_vessel_thickness']
+
+    # Since the blanket is sorta offset by the gaps, I'm just modeling it as torus with a different major radius
+    blanket_vessel_offset = (model_config['blanket_outboard_gap'] - model_config['blanket_inboard_gap'])/2
+    blanket_vessel_average_width = (model_config['blanket_outboard_gap'] + model_config['blanket_inboard_gap'])/2
+    radii['blanket_vessel_major_radius'] = R + blanket_vessel_offset
+    radii['blanket_vessel_inner'] = radii['vacuum_vessel_outer'] + blanket_vessel_average_width
+    radii['blanket_vessel_outer'] = radii['blanket_vessel_inner'] + model_config['blanket_vessel_thickness']
+
+    # outer layers: neutron shield, thermal shield + magnet case, magnet coil, magnet case
+    radii['neutron_shield_outer'] = radii['blanket_vessel_outer'] + model_config['shield_thickness']
+    radii['inner_case_outer'] = radii['neutron_shield_outer'] + inner_magnet_case_thickness
+    radii['firstcm_outer'] = radii['inner_case_outer'] + 1
+    radii['magnet_coil_outer'] = radii['inner_case_outer'] + model_config['magnet_thickness']
+    radii['outer_case_outer'] = radii['magnet_coil_outer'] + model_config['magnetcase_thickness']
+
+    return radii
+
+def section_extent(new_model_config=None):
+    """Find the radial and vertical extent of the whole model, in cylindrical coordinates about the z axis
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    r_min, r_max, half_height : float
+        Everything in the model is within r_min < r < r_max and |z| < half_height [cm]
+    """
+
+    radii = layer_radii(new_model_config)
+    outer_major_radius = radii['blanket_vessel_major_radius']
+    outer_radius = radii['outer_case_outer']
+
+    r_min = max(outer_major_radius - outer_radius, 0)
+    r_max = outer_major_radius + outer_radius
+    half_height = max(outer_radius*radii['elongation']*0.8, radii['vacuum_vessel_outer']*radii['elongation'])
+
+    return r_min, r_max, half_height
+
+def section_bounding_box(new_model_config=None):
+    """Find the smallest box (aligned with the axes) that holds the whole torus section,
+    which runs from the x axis around to the section angle
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    lower_left, upper_right : tuple of float
+        Corners of the box [cm]
+    """
+
+    r_min, r_max, half_height = section_extent(new_model_config)
+    section_angle_rad = 2*np.pi*section_correction(new_model_config)
+
+    # Past 90 degrees the wedge goes over the y axis, so it reaches x < 0 at its outer edge and y = r_max
+    x_min = min(r_min*np.cos(section_angle_rad), r_max*np.cos(section_angle_rad))
+    y_max = r_max if section_angle_rad > np.pi/2 else r_max*np.sin(section_angle_rad)
+
+    return (x_min, 0, -half_height), (r_max, y_max, half_height)
+
+def poloidal_cell_masks(r, z, new_model_config=None):
+    """Find which cell each point in the poloidal plane is in.
+    Follows the same surfaces as make_model, without the midplane split.
+
+    Parameters:
+    ----------
+    r : np.array
+        Distance of each point from the z axis [cm]
+    z : np.array
+        Height of each point [cm], same shape as r
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    masks : dict
+        key = cell name, value = boolean array, True where the point is in the cell
+    """
+
+    radii = layer_radii(new_model_config)
+    R = radii['major_radius']
+    blanket_vessel_major_radius = radii['blanket_vessel_major_radius']
+    elongation = radii['elongation']
+
+    # Inside each of the elliptical torus surfaces
+    def inside(majorrad, c, b):
+        return ((r - majorrad)/c)**2 + (z/b)**2 < 1
+    def inner_inside(name):
+        return inside(R, radii[name], radii[name]*elongation)
+    def outer_inside(name):
+        return inside(blanket_vessel_major_radius, radii[name], radii[name]*elongation*0.8)
+
+    first_cm_region = (np.abs(z) < MIDPLANE_OFFSET) & (r < blanket_vessel_major_radius)
+
+    masks = {
+        'plasma_cell': inner_inside('first_wall_inner'),
+        'first_wall_cell': inner_inside('first_wall_outer') & ~inner_inside('first_wall_inner'),
+        'cooling_channel_cell': inner_inside('cooling_vessel_inner') & ~inner_inside('first_wall_outer'),
+        'cooling_vessel_cell': inner_inside('cooling_vessel_outer') & ~inner_inside('cooling_vessel_inner'),
+        'vacuum_vessel_cell': inner_inside('vacuum_vessel_outer') & ~inner_inside('cooling_vessel_outer'),
+        'blanket_cell': outer_inside('blanket_vessel_inner') & ~inner_inside('vacuum_vessel_outer'),
+        'blanket_vessel_cell': outer_inside('blanket_vessel_outer') & ~outer_inside('blanket_vessel_inner'),
+        'neutron_shield_cell': outer_inside('neutron_shield_outer') & ~outer_inside('blanket_vessel_outer'),
+        'inner_case_cell': outer_inside('inner_case_outer') & ~outer_inside('neutron_shield_outer'),
+        'first_cm_cell': outer_inside('firstcm_outer') & ~outer_inside('inner_case_outer') & first_cm_region,
+        'magnet_coil_cell': outer_inside('magnet_coil_outer') & ~outer_inside('inner_case_outer') & ~(outer_inside('firstcm_outer') & first_cm_region),
+        'outer_case_cell': outer_inside('outer_case_outer') & ~outer_inside('magnet_coil_outer'),
+    }
+
+    return masks
+
+def voxel_cell_volumes(r_grid, z_grid, new_model_config=None, section_angle_rad=None, subdivisions=10):
+    """Calculate how much of each cell is in each voxel of a cylindrical (r, z) mesh over the section.
+    Each voxel is integrated with a subdivisions x subdivisions midpoint rule in the poloidal plane.
+
+    Parameters:
+    ----------
+    r_grid : np.array
+        Radial mesh boundaries [cm]
+    z_grid : np.array
+        Vertical mesh boundaries [cm]
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+    section_angle_rad : float, optional
+        Toroidal angle covered by the mesh [rad]. Default is the section angle of the model.
+    subdivisions : int, optional
+        Number of sample points along each side of a voxel. Default = 10
+
+    Returns:
+    -------
+    volumes : dict
+        key = cell name, value = array (len(z_grid)-1, len(r_grid)-1) of volume [cm3] of the cell in each voxel
+    """
+
+    if section_angle_rad is None:
+        section_angle_rad = 2*np.pi*section_correction(new_model_config)
+
+    r_grid = np.asarray(r_grid, dtype=float)
+    z_grid = np.asarray(z_grid, dtype=float)
+
+    # Midpoints of the sub-voxels, shaped (z voxel, r voxel, z sub-voxel, r sub-voxel)
+    fractions = (np.arange(subdivisions) + 0.5)/subdivisions
+    dr = np.diff(r_grid)
+    dz = np.diff(z_grid)
+    r = r_grid[:-1, None] + dr[:, None]*fractions[None, :]
+    z = z_grid[:-1, None] + dz[:, None]*fractions[None, :]
+    r = np.broadcast_to(r[None, :, None, :], (len(dz), len(dr), subdivisions, subdivisions))
+    z = np.broadcast_to(z[:, None, :, None], r.shape)
+
+    # Each sub-voxel is a ring segment with volume r*dr*dz*angle
+    weights = r * (dr[None, :, None, None]/subdivisions) * (dz[:, None, None, None]/subdivisions) * section_angle_rad
+
+    volumes = {}
+    for cell_name, mask in poloidal_cell_masks(r, z, new_model_config).items():
+        volumes[cell_name] = np.sum(weights*mask, axis=(2, 3))
+
+    return volumes
+
+def cell_volumes(new_model_config=None):
+    """Calculate the analytic volume of every cell in the model without building any OpenMC objects.
+    Any of the dimensions in the configuration can be numpy arrays, in which case every volume
+    is an array broadcast across them, so thousands of geometries can be screened at once.
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    volumes : dict
+        key = cell name, value = volume of the cell [cm3].
+        Includes the '_midpl' cells when 'midplane_split' is set, in which case the
+        main cell volumes have the midplane sector removed.
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    radii = layer_radii(model_config)
+    theta = 2*np.pi*section_correction(model_config)
+    R = radii['major_radius']
+    blanket_vessel_major_radius = radii['blanket_vessel_major_radius']
+    elongation = radii['elongation']
+
+    volumes = {}
+
+    # Layers between the plasma and the blanket, which can be split at the midplane
+    inner_layers = {
+        'first_wall': (R, radii['first_wall_inner'], radii['first_wall_outer']),
+        'cooling_channel': (R, radii['first_wall_outer'], radii['cooling_vessel_inner']),
+        'cooling_vessel': (R, radii['cooling_vessel_inner'], radii['cooling_vessel_outer']),
+        'vacuum_vessel': (R, radii['cooling_vessel_outer'], radii['vacuum_vessel_outer']),
+        'blanket_vessel': (blanket_vessel_major_radius, radii['blanket_vessel_inner'], radii['blanket_vessel_outer']),
+    }
+    for layer, (majorrad, inner_radius, outer_radius) in inner_layers.items():
+        total_volume = total_layer_volume(majorrad, inner_radius, outer_radius, elongation, theta=theta)
+        if model_config['midplane_split']:
+            midpl_volume = peaking_sector_volume(majorrad, inner_radius, outer_radius, inner_radius*elongation, outer_radius*elongation, theta=theta)
+            volumes[f'{layer}_cell'] = total_volume - midpl_volume
+            volumes[f'{layer}_midpl'] = midpl_volume
+        else:
+            volumes[f'{layer}_cell'] = total_volume
+
+    # Volume of blanket is calculated differently because it has two non-concentric ellipses in its poloidal xs
+    enclosed_volume = (2*np.pi*blanket_vessel_major_radius)*np.pi*radii['blanket_vessel_inner']**2*elongation*0.8
+    removed_volume = (2*np.pi*R)*np.pi*radii['vacuum_vessel_outer']**2*elongation
+    volumes['blanket_cell'] = (enclosed_volume - removed_volume) * section_correction(model_config)
+
+    volumes['neutron_shield_cell'] = total_layer_volume(blanket_vessel_major_radius, radii['blanket_vessel_outer'], radii['neutron_shield_outer'], elongation, theta=theta)
+    volumes['inner_case_cell'] = total_layer_volume(blanket_vessel_major_radius, radii['neutron_shield_outer'], radii['inner_case_outer'], elongation, theta=theta)
+    volumes['first_cm_cell'] = peaking_sector_volume(blanket_vessel_major_radius, radii['inner_case_outer'], radii['firstcm_outer'],
+                                                     radii['inner_case_outer']*elongation*0.8, radii['firstcm_outer']*elongation*0.8, theta=theta)
+    volumes['magnet_coil_cell'] = total_layer_volume(blanket_vessel_major_radius, radii['inner_case_outer'], radii['magnet_coil_outer'], elongation, theta=theta) - volumes['first_cm_cell']
+    volumes['outer_case_cell'] = total_layer_volume(blanket_vessel_major_radius, radii['magnet_coil_outer'], radii['outer_case_outer'], elongation, theta=theta)
+
+    return volumes
+
+def cell_masses(new_model_config=None):
+    """Calculate the mass of every cell in the model from the analytic volumes and the material densities.
+    Like cell_volumes, the dimensions in the configuration can be numpy arrays.
+    The salt inventory is the sum of 'blanket_cell' and 'cooling_channel_cell' (and 'cooling_channel_midpl').
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    masses : dict
+        key = cell name, value = mass of the cell [kg]
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    densities = {}
+    masses = {}
+    for cell_name, volume in cell_volumes(model_config).items():
+        material_key = CELL_MATERIALS[cell_name.replace('_midpl', '_cell')]
+        if material_key not in densities:
+            densities[material_key] = model_config[material_key].get_mass_density()
+        masses[cell_name] = volume * densities[material_key] / 1000
+
+    return masses
+
+# Models already built in this process, keyed by model_cache_key, oldest first
+_MODEL_CACHE = OrderedDict()
+MODEL_CACHE_SIZE = 16
+
+# Bump this whenever make_model changes what it builds for the same configuration
+# (geometry, tallies, settings, ...), so models cached on disk by older code aren't used
+MODEL_CACHE_VERSION = 2
+
+# Configuration values that change the shape of the geometry (and so the cell volumes)
+GEOMETRY_PARAMETERS = [
+    'section_angle',
+    'major_radius',
+    'minor_radius',
+    'elongation',
+    'first_wall_thickness',
+    'cooling_channel_width',
+    'cooling_vessel_thickness',
+    'vacuum_vessel_thickness',
+    'blanket_vessel_thickness',
+    'blanket_outboard_gap',
+    'blanket_inboard_gap',
+    'shield_thickness',
+    'thermal_shield_thickness',
+    'magnetcase_thickness',
+    'magnet_thickness',
+    'midplane_split'
+]
+
+def geometry_hash(new_model_config=None):
+    """Hash the geometry-defining part of a model configuration,
+    so two configurations with the same shape (but maybe different materials) get the same key.
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    str
+        Hash of the geometry parameters
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    return config_hash({key: model_config[key] for key in GEOMETRY_PARAMETERS})
+
+def model_config_hash(new_model_config=None):
+    """Hash the full model configuration, including the material compositions,
+    so identical design points get the same key no matter how their materials were created.
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    str
+        Hash of the configuration
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    canonical_config = {}
+    for key, value in model_config.items():
+        if isinstance(value, openmc.Material):
+            canonical_config[key] = material_signature(value)
+        else:
+            canonical_config[key] = value
+
+    return config_hash(canonical_config)
+
+def model_cache_key(new_model_config=None):
+    """Key of a model in the model cache: the configuration hash (with the batch settings
+    already resolved from any machine profile), the cache version and the openmc version writing the XML
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    str
+        Hash to cache the model under
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    return config_hash({'config': model_config_hash(model_config),
+                        'threads': recommended_threads() if model_config['machine_profile'] else None,
+                        'version': MODEL_CACHE_VERSION,
+                        'openmc': openmc.__version__})
+
+def _cache_model(key, model):
+    """Keep a copy of a model in memory, forgetting the least recently used ones past MODEL_CACHE_SIZE"""
+    _MODEL_CACHE[key] = copy.deepcopy(model)
+    _MODEL_CACHE.move_to_end(key)
+    while len(_MODEL_CACHE) > MODEL_CACHE_SIZE:
+        _MODEL_CACHE.popitem(last=False)
+
+def verify_volumes(model, new_model_config=None, samples=int(1e7), threads=None, n_sigma=3, use_cache=True):
+    """Check the analytic cell volumes against a stochastic volume calculation of the actual CSG.
+    All cells are sampled in one openmc.VolumeCalculation over a box tightly bounding the torus section.
+    Results are cached by geometry hash and number of samples, so repeated builds of the same geometry skip the calculation.
+
+    Parameters:
+    ----------
+    model : openmc.Model
+        Model made by make_model with the same configuration
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+    samples : int, optional
+        Number of points to sample. Default = 1e7
+    threads : int, optional
+        Number of OpenMP threads to run the volume calculation with. Default is all available.
+    n_sigma : float, optional
+        Analytic volumes further than this many standard deviations from the stochastic estimate are flagged.
+    use_cache : bool, optional
+        Whether to read and write cached results. Default = True
+
+    Returns:
+    -------
+    results : dict
+        key = cell name, value = dict with 'analytic', 'stochastic', 'std_dev' [cm3] and 'ok'
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    analytic_volumes = cell_volumes(model_config)
+
+    cache_file = CACHE_DIRECTORY / 'volumes' / f'{geometry_hash(model_config)}_{int(samples)}.json'
+    if use_cache and cache_file.exists():
+        with open(cache_file) as f:
+            stochastic_volumes = json.load(f)
+        print(f"Using cached volume check from {cache_file}")
+    else:
+        cells = {cell.name: cell for cell in model.geometry.get_all_cells().values()}
+        cells = {name: cells[name] for name in analytic_volumes}
+
+        # Tight box around the torus section, since that's where all the samples count
+        lower_left, upper_right = section_bounding_box(model_config)
+
+        volume_calculation = openmc.VolumeCalculation(list(cells.values()), int(samples), lower_left, upper_right)
+
+        original_calculations = model.settings.volume_calculations
+        model.settings.volume_calculations = [volume_calculation]
+        try:
+            with change_directory(tmpdir=True):
+                model.calculate_volumes(threads=threads, output=False, apply_volumes=False)
+        finally:
+            model.settings.volume_calculations = original_calculations
+
+        stochastic_volumes = {}
+        for name, cell in cells.items():
+            volume = volume_calculation.volumes[cell.id]
+            stochastic_volumes[name] = [volume.nominal_value, volume.std_dev]
+
+        if use_cache:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_file, 'w') as f:
+                json.dump(stochastic_volumes, f, indent=2)
+
+    results = {}
+    for name, analytic_volume in analytic_volumes.items():
+        stochastic_volume, std_dev = stochastic_volumes[name]
+        ok = abs(analytic_volume - stochastic_volume) <= n_sigma*std_dev
+        results[name] = {'analytic': analytic_volume,
+                         'stochastic': stochastic_volume,
+                         'std_dev': std_dev,
+                         'ok': ok}
+        if not ok and stochastic_volume == 0:
+            warnings.warn(f"No samples landed in {name} (analytic volume {analytic_volume:0.4e} cm3), use more samples to check it")
+        elif not ok:
+            warnings.warn(f"Analytic volume of {name} ({analytic_volume:0.4e} cm3) differs from the stochastic volume "
+                          f"({stochastic_volume:0.4e} +/- {std_dev:0.2e} cm3) by {(analytic_volume/stochastic_volume - 1)*100:0.2f}%")
+
+    return results
+
+def tally_results(statepoint, model, name):
+    """Get the results of one of the model's tallies as a tidy table, labeled by cell name
+
+    Parameters:
+    ----------
+    statepoint : openmc.StatePoint
+        Statepoint from running the model
+    model : openmc.Model
+        The model that was run, used to look up cell names
+    name : str
+        Name of the tally, i.e. 'layer_tally' or 'flux_spectrum'
+
+    Returns:
+    -------
+    results : pandas.DataFrame
+        One row per cell (and energy bin) and score, with columns 'cell_name', 'cell',
+        'score', 'mean' and 'std_dev' (and 'energy_low', 'energy_high' [eV] if binned in energy)
+    """
+
+    tally = statepoint.get_tally(name=name)
+    results = tally.get_pandas_dataframe()
+
+    cell_names = {cell_id: cell.name for cell_id, cell in model.geometry.get_all_cells().items()}
+    results.insert(0, 'cell_name', results['cell'].map(cell_names))
+    results = results.rename(columns={'std. dev.': 'std_dev',
+                                      'energy low [eV]': 'energy_low',
+                                      'energy high [eV]': 'energy_high'})
+    results = results.drop(columns='nuclide', errors='ignore')
+
+    return results
+
+def mesh_heating_results(statepoint, model, new_model_config=None, min_voxel_fraction=0.01):
+    """Get the heating and fast flux profiles of every layer from the 'heating_mesh' tally,
+    along with the average, peak and peaking factor of each.
+
+    Parameters:
+    ----------
+    statepoint : openmc.StatePoint
+        Statepoint from running a model made with 'heating_mesh' set
+    model : openmc.Model
+        The model that was run, used to look up cell names
+    new_model_config : dict, optional
+        The configuration the model was made with.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+    min_voxel_fraction : float, optional
+        Voxels with less than this fraction of their volume in a layer are left out of that layer's peak,
+        since the tiny slivers at the edge of a layer are very noisy. Default = 0.01
+
+    Returns:
+    -------
+    summary : pandas.DataFrame
+        One row per cell, with 'average_heating', 'peak_heating' [eV/source/cm3], 'heating_peaking_factor',
+        'average_fast_flux', 'peak_fast_flux' [particle-cm/source/cm3] and 'fast_flux_peaking_factor'
+    profiles : dict
+        key = cell name, value = dict of 'heating' and 'fast_flux' arrays (z, r) per unit volume,
+        NaN outside the layer. Also has 'r_grid' and 'z_grid'.
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    tally = statepoint.get_tally(name='heating_mesh')
+    mesh_filter, cell_filter, energy_filter = tally.filters
+    mesh = mesh_filter.mesh
+    n_r, n_phi, n_z = mesh.dimension
+    section_angle_rad = mesh.phi_grid[-1] - mesh.phi_grid[0]
+
+    # Mesh bins go with r fastest, then phi, then z
+    mean = tally.mean.reshape(n_z, n_phi, n_r, len(cell_filter.bins), len(energy_filter.bins), len(tally.scores)).sum(axis=1)
+    heating_index = [i for i, score in enumerate(tally.scores) if score.startswith('heating')][0]
+    flux_index = tally.scores.index('flux')
+    heating = mean[..., heating_index].sum(axis=-1)
+    fast_flux = mean[..., -1, flux_index] # The last energy bin is above 100 keV
+
+    volumes = voxel_cell_volumes(mesh.r_grid, mesh.z_grid, model_config, section_angle_rad)
+    full_voxel_volumes = 0.5*np.diff(np.asarray(mesh.r_grid)**2)[None, :] * np.diff(mesh.z_grid)[:, None] * section_angle_rad
+
+    cells = model.geometry.get_all_cells()
+    summary = []
+    profiles = {'r_grid': np.asarray(mesh.r_grid), 'z_grid': np.asarray(mesh.z_grid)}
+    for i, cell_id in enumerate(cell_filter.bins):
+        cell_name = cells[cell_id].name
+        cell_volume = volumes[cell_name]
+        in_layer = cell_volume > min_voxel_fraction*full_voxel_volumes
+
+        heating_density = np.full(cell_volume.shape, np.nan)
+        heating_density[in_layer] = heating[..., i][in_layer] / cell_volume[in_layer]
+        fast_flux_density = np.full(cell_volume.shape, np.nan)
+        fast_flux_density[in_layer] = fast_flux[..., i][in_layer] / cell_volume[in_layer]
+        profiles[cell_name] = {'heating': heating_density, 'fast_flux': fast_flux_density}
+
+        total_volume = np.sum(cell_volume)
+        average_heating = np.sum(heating[..., i]) / total_volume
+        average_fast_flux = np.sum(fast_flux[..., i]) / total_volume
+        peak_heating = np.nanmax(heating_density) if np.any(in_layer) else np.nan
+        peak_fast_flux = np.nanmax(fast_flux_density) if np.any(in_layer) else np.nan
+
+        summary.append({'cell_name': cell_name,
+                        'volume': total_volume,
+                        'average_heating': average_heating,
+                        'peak_heating': peak_heating,
+                        'heating_peaking_factor': peak_heating / average_heating,
+                        'average_fast_flux': average_fast_flux,
+                        'peak_fast_flux': peak_fast_flux,
+                        'fast_flux_peaking_factor': peak_fast_flux / average_fast_flux})
+
+    return pd.DataFrame(summary), profiles
+
+def convergence_report(statepoint, new_model_config=None, filename='convergence.json'):
+    """Record the uncertainty reached by each tally trigger, and whether it met its target
+
+    Parameters:
+    ----------
+    statepoint : openmc.StatePoint
+        Final statepoint of a run with 'tally_triggers' set
+    new_model_config : dict, optional
+        The configuration the model was made with.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+    filename : str, optional
+        JSON file to write the report to. If None, nothing is written.
+
+    Returns:
+    -------
+    report : dict
+        Number of batches run, and for each trigger the mean, standard deviation,
+        relative error, target and whether it converged
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    report = {'batches': statepoint.current_batch,
+              'max_batches': model_config['max_batches'],
+              'triggers': {}}
+    for target, threshold in (model_config['tally_triggers'] or {}).items():
+        tally = statepoint.get_tally(name=f'trigger_{target}')
+        mean = float(tally.mean.flat[0])
+        std_dev = float(tally.std_dev.flat[0])
+        relative_error = std_dev / mean if mean != 0 else float('inf')
+        report['triggers'][target] = {'mean': mean,
+                                      'std_dev': std_dev,
+                                      'relative_error': relative_error,
+                                      'target': threshold,
+                                      'converged': relative_error <= threshold}
+        if relative_error > threshold:
+            print(f"{target} did not converge: relative error {relative_error:0.2e} > {threshold:0.2e} after {statepoint.current_batch} batches")
+
+    if filename is not None:
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return report
+
+def fast_flux_results(statepoint, model, cell_names=('first_cm_cell', 'magnet_coil_cell'), threshold=1e5):
+    """Get the fast flux in some cells from the flux spectrum tally, e.g. the magnet flux that limits its lifetime
+
+    Parameters:
+    ----------
+    statepoint : openmc.StatePoint
+        Statepoint from running the model
+    model : openmc.Model
+        The model that was run, used to look up cell names
+    cell_names : list of str, optional
+        Cells to get the fast flux of. Default is the magnet.
+    threshold : float, optional
+        Lowest energy counted as fast [eV], must be an edge of the spectrum's energy bins. Default = 100 keV
+
+    Returns:
+    -------
+    results : pandas.DataFrame
+        One row per cell, like tally_results, with the score 'fast_flux'
+    """
+
+    spectrum = tally_results(statepoint, model, 'flux_spectrum')
+    if not np.isclose(spectrum['energy_low'], threshold).any():
+        raise ValueError(f"{threshold} eV is not an edge of the flux spectrum energy bins")
+
+    fast = spectrum[spectrum['cell_name'].isin(cell_names) & (spectrum['energy_low'] >= threshold * (1 - 1e-9))]
+    # Bins of the same tally are summed with their errors in quadrature, like openmc's Tally.summation
+    results = fast.groupby(['cell_name', 'cell'], as_index=False).agg(mean=('mean', 'sum'),
+                                                                       std_dev=('std_dev', lambda std_dev: np.sqrt(np.sum(std_dev**2))))
+    results.insert(2, 'score', 'fast_flux')
+
+    return results
+
+def figures_of_merit(statepoint, model, name='layer_tally', results=None):
+    """Calculate the figure of merit, 1/(R^2 T), of every bin of one of the model's tallies,
+    where R is the relative error and T is the transport time.
+    Use this to compare how quickly tallies converge with and without variance reduction.
+
+    Parameters:
+    ----------
+    statepoint : openmc.StatePoint
+        Statepoint from running the model
+    model : openmc.Model
+        The model that was run, used to look up cell names
+    name : str, optional
+        Name of the tally. Default = 'layer_tally'
+    results : pandas.DataFrame, optional
+        Results to use instead of the whole tally, e.g. from fast_flux_results
+
+    Returns:
+    -------
+    results : pandas.DataFrame
+        The tally_results table, with 'relative_error' and 'figure_of_merit' columns added
+    """
+
+    if results is None:
+        results = tally_results(statepoint, model, name)
+    else:
+        results = results.copy()
+    transport_time = statepoint.runtime['transport']
+
+    results['relative_error'] = results['std_dev'] / results['mean']
+    results['figure_of_merit'] = 1 / (results['relative_error']**2 * transport_time)
+
+    return results
+
+def generate_weight_windows(new_model_config=None, iterations=3, particles=int(1e5), batches=10, mesh_dimension=(100, 100), threads=None, use_cache=True):
+    """Generate weight windows for the model with MAGIC iterations.
+    Each iteration runs the model with the previous iteration's weight windows
+    and makes new ones from the flux it finds, pushing the windows deeper into the shield and magnet.
+    The final weight windows are cached by geometry hash.
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+    iterations : int, optional
+        Number of MAGIC iterations. Default = 3
+    particles : int, optional
+        Particles per batch in each iteration. Default = 1e5
+    batches : int, optional
+        Batches in each iteration. Default = 10
+    mesh_dimension : tuple of int, optional
+        Number of (r, z) bins of the weight window mesh. Default = (100, 100)
+    threads : int, optional
+        Number of OpenMP threads. Default is all available.
+    use_cache : bool, optional
+        Whether to reuse weight windows already made for this geometry. Default = True
+
+    Returns:
+    -------
+    weight_windows_file : pathlib.Path
+        Path to the weight_windows.h5 file
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    # Files from before only the final iteration was kept are in the parent directory and aren't used
+    weight_windows_file = CACHE_DIRECTORY / 'weight_windows' / 'final' / f'{geometry_hash(model_config)}.h5'
+    if use_cache and weight_windows_file.exists():
+        print(f"Using cached weight windows from {weight_windows_file}")
+        return weight_windows_file
+
+    model = make_model({**model_config,
+                        'variance_reduction': False,
+                        'verify_volumes': False,
+                        'cache_model': False,
+                        'heating_mesh': False,
+                        'batches': batches,
+                        'particles': particles})
+
+    # Cover the whole section, like the heating mesh
+    r_min, r_max, half_height = section_extent(model_config)
+    n_r, n_z = mesh_dimension
+    ww_mesh = openmc.CylindricalMesh(
+        r_grid=np.linspace(r_min, r_max, n_r + 1),
+        z_grid=np.linspace(-half_height, half_height, n_z + 1),
+        phi_grid=[0, 2*np.pi*section_correction(model_config)]
+    )
+
+    with change_directory(tmpdir=True):
+        for iteration in range(iterations):
+            # Only make the weight windows at the end of each iteration
+            wwg = openmc.WeightWindowGenerator(ww_mesh, np.logspace(-3, 8, 12))
+            wwg.max_realizations = batches
+            wwg.update_interval = batches
+            wwg.update_parameters = {'ratio' : 5.0,
+                                     'threshold': 0.5,
+                                     'value' : 'mean'}
+            model.settings.weight_window_generators = wwg
+
+            model.run(threads=threads, output=False)
+
+            # The file has the windows this iteration ran with followed by the new ones, so only keep the new ones
+            previous_ids = {ww.id for ww in model.settings.weight_windows}
+            weight_windows = [ww for ww in openmc.hdf5_to_wws('weight_windows.h5') if ww.id not in previous_ids]
+            model.settings.weight_windows = weight_windows
+            model.settings.weight_windows_on = True
+            ww_mesh = weight_windows[0].mesh # The next generator must use the same mesh object
+            print(f"Finished weight window iteration {iteration+1} of {iterations}")
+
+        weight_windows_file.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy('weight_windows.h5', weight_windows_file)
+        _keep_weight_windows(weight_windows_file, [ww.id for ww in weight_windows])
+
+    return weight_windows_file
+
+def _keep_weight_windows(path, ids):
+    """Remove every set of weight windows from a weight_windows.h5 file except the ones with the given ids"""
+    with h5py.File(path, 'a') as f:
+        group = f['weight_windows']
+        for name in list(group):
+            # Named weight_windows_<id>, which is also how openmc reads the id back
+            if int(name.split('_')[-1]) not in ids:
+                del group[name]
+        group.attrs['n_weight_windows'] = len(ids)
+        group.attrs['ids'] = np.array(ids, dtype=np.int32)
+
+def make_source(new_model_config=None):
+    """Create the fusion neutron source of the model
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    source : openmc.IndependentSource
+        D-T neutron source
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    source = openmc.IndependentSource()
+    source.particle = 'neutron'
+    # This source shape is a thin wire in the plasma core
+    radius = openmc.stats.Discrete([model_config['major_radius']], [1])
+    z_values = openmc.stats.Discrete([0], [1])
+    angle = openmc.stats.Uniform(a=np.radians(0), b=np.radians(model_config['section_angle']))
+    source.space = openmc.stats.CylindricalIndependent(
+        r=radius, phi=angle, z=z_values, origin=(0., 0., 0.))
+    source.angle = openmc.stats.Isotropic() # Isotropic directio neutron is launched
+    source.energy = openmc.stats.muir(e0=14.08e6, m_rat=5, kt=20000)
+
+    return source
+
+def check_source_bank_size(new_model_config=None):
+    """Warn if a run would go through the pre-sampled source bank more than once.
+    Replayed source sites make the batches correlated, so the reported uncertainties come out too small.
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+
+    Returns:
+    -------
+    float
+        Number of times each source site is used on average
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    final_batch = model_config['max_batches'] if model_config['tally_triggers'] else model_config['batches']
+    histories = model_config['particles'] * final_batch
+    replays = histories / model_config['source_bank_size']
+    if replays > 1:
+        warnings.warn(f"Up to {histories:0.2e} histories will reuse a bank of {model_config['source_bank_size']:0.2e} source sites "
+                      f"{replays:0.1f} times each, so the uncertainties will be underestimated. "
+                      f"Set 'source_bank_size' to at least the number of histories.")
+    return replays
+
+def presample_source(new_model_config=None, use_cache=True):
+    """Sample a bank of 'source_bank_size' particles from the model's source and save it as a source file.
+    The bank is cached by a hash of the source definition, so any model with the same source reuses it
+    and the source distribution is only evaluated once.
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+    use_cache : bool, optional
+        Whether to reuse a bank already made for this source. Default = True
+
+    Returns:
+    -------
+    source_file : pathlib.Path
+        Path to the source.h5 file
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    check_source_bank_size(model_config)
+
+    source = make_source(model_config)
+    source_definition = ET.tostring(source.to_xml_element(), encoding='unicode')
+    key = config_hash({'source': source_definition, 'particles': int(model_config['source_bank_size'])})
+    source_file = CACHE_DIRECTORY / 'sources' / key / 'source.h5'
+    if use_cache and source_file.exists():
+        print(f"Using cached source bank from {source_file}")
+        return source_file
+
+    # openmc.lib needs a whole model to sample from, even though only the source is used
+    model = make_model({**model_config,
+                        'presampled_source': False,
+                        'variance_reduction': False,
+                        'verify_volumes': False,
+                        'cache_model': False,
+                        'machine_profile': False})
+
+    with change_directory(tmpdir=True):
+        model.export_to_xml()
+        openmc.lib.init(output=False)
+        try:
+            particles = openmc.lib.sample_external_source(int(model_config['source_bank_size']))
+        finally:
+            openmc.lib.finalize()
+
+    source_file.parent.mkdir(parents=True, exist_ok=True)
+    openmc.write_source_file(particles, source_file)
+    print(f"Saved {len(particles)} source particles to {source_file}")
+
+    return source_file
+
+def torus_bounding_region(torus):
+    """Make a region of cheap z-cylinders and z-planes that encloses everything inside a ZTorus.
+    Putting this first in a cell's region lets OpenMC rule out most points
+    without ever evaluating the quartic torus surfaces.
+
+    Parameters:
+    ----------
+    torus : openmc.ZTorus
+        Outermost surface of the cell, centered on the origin
+
+    Returns:
+    -------
+    bounds : openmc.Intersection
+        Region containing the inside of the torus
+    """
+
+    outer_cylinder = openmc.ZCylinder(r=torus.a + torus.c)
+    upper_plane = openmc.ZPlane(z0=torus.b)
+    lower_plane = openmc.ZPlane(z0=-torus.b)
+    bounds = -outer_cylinder & -upper_plane & +lower_plane
+
+    # Only add the inner cylinder if there is a hole in the middle
+    if torus.a > torus.c:
+        inner_cylinder = openmc.ZCylinder(r=torus.a - torus.c)
+        bounds &= +inner_cylinder
+
+    return bounds
+
+def add_bounding_region(cell, bounds):
+    """Put a bounding region at the front of a cell's region, keeping it a flat intersection
+
+    Parameters:
+    ----------
+    cell : openmc.Cell
+        Cell to modify
+    bounds : openmc.Intersection
+        Region that encloses the cell, e.g. from torus_bounding_region
+    """
+    if isinstance(cell.region, openmc.Intersection):
+        cell.region = openmc.Intersection([*bounds, *cell.region])
+    else:
+        cell.region = openmc.Intersection([*bounds, cell.region])
+
+def machine_profile_settings(new_model_config=None, profile=None):
+    """Batch settings that run the same total number of histories as a configuration,
+    but with the particles per batch recommended by a machine profile from barc_blanket.autotune
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Dictionary containing the model configuration.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+    profile : dict, optional
+        Machine profile. Default is this machine's, from load_machine_profile.
+
+    Returns:
+    -------
+    dict
+        'particles', 'batches', 'max_batches', 'trigger_batch_interval' and 'statepoint_interval' to use.
+        The configuration's own values if there is no profile.
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+    if profile is None:
+        profile = load_machine_profile()
+
+    batch_keys = ['batches', 'max_batches', 'trigger_batch_interval', 'statepoint_interval']
+    settings = {key: model_config[key] for key in ['particles'] + batch_keys}
+    if profile is None:
+        return settings
+
+    # Everything counted in batches is scaled, so the same number of histories go by between statepoints and trigger checks too
+    particles = int(profile['recommended']['particles'])
+    scale = model_config['particles'] / particles
+    settings = {'particles': particles}
+    for key in batch_keys:
+        settings[key] = max(int(round(model_config[key] * scale)), 1)
+    settings['max_batches'] = max(settings['max_batches'], settings['batches'])
+    return settings
+
 def make_model(new_model_config=None):
     """Create an OpenMC model using the given configuration
     
@@ -191,68 +1294,91 @@ def make_model(new_model_config=None):
             else:
                 print(f"Using set value for {key}:\t {model_config[key]}")
 
+    if model_config['heating_mesh'] and model_config['midplane_split']:
+        raise ValueError("heating_mesh gives the peaking factors on its own, so it can't be used with midplane_split")
+
+    # The periodic planes have to cross on the z axis and leave a wedge in between
+    if not 0 < model_config['section_angle'] < 180:
+        raise ValueError(f"section_angle must be between 0 and 180 degrees, but got {model_config['section_angle']}")
+
+    multigroup = model_config['energy_mode'] == 'multi-group'
+    if multigroup:
+        if model_config['mgxs_library'] is None:
+            raise ValueError("Must provide an mgxs_library to run in multi-group mode")
+        if model_config['heating_mesh'] or model_config['tally_triggers'] or model_config['photon_transport']:
+            raise ValueError("Multi-group mode can only tally flux, so it can't be used with heating_mesh, tally_triggers or photon_transport")
+    elif model_config['energy_mode'] != 'continuous-energy':
+        raise ValueError(f"Invalid energy_mode: {model_config['energy_mode']}")
+
+    if model_config['machine_profile'] and (new_model_config is None or 'particles' not in new_model_config):
+        profile_settings = machine_profile_settings(model_config)
+        print(f"Using machine profile: {profile_settings['particles']} particles x {profile_settings['batches']} batches")
+        model_config = {**model_config, **profile_settings}
+
+    if model_config['cache_model']:
+        # Reuse a model built earlier in this process, or one exported by an earlier run
+        key = model_cache_key(model_config)
+        model_file = CACHE_DIRECTORY / 'models' / key / 'model.xml'
+        if key in _MODEL_CACHE:
+            _MODEL_CACHE.move_to_end(key)
+            return copy.deepcopy(_MODEL_CACHE[key])
+        if model_file.exists():
+            print(f"Loading cached model from {model_file}")
+            model = openmc.Model.from_model_xml(model_file)
+            _cache_model(key, model)
+            return model
+
     #####################
     ## Define Geometry ##
     #####################
 
+    radii = layer_radii(model_config)
+    volumes = cell_volumes(model_config)
+
     R = model_config['major_radius']
     a = model_config['minor_radius']
     elongation = model_config['elongation']
     b=elongation*a
 
-    first_wall_thickness = model_config['first_wall_thickness']
-    cooling_channel_width = model_config['cooling_channel_width']
-    cooling_vessel_thickness = model_config['cooling_vessel_thickness']
-    vacuum_vessel_thickness = model_config['vacuum_vessel_thickness']
-    blanket_vessel_thickness = model_config['blanket_vessel_thickness']
-    neutron_shield_thickness = model_config['shield_thickness']
-    inner_magnet_case_thickness = model_config['thermal_shield_thickness'] + model_config['magnetcase_thickness']
-    # ^ this includes the thermal shield, being of the same material
-    outer_magnet_case_thickness = model_config['magnetcase_thickness']
-    magnet_coil_thickness = model_config['magnet_thickness']
-
     # Taking the provided minor radius as the smaller one
     # This is gonna make the thicknesses on the top and bottom a little bigger,
     # but I don't think that will make a significant difference
     plasma_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=R,b=b,c=a)
 
-    first_wall_inner_radius = a
-    first_wall_outer_radius = a + first_wall_thickness
+    first_wall_inner_radius = radii['first_wall_inner']
+    first_wall_outer_radius = radii['first_wall_outer']
     first_wall_inner_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=R,b=first_wall_inner_radius*elongation,c=first_wall_inner_radius)
     first_wall_outer_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=R,b=first_wall_outer_radius*elongation,c=first_wall_outer_radius)
 
-    cooling_vessel_inner_radius = first_wall_outer_radius + cooling_channel_width
-    cooling_vessel_outer_radius = cooling_vessel_inner_radius + cooling_vessel_thickness
+    cooling_vessel_inner_radius = radii['cooling_vessel_inner']
+    cooling_vessel_outer_radius = radii['cooling_vessel_outer']
     cooling_vessel_inner_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=R,b=cooling_vessel_inner_radius*elongation,c=cooling_vessel_inner_radius)
     cooling_vessel_outer_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=R,b=cooling_vessel_outer_radius*elongation,c=cooling_vessel_outer_radius)
 
-    vacuum_vessel_inner_radius = cooling_vessel_outer_radius # These two are in contact
-    vacuum_vessel_outer_radius = vacuum_vessel_inner_radius + vacuum_vessel_thickness
-    vacuum_vessel_inner_surface = cooling_vessel_outer_surface
+    vacuum_vessel_outer_radius = radii['vacuum_vessel_outer']
+    vacuum_vessel_inner_surface = cooling_vessel_outer_surface # These two are in contact
     vacuum_vessel_outer_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=R,b=vacuum_vessel_outer_radius*elongation,c=vacuum_vessel_outer_radius)
 
-    # Since the blanket is sorta offset by the gaps, I'm just modeling it as torus with a different major radius
-    blanket_vessel_offset = (model_config['blanket_outboard_gap'] - model_config['blanket_inboard_gap'])/2
-    blanket_vessel_average_width = (model_config['blanket_outboard_gap'] + model_config['blanket_inboard_gap'])/2
-    blanket_vessel_major_radius = R + blanket_vessel_offset
-    blanket_vessel_inner_radius = vacuum_vessel_outer_radius + blanket_vessel_average_width
-    blanket_vessel_outer_radius = blanket_vessel_inner_radius + blanket_vessel_thickness
+    # The blanket is offset by the gaps, so it and everything outside it uses a different major radius
+    blanket_vessel_major_radius = radii['blanket_vessel_major_radius']
+    blanket_vessel_inner_radius = radii['blanket_vessel_inner']
+    blanket_vessel_outer_radius = radii['blanket_vessel_outer']
     blanket_vessel_inner_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=blanket_vessel_major_radius,b=blanket_vessel_inner_radius*elongation*0.8,c=blanket_vessel_inner_radius)
     blanket_vessel_outer_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=blanket_vessel_major_radius,b=blanket_vessel_outer_radius*elongation*0.8,c=blanket_vessel_outer_radius)
 
     # outer layers: neutron shield, thermal shield, magnet case, magnet coil, magnet case
     # the inner surface of the neutron shield is coincident with the blanket vessel
-    neutron_shield_outer_radius = blanket_vessel_outer_radius + neutron_shield_thickness
+    neutron_shield_outer_radius = radii['neutron_shield_outer']
     neutron_shield_outer_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=blanket_vessel_major_radius,b=neutron_shield_outer_radius*elongation*0.8,c=neutron_shield_outer_radius)
     # in this case, the thermal shield and magnet case are also combined because they are of the same material
-    inner_case_outer_radius = neutron_shield_outer_radius + inner_magnet_case_thickness
+    inner_case_outer_radius = radii['inner_case_outer']
     inner_case_outer_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=blanket_vessel_major_radius,b=inner_case_outer_radius*elongation*0.8,c=inner_case_outer_radius)
-    magnet_coil_outer_radius = inner_case_outer_radius + magnet_coil_thickness
+    magnet_coil_outer_radius = radii['magnet_coil_outer']
     magnet_coil_outer_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=blanket_vessel_major_radius,b=magnet_coil_outer_radius*elongation*0.8,c=magnet_coil_outer_radius)
-    outer_case_outer_radius = magnet_coil_outer_radius + outer_magnet_case_thickness
+    outer_case_outer_radius = radii['outer_case_outer']
     outer_case_outer_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=blanket_vessel_major_radius,b=outer_case_outer_radius*elongation*0.8,c=outer_case_outer_radius, boundary_type='vacuum')
 
-    firstcm_outer_radius = inner_case_outer_radius+1
+    firstcm_outer_radius = radii['firstcm_outer']
     firstcm_outer_surface = openmc.ZTorus(x0=0,y0=0,z0=0,a=blanket_vessel_major_radius,b=firstcm_outer_radius*elongation*0.8,c=firstcm_outer_radius)
     
     midplane_upper_bound = openmc.ZPlane(z0=MIDPLANE_OFFSET)
@@ -262,7 +1388,7 @@ def make_model(new_model_config=None):
 
     # Make two planes to cut the torus into a section
     # Angle follows right hand rule around z axis (https://www.desmos.com/3d/214a6bb908)
-    section_angle_rad = np.radians(360*SECTION_CORRECTION)
+    section_angle_rad = np.radians(model_config['section_angle'])
     x_coeff, y_coeff = np.sin(section_angle_rad), -np.cos(section_angle_rad)
     xz_plane = openmc.Plane(a=0, b=1, boundary_type='periodic')
     angled_plane = openmc.Plane(a=x_coeff, b=y_coeff, boundary_type='periodic')
@@ -281,7 +1407,7 @@ def make_model(new_model_config=None):
         region=+first_wall_inner_surface & -first_wall_outer_surface & torus_section,
         fill=model_config['first_wall_material']
     )
-    first_wall_total_volume = total_layer_volume(R,first_wall_inner_radius,first_wall_outer_radius, elongation)
+    first_wall_cell.fill.volume = volumes['first_wall_cell']
     if model_config['midplane_split']:
         first_wall_midpl = openmc.Cell(
             name='first_wall_midpl',
@@ -289,18 +1415,14 @@ def make_model(new_model_config=None):
             fill=copy.deepcopy(model_config['first_wall_material'])
         )
         first_wall_cell.region = first_wall_cell.region & ~midpl
-        first_wall_midpl_volume = peaking_sector_volume(R,first_wall_inner_radius,first_wall_outer_radius,first_wall_inner_radius*elongation,first_wall_outer_radius*elongation)
-        first_wall_cell.fill.volume = first_wall_total_volume - first_wall_midpl_volume
-        first_wall_midpl.fill.volume = first_wall_midpl_volume
-    else:
-        first_wall_cell.fill.volume = first_wall_total_volume
+        first_wall_midpl.fill.volume = volumes['first_wall_midpl']
 
     cooling_channel_cell = openmc.Cell(
         name='cooling_channel_cell',
         region=+first_wall_outer_surface & -cooling_vessel_inner_surface & torus_section,
         fill=copy.deepcopy(model_config['blanket_material'])
     )
-    cooling_channel_total_volume = total_layer_volume(R,first_wall_outer_radius,cooling_vessel_inner_radius, elongation)
+    cooling_channel_cell.fill.volume = volumes['cooling_channel_cell']
     if model_config['midplane_split']:
         cooling_channel_midpl = openmc.Cell(
             name='cooling_channel_midpl',
@@ -308,18 +1430,14 @@ def make_model(new_model_config=None):
             fill=copy.deepcopy(model_config['blanket_material'])
         )
         cooling_channel_cell.region = cooling_channel_cell.region & ~midpl
-        cooling_channel_midpl_volume = peaking_sector_volume(R,first_wall_outer_radius,cooling_vessel_inner_radius,first_wall_outer_radius*elongation,cooling_vessel_inner_radius*elongation)
-        cooling_channel_cell.fill.volume = cooling_channel_total_volume - cooling_channel_midpl_volume
-        cooling_channel_midpl.fill.volume = cooling_channel_midpl_volume
-    else:
-        cooling_channel_cell.fill.volume = cooling_channel_total_volume
+        cooling_channel_midpl.fill.volume = volumes['cooling_channel_midpl']
 
     cooling_vessel_cell = openmc.Cell(
         name='cooling_vessel_cell',
         region=+cooling_vessel_inner_surface & -cooling_vessel_outer_surface & torus_section,
         fill=model_config['cooling_vessel_material']
     )
-    cooling_vessel_total_volume = total_layer_volume(R,cooling_vessel_inner_radius,cooling_vessel_outer_radius, elongation)
+    cooling_vessel_cell.fill.volume = volumes['cooling_vessel_cell']
     if model_config['midplane_split']:
         cooling_vessel_midpl = openmc.Cell(
             name='cooling_vessel_midpl',
@@ -327,18 +1445,14 @@ def make_model(new_model_config=None):
             fill=copy.deepcopy(model_config['cooling_vessel_material'])
         )
         cooling_vessel_cell.region = cooling_vessel_cell.region & ~midpl
-        cooling_vessel_midpl_volume = peaking_sector_volume(R,cooling_vessel_inner_radius,cooling_vessel_outer_radius,cooling_vessel_inner_radius*elongation,cooling_vessel_outer_radius*elongation)
-        cooling_vessel_cell.fill.volume = cooling_vessel_total_volume - cooling_vessel_midpl_volume
-        cooling_vessel_midpl.fill.volume = cooling_vessel_midpl_volume
-    else:
-        cooling_vessel_cell.fill.volume = cooling_vessel_total_volume
+        cooling_vessel_midpl.fill.volume = volumes['cooling_vessel_midpl']
 
     vacuum_vessel_cell = openmc.Cell(
         name='vacuum_vessel_cell',
         region=+vacuum_vessel_inner_surface & -vacuum_vessel_outer_surface & torus_section,
         fill=model_config['vacuum_vessel_material']
     )
-    vacuum_vessel_total_volume = total_layer_volume(R,vacuum_vessel_inner_radius,vacuum_vessel_outer_radius, elongation)
+    vacuum_vessel_cell.fill.volume = volumes['vacuum_vessel_cell']
     if model_config['midplane_split']:
         vacuum_vessel_midpl = openmc.Cell(
             name='vacuum_vessel_midpl',
@@ -346,28 +1460,21 @@ def make_model(new_model_config=None):
             fill=copy.deepcopy(model_config['vacuum_vessel_material'])
         )
         vacuum_vessel_cell.region = vacuum_vessel_cell.region & ~midpl
-        vacuum_vessel_midpl_volume = peaking_sector_volume(R,vacuum_vessel_inner_radius,vacuum_vessel_outer_radius,vacuum_vessel_inner_radius*elongation,vacuum_vessel_outer_radius*elongation)
-        vacuum_vessel_cell.fill.volume = vacuum_vessel_total_volume - vacuum_vessel_midpl_volume
-        vacuum_vessel_midpl.fill.volume = vacuum_vessel_midpl_volume
-    else:
-        vacuum_vessel_cell.fill.volume = vacuum_vessel_total_volume
+        vacuum_vessel_midpl.fill.volume = volumes['vacuum_vessel_midpl']
 
-    # Volume of blanket is calculated differently because it has two non-concentric ellipses in its poloidal xs
     blanket_cell = openmc.Cell(
         name='blanket_cell',
         region=+vacuum_vessel_outer_surface & -blanket_vessel_inner_surface & torus_section,
         fill=model_config['blanket_material']
     )
-    enclosed_volume = (2*np.pi*blanket_vessel_major_radius)*np.pi*blanket_vessel_inner_radius**2*elongation*0.8
-    removed_volume = (2*np.pi*R)*np.pi*vacuum_vessel_outer_radius**2*elongation
-    blanket_cell.fill.volume = (enclosed_volume - removed_volume) * SECTION_CORRECTION
+    blanket_cell.fill.volume = volumes['blanket_cell']
 
     blanket_vessel_cell = openmc.Cell(
         name='blanket_vessel_cell',
         region=+blanket_vessel_inner_surface & -blanket_vessel_outer_surface & torus_section,
         fill=model_config['blanket_vessel_material']
     )
-    total_blanket_vessel_volume = total_layer_volume(blanket_vessel_major_radius,blanket_vessel_inner_radius,blanket_vessel_outer_radius, elongation)
+    blanket_vessel_cell.fill.volume = volumes['blanket_vessel_cell']
     if model_config['midplane_split']:
         blanket_vessel_midpl = openmc.Cell(
             name='blanket_vessel_midpl',
@@ -375,47 +1482,84 @@ def make_model(new_model_config=None):
             fill=copy.deepcopy(model_config['blanket_vessel_material'])
         )
         blanket_vessel_cell.region = blanket_vessel_cell.region & ~midpl
-        blanket_vessel_midpl_volume = peaking_sector_volume(blanket_vessel_major_radius,blanket_vessel_inner_radius,blanket_vessel_outer_radius,blanket_vessel_inner_radius*elongation,blanket_vessel_outer_radius*elongation)
-        blanket_vessel_cell.fill.volume = total_blanket_vessel_volume - blanket_vessel_midpl_volume
-        blanket_vessel_midpl.fill.volume = blanket_vessel_midpl_volume
-    else:
-        blanket_vessel_cell.fill.volume = total_blanket_vessel_volume
+        blanket_vessel_midpl.fill.volume = volumes['blanket_vessel_midpl']
 
     neutron_shield_cell = openmc.Cell(
         name='neutron_shield_cell',
         region=+blanket_vessel_outer_surface & -neutron_shield_outer_surface & torus_section,
         fill=model_config['magnetcase_material']
     )
-    neutron_shield_cell.fill.volume = total_layer_volume(blanket_vessel_major_radius,blanket_vessel_outer_radius,neutron_shield_outer_radius, elongation)
+    neutron_shield_cell.fill.volume = volumes['neutron_shield_cell']
 
     inner_case_cell = openmc.Cell(
         name='inner_case_cell',
         region=+neutron_shield_outer_surface & -inner_case_outer_surface & torus_section,
         fill=model_config['magnetcase_material']
     )
-    inner_case_cell.fill.volume = total_layer_volume(blanket_vessel_major_radius,neutron_shield_outer_radius,inner_case_outer_radius, elongation)
+    inner_case_cell.fill.volume = volumes['inner_case_cell']
 
     first_cm_cell = openmc.Cell(
         name='first_cm_cell',
         region=+inner_case_outer_surface & -firstcm_outer_surface & midpl & torus_section,
         fill=model_config['magnet_material']
     )
-    first_cm_cell.fill.volume = peaking_sector_volume(blanket_vessel_major_radius,inner_case_outer_radius,firstcm_outer_radius,inner_case_outer_radius*elongation*0.8,firstcm_outer_radius*elongation*0.8)
+    first_cm_cell.fill.volume = volumes['first_cm_cell']
 
     magnet_coil_cell = openmc.Cell(
         name='magnet_coil_cell',
         region=+inner_case_outer_surface & -magnet_coil_outer_surface & torus_section & ~first_cm_cell.region,
         fill=model_config['magnet_material']
     )
-    magnet_coil_cell.fill.volume = total_layer_volume(blanket_vessel_major_radius,inner_case_outer_radius,magnet_coil_outer_radius, elongation) - \
-        peaking_sector_volume(blanket_vessel_major_radius,inner_case_outer_radius,firstcm_outer_radius,inner_case_outer_radius*elongation*0.8,firstcm_outer_radius*elongation*0.8)
+    magnet_coil_cell.fill.volume = volumes['magnet_coil_cell']
 
     outer_case_cell = openmc.Cell(
         name='outer_case_cell',
         region=+magnet_coil_outer_surface & -outer_case_outer_surface & torus_section,
         fill=model_config['magnetcase_material']
     )
-    outer_case_cell.fill.volume = total_layer_volume(blanket_vessel_major_radius,magnet_coil_outer_radius,outer_case_outer_radius, elongation)
+    outer_case_cell.fill.volume = volumes['outer_case_cell']
+
+    if model_config['bounding_regions']:
+        # Each cell is enclosed by the outermost torus it touches
+        outer_surfaces = {
+            'plasma_cell': plasma_surface,
+            'first_wall': first_wall_outer_surface,
+            'cooling_channel': cooling_vessel_inner_surface,
+            'cooling_vessel': cooling_vessel_outer_surface,
+            'vacuum_vessel': vacuum_vessel_outer_surface,
+            'blanket_cell': blanket_vessel_inner_surface,
+            'blanket_vessel': blanket_vessel_outer_surface,
+            'neutron_shield_cell': neutron_shield_outer_surface,
+            'inner_case_cell': inner_case_outer_surface,
+            'first_cm_cell': firstcm_outer_surface,
+            'magnet_coil_cell': magnet_coil_outer_surface,
+            'outer_case_cell': outer_case_outer_surface,
+        }
+        bounded_cells = {
+            'plasma_cell': [plasma_cell],
+            'first_wall': [first_wall_cell],
+            'cooling_channel': [cooling_channel_cell],
+            'cooling_vessel': [cooling_vessel_cell],
+            'vacuum_vessel': [vacuum_vessel_cell],
+            'blanket_cell': [blanket_cell],
+            'blanket_vessel': [blanket_vessel_cell],
+            'neutron_shield_cell': [neutron_shield_cell],
+            'inner_case_cell': [inner_case_cell],
+            'first_cm_cell': [first_cm_cell],
+            'magnet_coil_cell': [magnet_coil_cell],
+            'outer_case_cell': [outer_case_cell],
+        }
+        if model_config['midplane_split']:
+            bounded_cells['first_wall'].append(first_wall_midpl)
+            bounded_cells['cooling_channel'].append(cooling_channel_midpl)
+            bounded_cells['cooling_vessel'].append(cooling_vessel_midpl)
+            bounded_cells['vacuum_vessel'].append(vacuum_vessel_midpl)
+            bounded_cells['blanket_vessel'].append(blanket_vessel_midpl)
+
+        for layer, cells in bounded_cells.items():
+            bounds = torus_bounding_region(outer_surfaces[layer])
+            for cell in cells:
+                add_bounding_region(cell, bounds)
 
     universe = openmc.Universe(
         cells=[
@@ -443,176 +1587,139 @@ def make_model(new_model_config=None):
 
     geometry = openmc.Geometry(universe)
 
+    if multigroup:
+        # Each cell gets its own macroscopic cross sections, collapsed with that cell's spectrum
+        mg_materials = openmc.Materials()
+        mg_materials.cross_sections = str(model_config['mgxs_library'])
+        for cell in universe.cells.values():
+            if cell.fill is None:
+                continue
+            material = openmc.Material(name=cell.name)
+            material.set_density('macro', 1.0)
+            material.add_macroscopic(cell.name)
+            material.volume = volumes.get(cell.name)
+            cell.fill = material
+            mg_materials.append(material)
+
     #####################
     ## Define Settings ##
     #####################
 
-    source = openmc.IndependentSource()
-    source.particle = 'neutron'
-    # This source shape is a thin wire in the plasma core
-    radius = openmc.stats.Discrete([R], [1])
-    z_values = openmc.stats.Discrete([0], [1])
-    angle = openmc.stats.Uniform(a=np.radians(0), b=section_angle_rad)
-    source.space = openmc.stats.CylindricalIndependent(
-        r=radius, phi=angle, z=z_values, origin=(0., 0., 0.))
-    source.angle = openmc.stats.Isotropic() # Isotropic directio neutron is launched
-    source.energy = openmc.stats.muir(e0=14.08e6, m_rat=5, kt=20000)
+    if model_config['presampled_source']:
+        source = openmc.FileSource(presample_source(model_config))
+    else:
+        source = make_source(model_config)
 
     settings = openmc.Settings(run_mode='fixed source')
+    settings.energy_mode = model_config['energy_mode']
     settings.photon_transport = model_config['photon_transport']
     settings.source = source
     settings.batches = model_config['batches']
     settings.particles = int(model_config['particles'])
-    # Make statepoints every 10 batches, ensuring the final batch is always included
-    statepoint_set = set([i for i in range(10, model_config['batches']+1, 10)])
-    statepoint_set.add(model_config['batches'])
+    # Make statepoints every statepoint_interval batches, ensuring the final batch is always included
+    final_batch = model_config['max_batches'] if model_config['tally_triggers'] else model_config['batches']
+    interval = model_config['statepoint_interval']
+    statepoint_set = set([i for i in range(interval, final_batch+1, interval)])
+    statepoint_set.add(final_batch)
     settings.statepoint = {'batches': list(statepoint_set)}
     settings.output = {'tallies': True}
 
-    # # create weight windows for global variance reduction
-    # ww_mesh = openmc.CylindricalMesh()
-    # ww_mesh.r_grid = np.linspace((blanket_vessel_major_radius - outer_case_outer_radius), (blanket_vessel_major_radius + outer_case_outer_radius), 100)
-    # ww_mesh.z_grid = np.linspace((0 - outer_case_outer_radius*elongation*0.8),(outer_case_outer_radius*elongation*0.8),100)
-    # ww_mesh.phi_grid = [0, section_angle_rad]
-    # ww_mesh_filter = openmc.MeshFilter(ww_mesh,filter_id=99)
-    
-    # wwg = openmc.WeightWindowGenerator(ww_mesh,np.logspace(-3, 8, 12))
-    # wwg.max_realizations = 10
-    # wwg.update_interval = 2
-    # wwg.update_parameters = {'ratio' : 5.0,
-    #                          'threshold': 0.5,
-    #                          'value' : 'mean'}
-    # settings.weight_window_generators = wwg
+    if model_config['variance_reduction']:
+        # Global variance reduction, using weight windows from a few MAGIC iterations of this geometry
+        weight_windows = openmc.hdf5_to_wws(generate_weight_windows(model_config))
+        for ww in weight_windows:
+            ww.mesh.id = None # Avoid clashing with the ids of the meshes in this model
+        settings.weight_windows = weight_windows
+        settings.weight_windows_on = True
 
     #####################
     ## Define Tallies  ##
     #####################
 
-    first_wall_cell_filter = openmc.CellFilter([first_wall_cell])
-    vacuum_vessel_cell_filter = openmc.CellFilter([vacuum_vessel_cell])
-    cooling_channel_cell_filter = openmc.CellFilter([cooling_channel_cell])
-    cooling_vessel_cell_filter = openmc.CellFilter([cooling_vessel_cell])
-    blanket_cell_filter = openmc.CellFilter([blanket_cell])
-    blanket_vessel_cell_filter = openmc.CellFilter([blanket_vessel_cell])
-    if model_config['midplane_split']:
-        first_wall_midpl_filter = openmc.CellFilter([first_wall_midpl])
-        cooling_channel_midpl_filter = openmc.CellFilter([cooling_channel_midpl])
-        cooling_vessel_midpl_filter = openmc.CellFilter([cooling_vessel_midpl])
-        vacuum_vessel_midpl_filter = openmc.CellFilter([vacuum_vessel_midpl])
-        blanket_vessel_midpl_filter = openmc.CellFilter([blanket_vessel_midpl])
-    
-    magnetmat_filter = openmc.MaterialFilter([model_config['magnet_material']])
-    first_cm_filter = openmc.CellFilter([first_cm_cell])
-
-    # Tallies for flux and TBR in flibe mixture
-    flibe_cell_filter = openmc.CellFilter([cooling_channel_cell, blanket_cell])
-    energy_filter = openmc.EnergyFilter(np.logspace(0,7)) # 1eV to 100MeV
-
-    flux_tally = openmc.Tally(tally_id=1, name="flux_blanket")
-    flux_tally.filters = [flibe_cell_filter,energy_filter]
-    flux_tally.scores = ["flux"]
-
-    tbr_tally = openmc.Tally(tally_id=2, name='TBR')
-    tbr_tally.filters = [flibe_cell_filter]
-    tbr_tally.scores = ['(n,Xt)']
+    # All tallies are by cell, so every layer shares one filter and results are looked up by cell name
+    all_cells = list(universe.cells.values())
+    cell_filter = openmc.CellFilter(all_cells)
 
     # Tallies for neutron power deposition in each layer
     if model_config['photon_transport'] is True:
-        heating_tally_type = ['heating']
+        heating_tally_type = 'heating'
     elif model_config['photon_transport'] is False:
-        heating_tally_type = ['heating-local']
-
-    first_wall_heating_tally = openmc.Tally(tally_id=3, name='neutron_heating_first_wall')
-    first_wall_heating_tally.filters = [first_wall_cell_filter]
-    first_wall_heating_tally.scores = heating_tally_type
-
-    cooling_channel_heating_tally = openmc.Tally(tally_id=4, name='neutron_heating_cooling_channel')
-    cooling_channel_heating_tally.filters = [cooling_channel_cell_filter]
-    cooling_channel_heating_tally.scores = heating_tally_type
-
-    cooling_vessel_heating_tally = openmc.Tally(tally_id=5, name='neutron_heating_cooling_vessel')
-    cooling_vessel_heating_tally.filters = [cooling_vessel_cell_filter]
-    cooling_vessel_heating_tally.scores = heating_tally_type
-
-    vacuum_vessel_heating_tally = openmc.Tally(tally_id=6, name='neutron_heating_vacuum_vessel')
-    vacuum_vessel_heating_tally.filters = [vacuum_vessel_cell_filter]
-    vacuum_vessel_heating_tally.scores = heating_tally_type
-
-    blanket_heating_tally = openmc.Tally(tally_id=7, name='neutron_heating_blanket')
-    blanket_heating_tally.filters = [blanket_cell_filter]
-    blanket_heating_tally.scores = heating_tally_type
-    
-    blanket_vessel_heating_tally = openmc.Tally(tally_id=8, name='neutron_heating_blanket_vessel')
-    blanket_vessel_heating_tally.filters = [blanket_vessel_cell_filter]
-    blanket_vessel_heating_tally.scores = heating_tally_type
-
-    if model_config['midplane_split']:
-        first_wall_midplane_tally = openmc.Tally(tally_id=23, name='neutron_heating_first_wall_midplane')
-        first_wall_midplane_tally.filters = [first_wall_midpl_filter]
-        first_wall_midplane_tally.scores = heating_tally_type
-
-        cooling_channel_midpl_tally = openmc.Tally(tally_id=24, name='neutron_heating_cooling_channel_midplane')
-        cooling_channel_midpl_tally.filters = [cooling_channel_midpl_filter]
-        cooling_channel_midpl_tally.scores = heating_tally_type
-
-        cooling_vessel_midpl_tally = openmc.Tally(tally_id=25, name='neutron_heating_cooling_vessel_midplane')
-        cooling_vessel_midpl_tally.filters = [cooling_vessel_midpl_filter]
-        cooling_vessel_midpl_tally.scores = heating_tally_type
-
-        vacuum_vessel_midpl_tally = openmc.Tally(tally_id=26, name='neutron_heating_vacuum_vessel_midplane')
-        vacuum_vessel_midpl_tally.filters = [vacuum_vessel_midpl_filter]
-        vacuum_vessel_midpl_tally.scores = heating_tally_type
-
-        blanket_vessel_midpl_tally = openmc.Tally(tally_id=28, name='neutron_heating_blanket_vessel_midplane')
-        blanket_vessel_midpl_tally.filters = [blanket_vessel_midpl_filter]
-        blanket_vessel_midpl_tally.scores = heating_tally_type
-
-    high_e_filter = openmc.EnergyFilter([100000, 20000000])
-
-    magnet_ff_tally = openmc.Tally(tally_id=9, name='fast_flux_magnet_coil')
-    magnet_ff_tally.filters = [magnetmat_filter,high_e_filter]
-    magnet_ff_tally.scores = ['flux']
-
-    peak_magnet_ff_tally = openmc.Tally(tally_id=10, name='fast_flux_first_cm')
-    peak_magnet_ff_tally.filters = [first_cm_filter,high_e_filter]
-    peak_magnet_ff_tally.scores = ['flux']
-
-    magnet_heating_tally = openmc.Tally(tally_id=11, name='fast_flux_magnet_coil')
-    magnet_heating_tally.filters = [magnetmat_filter]
-    magnet_heating_tally.scores = heating_tally_type
-
-    peak_magnet_heating_tally = openmc.Tally(tally_id=12, name='fast_flux_first_cm')
-    peak_magnet_heating_tally.filters = [first_cm_filter]
-    peak_magnet_heating_tally.scores = heating_tally_type
-
-
-    tallies = openmc.Tallies([
-        flux_tally,
-        tbr_tally,
-        first_wall_heating_tally,
-        cooling_channel_heating_tally,
-        cooling_vessel_heating_tally,
-        vacuum_vessel_heating_tally,
-        blanket_heating_tally,
-        blanket_vessel_heating_tally,
-        magnet_ff_tally,
-        peak_magnet_ff_tally,
-        magnet_heating_tally,
-        peak_magnet_heating_tally
-    ])
-
-    if model_config['midplane_split']:
-        tallies.append(first_wall_midplane_tally)
-        tallies.append(cooling_channel_midpl_tally)
-        tallies.append(cooling_vessel_midpl_tally)
-        tallies.append(vacuum_vessel_midpl_tally)
-        tallies.append(blanket_vessel_midpl_tally)
+        heating_tally_type = 'heating-local'
+
+    # Heating, tritium production and total flux in every cell
+    layer_tally = openmc.Tally(name='layer_tally')
+    layer_tally.filters = [cell_filter]
+    layer_tally.scores = [heating_tally_type, '(n,Xt)', 'flux']
+
+    # Flux spectrum in every cell, 1 eV to 20 MeV
+    # 100 keV is one of the bin edges, so the fast flux in the magnet can be summed from this
+    energy_filter = openmc.EnergyFilter(np.append(np.logspace(0, 7, 50), 2e7))
+
+    if multigroup:
+        # Reaction rates can't be tallied in multi-group mode, so only the group fluxes are kept,
+        # which are folded with the response coefficients from the continuous-energy reference run
+        layer_tally.scores = ['flux']
+        group_structure = openmc.MGXSLibrary.from_hdf5(model_config['mgxs_library']).energy_groups
+        energy_filter = openmc.EnergyFilter(group_structure.group_edges)
+    flux_spectrum_tally = openmc.Tally(name='flux_spectrum')
+    flux_spectrum_tally.filters = [cell_filter, energy_filter]
+    flux_spectrum_tally.scores = ['flux']
+
+    tallies = openmc.Tallies([layer_tally, flux_spectrum_tally])
+
+    if model_config['tally_triggers']:
+        # Small tallies just for the quantities we want converged, since a trigger on the
+        # layer tally would wait for every bin, even the ones deep in the magnet
+        cells_by_name = {cell.name: cell for cell in all_cells}
+        for target, threshold in model_config['tally_triggers'].items():
+            trigger_tally = openmc.Tally(name=f'trigger_{target}')
+            if target == 'tbr':
+                # Only the breeder, like the TBR itself, not the tritium made in the structure
+                trigger_tally.filters = [openmc.CellFilter([cells_by_name[name] for name in BREEDER_CELLS if name in cells_by_name])]
+                trigger_tally.scores = ['(n,Xt)']
+            elif target in cells_by_name:
+                trigger_tally.filters = [openmc.CellFilter([cells_by_name[target]])]
+                trigger_tally.scores = [heating_tally_type]
+            else:
+                raise ValueError(f"Invalid tally trigger: {target}. Must be 'tbr' or the name of a cell")
+            trigger = openmc.Trigger('rel_err', threshold)
+            trigger.scores = trigger_tally.scores
+            trigger_tally.triggers = [trigger]
+            tallies.append(trigger_tally)
+
+        settings.trigger_active = True
+        settings.trigger_max_batches = model_config['max_batches']
+        settings.trigger_batch_interval = model_config['trigger_batch_interval']
+
+    if model_config['heating_mesh']:
+        # Heating and fast flux over the whole poloidal cross section, split by cell so each layer's profile can be pulled out
+        r_min, r_max, half_height = section_extent(model_config)
+        n_r, n_z = model_config['heating_mesh_dimension']
+        heating_mesh = openmc.CylindricalMesh(
+            r_grid=np.linspace(r_min, r_max, n_r + 1),
+            z_grid=np.linspace(-half_height, half_height, n_z + 1),
+            phi_grid=[0, section_angle_rad]
+        )
+        heating_mesh_tally = openmc.Tally(name='heating_mesh')
+        heating_mesh_tally.filters = [openmc.MeshFilter(heating_mesh), cell_filter, openmc.EnergyFilter([0, 1e5, 2e7])]
+        heating_mesh_tally.scores = [heating_tally_type, 'flux']
+        tallies.append(heating_mesh_tally)
 
     model = openmc.model.Model(
         geometry=geometry,
         settings=settings,
         tallies=tallies
     )
+    if multigroup:
+        model.materials = mg_materials
+
+    if model_config['verify_volumes']:
+        verify_volumes(model, model_config)
+
+    if model_config['cache_model']:
+        model_file.parent.mkdir(parents=True, exist_ok=True)
+        model.export_to_model_xml(model_file)
+        _cache_model(key, model)
 
     return model
 
@@ -111,6 +111,19 @@ def water():
     water.set_density('g/cm3', 1.0)
     return water
 
+# Borosilicate glass for vitrifying separated waste
+# Composition from PNNL-15870 Rev. 1 (Glass, Borosilicate (Pyrex))
+def borosilicate_glass():
+    borosilicate_glass = openmc.Material(name='borosilicate_glass')
+    borosilicate_glass.add_element('B', 0.040064, 'wo')
+    borosilicate_glass.add_element('O', 0.539562, 'wo')
+    borosilicate_glass.add_element('Na', 0.028191, 'wo')
+    borosilicate_glass.add_element('Al', 0.011644, 'wo')
+    borosilicate_glass.add_element('Si', 0.377220, 'wo')
+    borosilicate_glass.add_element('K', 0.003321, 'wo')
+    borosilicate_glass.set_density('g/cm3', 2.23)
+    return borosilicate_glass
+
 # SS316L for magnet and shield
 def ss316L():
     ss316L = openmc.Material(name='ss316L')
@@ -0,0 +1,184 @@
+import json
+import numpy as np
+import pandas as pd
+import openmc
+import openmc.mgxs
+
+from barc_blanket.models.barc_model_final import make_model, tally_results, DEFAULT_PARAMETERS, BREEDER_CELLS
+from barc_blanket.utilities import change_directory
+from barc_blanket.orchestrator import run_model
+
+# Cross sections needed for neutron-only fixed source transport
+# The multiplicity matrix keeps the (n,2n) neutron multiplication in the beryllium and lead
+MGXS_TYPES = ['total', 'absorption', 'nu-scatter matrix', 'multiplicity matrix']
+
+def generate_multigroup_library(new_model_config=None, directory="multigroup", groups='VITAMIN-J-175', legendre_order=3):
+    """Run a continuous-energy reference of the final model and collapse it into a multi-group library.
+    Every cell gets its own cross sections, since cells of the same material
+    (e.g. the three steel case layers) see very different spectra.
+
+    Because tritium production and heating can't be tallied in multi-group mode, this also saves
+    group-wise response coefficients (reaction rate / flux in each group and cell) to fold with
+    multi-group fluxes, and the continuous-energy results to measure the multi-group bias against.
+
+    Parameters:
+    ----------
+    new_model_config : dict, optional
+        Configuration of the reference design.
+        Values not provided are taken from DEFAULT_PARAMETERS.
+    directory : str, optional
+        Where to run and save the library. Default = "multigroup"
+    groups : str or np.array, optional
+        Group structure, either the name of one in openmc.mgxs.GROUP_STRUCTURES or the group edges [eV]
+        Default = 'VITAMIN-J-175', which is made for fusion spectra
+    legendre_order : int, optional
+        Order of the scattering expansion. Default = 3
+
+    Files written to directory:
+    -------
+    mgxs.h5 : multi-group library to pass as 'mgxs_library' to make_model
+    responses.npz : 'cell_names', 'group_edges', 'tritium' and 'heating' response coefficients (cell x group) [1/cm and eV/cm]
+    ce_reference.json : TBR and heating in each cell from the continuous-energy run
+    """
+
+    model_config = DEFAULT_PARAMETERS.copy()
+    if new_model_config is not None:
+        model_config.update(new_model_config)
+
+    with change_directory(directory):
+        model = make_model(model_config)
+        cells = [cell for cell in model.geometry.get_all_cells().values() if cell.fill is not None]
+        energy_groups = openmc.mgxs.EnergyGroups(groups)
+
+        library = openmc.mgxs.Library(model.geometry)
+        library.energy_groups = energy_groups
+        library.mgxs_types = MGXS_TYPES
+        library.domain_type = 'cell'
+        library.domains = cells
+        library.legendre_order = legendre_order
+        library.correction = None
+        library.build_library()
+        library.add_to_tallies_file(model.tallies, merge=True)
+
+        heating_score = 'heating' if model_config['photon_transport'] else 'heating-local'
+        response_tally = openmc.Tally(name='group_responses')
+        response_tally.filters = [openmc.CellFilter(cells), openmc.EnergyFilter(energy_groups.group_edges)]
+        response_tally.scores = ['flux', '(n,Xt)', heating_score]
+        model.tallies.append(response_tally)
+
+        statepoint_path = run_model(model)
+
+        with openmc.StatePoint(statepoint_path) as statepoint:
+            library.load_from_statepoint(statepoint)
+
+            # Reaction rate per unit flux in each cell and group
+            rates = statepoint.get_tally(name='group_responses').mean.reshape(len(cells), energy_groups.num_groups, 3)
+            flux = rates[..., 0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                tritium = np.where(flux > 0, rates[..., 1] / flux, 0)
+                heating = np.where(flux > 0, rates[..., 2] / flux, 0)
+
+            layer_results = tally_results(statepoint, model, 'layer_tally')
+
+        mg_library = library.create_mg_library(xs_type='macro', xsdata_names=[cell.name for cell in cells])
+        mg_library.export_to_hdf5("mgxs.h5")
+
+        np.savez("responses.npz",
+                 cell_names=np.array([cell.name for cell in cells]),
+                 group_edges=energy_groups.group_edges,
+                 tritium=tritium,
+                 heating=heating)
+
+        reference = _layer_quantities(layer_results)
+        with open("ce_reference.json", 'w') as f:
+            json.dump(reference, f, indent=2)
+
+    print(f"Multi-group library written to {directory}/mgxs.h5")
+
+def _layer_quantities(layer_results):
+    """Get the TBR (from the breeder cells only) and the heating in each cell from the layer tally results"""
+    tritium = layer_results[(layer_results['score'] == '(n,Xt)') & layer_results['cell_name'].isin(BREEDER_CELLS)]
+    heating = layer_results[layer_results['score'].str.startswith('heating')]
+    return {'tbr': float(tritium['mean'].sum()),
+            'heating': dict(zip(heating['cell_name'], heating['mean'].astype(float)))}
+
+def multigroup_results(statepoint, model, directory="multigroup"):
+    """Fold the group fluxes of a multi-group run with the response coefficients
+    to get the TBR and heating in each cell
+
+    Parameters:
+    ----------
+    statepoint : openmc.StatePoint
+        Statepoint from running a model made with 'energy_mode': 'multi-group'
+    model : openmc.Model
+        The model that was run, used to look up cell names
+    directory : str, optional
+        Directory the library was generated in. Default = "multigroup"
+
+    Returns:
+    -------
+    results : dict
+        'tbr' and 'heating' (dict of cell name to eV/source particle)
+    """
+
+    responses = np.load(f"{directory}/responses.npz")
+    spectrum = tally_results(statepoint, model, 'flux_spectrum')
+    return _fold_responses(spectrum, responses)
+
+def _fold_responses(spectrum, responses):
+    """Fold the group flux in each cell (from the flux_spectrum tally results) with the response coefficients"""
+    response_index = {name: i for i, name in enumerate(responses['cell_names'])}
+    num_groups = len(responses['group_edges']) - 1
+
+    results = {'tbr': 0.0, 'heating': {}}
+    for cell_name, cell_spectrum in spectrum.groupby('cell_name', sort=False):
+        if cell_name not in response_index:
+            continue
+        group_flux = cell_spectrum.sort_values('energy_low')['mean'].to_numpy()
+        if len(group_flux) != num_groups:
+            raise ValueError(f"The multi-group run has {len(group_flux)} groups but the responses have {num_groups}")
+        i = response_index[cell_name]
+        if cell_name in BREEDER_CELLS:
+            results['tbr'] += float(np.sum(group_flux * responses['tritium'][i]))
+        results['heating'][cell_name] = float(np.sum(group_flux * responses['heating'][i]))
+
+    return results
+
+def multigroup_bias(statepoint, model, directory="multigroup"):
+    """Compare a multi-group run of the reference design to the continuous-energy reference
+
+    Parameters:
+    ----------
+    statepoint : openmc.StatePoint
+        Statepoint from running the reference design in multi-group mode
+    model : openmc.Model
+        The model that was run
+    directory : str, optional
+        Directory the library was generated in. Default = "multigroup"
+
+    Returns:
+    -------
+    bias : pandas.DataFrame
+        One row per quantity ('tbr' and the heating of each cell), with the
+        'continuous_energy' and 'multi_group' values and 'bias_percent'
+    """
+
+    with open(f"{directory}/ce_reference.json") as f:
+        reference = json.load(f)
+    results = multigroup_results(statepoint, model, directory)
+    return _bias_table(reference, results)
+
+def _bias_table(reference, results):
+    """Table of the continuous-energy and multi-group TBR and heating, and the bias between them"""
+    rows = [{'quantity': 'tbr', 'continuous_energy': reference['tbr'], 'multi_group': results['tbr']}]
+    for cell_name, heating in reference['heating'].items():
+        if cell_name in results['heating']:
+            rows.append({'quantity': f'heating_{cell_name}',
+                         'continuous_energy': heating,
+                         'multi_group': results['heating'][cell_name]})
+
+    bias = pd.DataFrame(rows)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bias['bias_percent'] = (bias['multi_group'] / bias['continuous_energy'] - 1) * 100
+
+    return bias
@@ -1,7 +1,10 @@
 import openmc
 
+from barc_blanket.orchestrator import run_model
 
-def evaluate_metric(model:openmc.Model, metric):
+METRICS = ["tbr"]
+
+def evaluate_metric(model:openmc.Model, metric, session=None):
     """ Evaluate the metric for the given model
 
     Parameters:
@@ -10,6 +13,9 @@ def evaluate_metric(model:openmc.Model, metric):
         The model to evaluate the metric for
     metric : str
         The name of the metric to evaluate
+    session : barc_blanket.session.SessionEvaluator, optional
+        Persistent openmc.lib session to run the model in.
+        If not provided, the model is run in a new OpenMC process.
 
     Returns:
     -------
@@ -17,27 +23,55 @@ def evaluate_metric(model:openmc.Model, metric):
         The value of the metric calculated for the model
     """
 
-    if metric == "tbr":
-        metric_val = tritium_breeding_ratio(model)
-    #elif metric == "some_other_arbitrary_metric":
-    #    metric_val = whatever_function(model)
+    if metric not in METRICS:
+        raise ValueError(f"Invalid metric: {metric}")
+
+    # Run the model
+    if session is None:
+        statepoint_path = run_model(model)
     else:
+        statepoint_path = session.run(model)
+
+    return statepoint_metric(statepoint_path, metric)
+
+def statepoint_metric(statepoint_path, metric):
+    """ Calculate the metric from a finished run
+
+    Parameters:
+    ----------
+    statepoint_path : str
+        Path to the final statepoint of the run
+    metric : str
+        The name of the metric to calculate
+
+    Returns:
+    -------
+    metric_val: float
+        The value of the metric
+    """
+
+    if metric not in METRICS:
         raise ValueError(f"Invalid metric: {metric}")
 
+    if metric == "tbr":
+        metric_val = tritium_breeding_ratio(statepoint_path)
+    #elif metric == "some_other_arbitrary_metric":
+    #    metric_val = whatever_function(statepoint_path)
+
     return metric_val
 
 # THIS IS JUST A PROOF OF CONCEPT
 # THIS FUNCTION DOES NOT PRODUCE CORRECT OUTPUT
-def tritium_breeding_ratio(model:openmc.Model):
+def tritium_breeding_ratio(statepoint_path):
     """ THIS IS JUST A PROOF OF CONCEPT
     THIS FUNCTION DOES NOT PRODUCE CORRECT OUTPUT
     
-    Calculate the tritium breeding ratio for the given model
+    Calculate the tritium breeding ratio from a finished run
 
     Parameters:
     ----------
-    model : openmc.Model
-        The model to evaluate the metric for
+    statepoint_path : str
+        Path to the final statepoint of the run
 
     Returns:
     -------
@@ -45,9 +79,7 @@ def tritium_breeding_ratio(model:openmc.Model):
         The tritium breeding ratio for the model
     """
 
-    # Run the model
-    model.run()
-    final_statepoint = openmc.StatePoint("statepoint.50.h5")
+    final_statepoint = openmc.StatePoint(statepoint_path)
 
     # Get tally results
     # TODO: do this programmatically instead of hardcoded here
@@ -0,0 +1,230 @@
+import os
+import re
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+from barc_blanket.utilities import latest_statepoint, recommended_threads
+
+# What to look for in the OpenMC output
+FIXED_SOURCE_BATCH = re.compile(r"Simulating batch\s+(\d+)")
+# e.g. "       12/1    1.02345    1.02100 +/- 0.00123"
+EIGENVALUE_BATCH = re.compile(r"^\s*(\d+)/\d+\s+(\d+\.\d+)(?:\s+(\d+\.\d+)\s+\+/-\s+(\d+\.\d+))?")
+TRIGGERS_UNSATISFIED = re.compile(r"Triggers unsatisfied, max unc\./thresh\. is ([\d.eE+-]+) for (\S+) in tally (\d+)")
+TRIGGERS_SATISFIED = re.compile(r"Triggers satisfied")
+STATEPOINT = re.compile(r"Creating state point (\S+?\.h5)")
+
+FINISHED_STATUSES = ['done', 'failed', 'timeout']
+
+async def run_openmc(run, semaphore, threads=None, timeout=None):
+    """Run OpenMC on the model files in a run's directory, following its progress in the output.
+    The output is also written to openmc.log in the directory.
+
+    Parameters:
+    ----------
+    run : dict
+        Run to update as it goes, with at least 'name' and 'directory'.
+        'status', 'batch', 'batches', 'keff', 'trigger', 'statepoint', 'return_code' and 'wall_time' are filled in.
+    semaphore : asyncio.Semaphore
+        Limits how many runs go at the same time
+    threads : int, optional
+        Number of OpenMP threads. Default is all available.
+    timeout : float, optional
+        Seconds to let the run go before killing it. Default is no limit.
+    """
+
+    async with semaphore:
+        directory = Path(run['directory'])
+        run['status'] = 'running'
+        start = time.time()
+
+        command = ['openmc']
+        if threads is not None:
+            command += ['-s', str(threads)]
+        process = await asyncio.create_subprocess_exec(*command, cwd=directory,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.STDOUT)
+        try:
+            run['return_code'] = await asyncio.wait_for(_follow_output(process, run, directory / 'openmc.log'), timeout)
+            run['status'] = 'done' if run['return_code'] == 0 else 'failed'
+        except asyncio.TimeoutError:
+            run['status'] = 'timeout'
+        finally:
+            # Don't leave OpenMC running if we timed out or were cancelled
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            run['wall_time'] = time.time() - start
+
+        if run['status'] == 'done':
+            if run['statepoint'] is None:
+                # Already includes the directory
+                run['statepoint'] = latest_statepoint(directory).resolve()
+            else:
+                # Parsed from the output, relative to where OpenMC ran
+                run['statepoint'] = (directory / run['statepoint']).resolve()
+
+async def _follow_output(process, run, log_path):
+    """Read the OpenMC output line by line, keeping the run's progress up to date"""
+    with open(log_path, 'w') as log:
+        async for raw_line in process.stdout:
+            line = raw_line.decode(errors='replace')
+            log.write(line)
+            _parse_line(line, run)
+    return await process.wait()
+
+def _parse_line(line, run):
+    """Update the progress of a run from one line of OpenMC output"""
+    match = FIXED_SOURCE_BATCH.search(line)
+    if match:
+        run['batch'] = int(match.group(1))
+        return
+    match = EIGENVALUE_BATCH.match(line)
+    if match:
+        run['batch'] = int(match.group(1))
+        # The combined estimate is only printed once there are active batches
+        if match.group(3) is not None:
+            run['keff'] = (float(match.group(3)), float(match.group(4)))
+        return
+    match = TRIGGERS_UNSATISFIED.search(line)
+    if match:
+        run['trigger'] = f"{match.group(2)} in tally {match.group(3)} at {float(match.group(1)):0.2f}x target"
+        return
+    if TRIGGERS_SATISFIED.search(line):
+        run['trigger'] = "satisfied"
+        return
+    match = STATEPOINT.search(line)
+    if match:
+        run['statepoint'] = match.group(1)
+
+def _progress_lines(runs):
+    """One line summary of the campaign and one line per active run"""
+    counts = {status: sum(run['status'] == status for run in runs) for status in ['queued', 'running'] + FINISHED_STATUSES}
+    lines = [", ".join(f"{count} {status}" for status, count in counts.items() if count > 0)]
+    for run in runs:
+        if run['status'] != 'running':
+            continue
+        line = f"  {run['name']:<30} batch {run['batch']}/{run['batches']}"
+        if run['keff'] is not None:
+            line += f"  k = {run['keff'][0]:0.5f} +/- {run['keff'][1]:0.5f}"
+        if run['trigger'] is not None:
+            line += f"  triggers: {run['trigger']}"
+        lines.append(line)
+    return lines
+
+async def _show_progress(runs, interval):
+    """Keep one view of every run's progress on the console until the runs finish"""
+    interactive = sys.stdout.isatty()
+    previous_lines = 0
+    while True:
+        lines = _progress_lines(runs)
+        if interactive:
+            # Redraw in place
+            if previous_lines > 0:
+                sys.stdout.write(f"\x1b[{previous_lines}F\x1b[J")
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+            previous_lines = len(lines)
+        else:
+            # Logs get a single line at a time
+            print(lines[0], flush=True)
+        await asyncio.sleep(interval)
+
+async def run_models_async(models, directories=None, max_concurrent=1, threads=None, timeout=None, progress_interval=None):
+    """Run many models as separate OpenMC processes at the same time
+
+    Parameters:
+    ----------
+    models : list of openmc.Model or dict of str to openmc.Model
+        Models to run. If a dict, the keys are used as the names of the runs.
+    directories : list of str, optional
+        Directory to run each model in. Default is run_<name> in the current directory.
+    max_concurrent : int, optional
+        Number of models to run at the same time. Default = 1
+    threads : int, optional
+        OpenMP threads for each run. Default splits the cores evenly between the concurrent runs,
+        or when running one at a time uses the machine profile from barc_blanket.autotune (or leaves it to OpenMC if there isn't one).
+    timeout : float, optional
+        Seconds to let each run go before killing it. Default is no limit.
+    progress_interval : float, optional
+        Seconds between updates of the progress on the console. Default is no progress shown.
+
+    Returns:
+    -------
+    runs : list of dict
+        For each model, its 'name', 'directory', 'status' ('done', 'failed' or 'timeout'),
+        'statepoint' (absolute path, None if not done), 'return_code', 'wall_time' [s],
+        and the last 'batch', 'keff' and 'trigger' status seen in its output
+    """
+
+    if not isinstance(models, dict):
+        models = {str(i): model for i, model in enumerate(models)}
+    if directories is None:
+        directories = [f"run_{name}" for name in models]
+    if len(directories) != len(models):
+        raise ValueError(f"Got {len(directories)} directories for {len(models)} models")
+    if threads is None and max_concurrent > 1:
+        threads = max(os.cpu_count() // max_concurrent, 1)
+    elif threads is None:
+        threads = recommended_threads()
+
+    runs = []
+    for (name, model), directory in zip(models.items(), directories):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        model.export_to_xml(directory)
+        runs.append({'name': name,
+                     'directory': directory,
+                     'status': 'queued',
+                     'batch': 0,
+                     'batches': model.settings.batches,
+                     'keff': None,
+                     'trigger': None,
+                     'statepoint': None,
+                     'return_code': None,
+                     'wall_time': None})
+
+    semaphore = asyncio.Semaphore(max_concurrent)
+    progress = None
+    if progress_interval is not None:
+        progress = asyncio.create_task(_show_progress(runs, progress_interval))
+    try:
+        await asyncio.gather(*(run_openmc(run, semaphore, threads, timeout) for run in runs))
+    finally:
+        if progress is not None:
+            progress.cancel()
+            print("\n".join(_progress_lines(runs)))
+
+    return runs
+
+def run_models(models, directories=None, max_concurrent=1, threads=None, timeout=None, progress_interval=10):
+    """Blocking version of run_models_async, for use outside of asyncio code. See run_models_async."""
+    return asyncio.run(run_models_async(models, directories, max_concurrent, threads, timeout, progress_interval))
+
+def run_model(model, directory='.', threads=None, timeout=None):
+    """Run a single model in an OpenMC process, like model.run() but with a timeout
+    and with the output saved to openmc.log in the directory instead of printed
+
+    Parameters:
+    ----------
+    model : openmc.Model
+        Model to run
+    directory : str, optional
+        Directory to run in. Default is the current directory.
+    threads : int, optional
+        Number of OpenMP threads. Default is the machine profile's, or all available.
+    timeout : float, optional
+        Seconds to let the run go before killing it. Default is no limit.
+
+    Returns:
+    -------
+    pathlib.Path
+        Absolute path to the final statepoint
+    """
+
+    run = run_models([model], [directory], threads=threads, timeout=timeout, progress_interval=None)[0]
+    if run['status'] == 'timeout':
+        raise TimeoutError(f"OpenMC didn't finish within {timeout} s, see {Path(directory) / 'openmc.log'}")
+    if run['status'] != 'done':
+        raise RuntimeError(f"OpenMC failed with exit code {run['return_code']}, see {Path(directory) / 'openmc.log'}")
+    return run['statepoint']
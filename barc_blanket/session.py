@@ -0,0 +1,135 @@
+import os
+import openmc
+import openmc.lib
+
+from barc_blanket.utilities import geometry_signature, working_directory
+
+
+class SessionEvaluator:
+    """Run many models through one openmc.lib session,
+    so the nuclear data is only loaded once per worker instead of once per trial.
+
+    Material compositions and densities and the number of particles are updated in place in memory.
+    openmc.lib has no way to change surface coefficients, so when a model has a different
+    geometry than the one loaded, the session is re-initialized from the new model's XML.
+    Sweeps over material parameters (enrichment, slurry ratio, separations...) get the full benefit,
+    while sweeps over dimensions pay the normal startup cost for every new geometry.
+
+    Cross sections are only loaded for the nuclides in the model the session is started from,
+    so materials swapped in later can't have any others unless they are listed in nuclides.
+    S(a,b) tables and temperatures are not updated either.
+
+    Parameters:
+    ----------
+    directory : str, optional
+        Directory to write the XML files and statepoints to. Default is the current directory.
+    threads : int, optional
+        Number of OpenMP threads to run with. Default is all available.
+    nuclides : list of str, optional
+        Extra nuclides to load cross sections for, e.g. every nuclide in any of the models that will be run
+    """
+
+    def __init__(self, directory='.', threads=None, nuclides=None):
+        self.directory = directory
+        self.threads = threads
+        self.nuclides = nuclides
+        self.geometry = None
+        self.batches = None
+        self.cell_ids = {}
+        self.reinitializations = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.finalize()
+
+    def initialize(self, model:openmc.Model):
+        """(Re)start the openmc.lib session from the given model"""
+        self.finalize()
+
+        os.makedirs(self.directory, exist_ok=True)
+        model.export_to_xml(self.directory)
+        if self.nuclides:
+            # OpenMC loads the data for every material in materials.xml, even ones that fill no cells
+            materials = openmc.Materials(model.materials if len(model.materials) > 0 else model.geometry.get_all_materials().values())
+            materials.append(_nuclide_carrier(self.nuclides))
+            materials.export_to_xml(os.path.join(self.directory, 'materials.xml'))
+
+        args = ['-s', str(self.threads)] if self.threads is not None else None
+        with working_directory(self.directory):
+            openmc.lib.init(args=args, output=False)
+
+        self.geometry = geometry_signature(model)
+        self.batches = model.settings.batches
+        self.cell_ids = {cell.name: cell_id for cell_id, cell in model.geometry.get_all_cells().items()}
+        self.reinitializations += 1
+
+    def finalize(self):
+        """Close the openmc.lib session if one is open"""
+        if openmc.lib.is_initialized:
+            openmc.lib.finalize()
+        self.geometry = None
+
+    def update(self, model:openmc.Model):
+        """Bring the loaded session in line with the given model,
+        re-initializing only if the geometry (or number of batches, which sets the statepoints) is different
+
+        Parameters:
+        ----------
+        model : openmc.Model
+            Model to update the session to
+        """
+
+        if (self.geometry is None
+            or model.settings.batches != self.batches
+            or geometry_signature(model) != self.geometry):
+            self.initialize(model)
+            return
+
+        # Same geometry, so just swap the material contents of each cell
+        for cell in model.geometry.get_all_cells().values():
+            if not isinstance(cell.fill, openmc.Material):
+                continue
+            lib_material = openmc.lib.cells[self.cell_ids[cell.name]].fill
+            atom_densities = cell.fill.get_nuclide_atom_densities()
+            lib_material.set_densities(list(atom_densities.keys()), list(atom_densities.values()))
+
+        openmc.lib.settings.particles = model.settings.particles
+
+    def run(self, model:openmc.Model):
+        """Run the given model in the session
+
+        Parameters:
+        ----------
+        model : openmc.Model
+            Model to run
+
+        Returns:
+        -------
+        statepoint_path : str
+            Path to the statepoint of the final batch
+        """
+
+        self.update(model)
+
+        with working_directory(self.directory):
+            openmc.lib.hard_reset()
+            openmc.lib.run(output=False)
+
+        return os.path.join(self.directory, f"statepoint.{model.settings.batches}.h5")
+
+def model_nuclides(model:openmc.Model):
+    """Every nuclide in the materials that fill the cells of a model"""
+    nuclides = set()
+    for material in model.geometry.get_all_materials().values():
+        nuclides.update(material.get_nuclides())
+    return sorted(nuclides)
+
+def _nuclide_carrier(nuclides):
+    """Material that isn't used anywhere, just to get the cross sections of these nuclides loaded"""
+    carrier = openmc.Material(name='session_nuclides')
+    for nuclide in nuclides:
+        carrier.add_nuclide(nuclide, 1.0)
+    carrier.set_density('g/cm3', 1.0)
+    return carrier
@@ -1,13 +1,179 @@
 import os
+import json
+import socket
+import hashlib
 from contextlib import contextmanager
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Optional
 
+import openmc
 from openmc.checkvalue import PathLike
 
-CROSS_SECTIONS = os.environ['OPENMC_CROSS_SECTIONS']
-CHAIN_FILE = os.environ['OPENMC_CHAIN_FILE']
+# CROSS_SECTIONS and CHAIN_FILE are read from the environment when they are first used (see __getattr__),
+# so the models can be built and plotted without the nuclear data set up
+_ENVIRONMENT_VARIABLES = {
+    'CROSS_SECTIONS': 'OPENMC_CROSS_SECTIONS',
+    'CHAIN_FILE': 'OPENMC_CHAIN_FILE'
+}
+
+def __getattr__(name):
+    if name in _ENVIRONMENT_VARIABLES:
+        return os.environ[_ENVIRONMENT_VARIABLES[name]]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Where expensive, reusable results (volume checks, models, weight windows, ...) are kept between runs
+CACHE_DIRECTORY = Path(os.environ.get('BARC_BLANKET_CACHE', Path.home() / '.cache' / 'barc_blanket'))
+
+def config_hash(values):
+    """Make a short, stable hash of a JSON-serializable collection of values
+    Parameters
+    ----------
+    values : dict or list
+        Values to hash. Numpy scalars and arrays are converted to python types.
+
+    Returns
+    -------
+    str
+        First 16 hex characters of the sha256 of the canonical JSON
+    """
+    def to_python(value):
+        if hasattr(value, 'tolist'):
+            return value.tolist()
+        raise TypeError(f"Cannot hash value of type {type(value)}")
+
+    text = json.dumps(values, sort_keys=True, default=to_python)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+def machine_profile_path():
+    """Where this machine's settings profile from barc_blanket.autotune is kept, named after the hostname"""
+    return CACHE_DIRECTORY / 'machine_profiles' / f'{socket.gethostname()}.json'
+
+def load_machine_profile():
+    """Load the recommended settings for this machine, if it has been calibrated
+    Returns
+    -------
+    dict or None
+        Contents of the profile written by barc_blanket.autotune.autotune, or None if there isn't one
+    """
+    path = machine_profile_path()
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def recommended_threads():
+    """Number of OpenMP threads recommended by this machine's profile, to pass when running models
+    Returns
+    -------
+    int or None
+        Recommended threads, or None (let OpenMC decide) if the machine hasn't been calibrated
+    """
+    profile = load_machine_profile()
+    if profile is None:
+        return None
+    return profile['recommended']['threads']
+
+def latest_statepoint(directory='.'):
+    """Find the statepoint with the highest batch number in a directory,
+    e.g. after a run that was stopped early by tally triggers
+    Parameters
+    ----------
+    directory : path-like, optional
+        Directory the model was run in. Default is the current directory.
+
+    Returns
+    -------
+    pathlib.Path
+        Path to the latest statepoint
+    """
+    statepoints = list(Path(directory).glob('statepoint.*.h5'))
+    if len(statepoints) == 0:
+        raise FileNotFoundError(f"No statepoints found in {directory}")
+    return max(statepoints, key=lambda path: int(path.name.split('.')[1]))
+
+def material_signature(material):
+    """Describe an openmc.Material by what it physically is,
+    ignoring the id, name and volume that can differ between identical materials
+    Parameters
+    ----------
+    material : openmc.Material
+        Material to describe
+
+    Returns
+    -------
+    dict
+        JSON-serializable description of the composition, density, temperature and S(a,b) tables
+    """
+    return {
+        'nuclides': sorted([nuclide.name, nuclide.percent, nuclide.percent_type] for nuclide in material.nuclides),
+        'density': [material.density, material.density_units],
+        'temperature': material.temperature,
+        'sab': sorted([name, fraction] for name, fraction in material._sab),
+        'depletable': material.depletable
+    }
+
+def geometry_signature(model):
+    """Describe the geometry of a model by its surfaces and cell regions,
+    so two models built from configs that only differ in materials compare equal
+    Parameters
+    ----------
+    model : openmc.Model
+        Model to describe
+
+    Returns
+    -------
+    str
+        Hash of the surface coefficients, boundary conditions and cell regions
+    """
+
+    surfaces = model.geometry.get_all_surfaces()
+    cells = model.geometry.get_all_cells()
+
+    # Describe everything by position in the model rather than by id, since ids change every build
+    surface_index = {surface_id: i for i, surface_id in enumerate(surfaces)}
+    surface_descriptions = [
+        [surface._type, surface.boundary_type, [float(value) for value in surface._coefficients.values()]]
+        for surface in surfaces.values()
+    ]
+    cell_descriptions = [
+        [cell.name, _region_description(cell.region, surface_index)]
+        for cell in cells.values()
+    ]
+
+    return config_hash({'surfaces': surface_descriptions, 'cells': cell_descriptions})
+
+def _region_description(region, surface_index):
+    """Turn a region into a string that doesn't depend on the surface ids"""
+    if region is None:
+        return ''
+    if isinstance(region, openmc.Halfspace):
+        return f"{region.side}{surface_index[region.surface.id]}"
+    if isinstance(region, openmc.Complement):
+        return f"~({_region_description(region.node, surface_index)})"
+    operator = ' & ' if isinstance(region, openmc.Intersection) else ' | '
+    return '(' + operator.join(_region_description(node, surface_index) for node in region) + ')'
+
+def model_hash(model):
+    """Hash what a model physically is: its geometry and the material filling every cell.
+    Unlike the ids, this is the same every time the same config is built, e.g. to check that
+    results on disk came from the model being run.
+    Parameters
+    ----------
+    model : openmc.Model
+        Model to hash
+
+    Returns
+    -------
+    str
+        Short hash of the geometry signature and the cell materials
+    """
+    cell_materials = {
+        cell.name: material_signature(cell.fill)
+        for cell in model.geometry.get_all_cells().values()
+        if isinstance(cell.fill, openmc.Material)
+    }
+    return config_hash({'geometry': geometry_signature(model), 'materials': cell_materials})
 
 @contextmanager
 def working_directory(directory):
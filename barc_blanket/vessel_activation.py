@@ -9,13 +9,14 @@ from barc_blanket.utilities import change_directory
 import os
 
 from barc_blanket.utilities import CROSS_SECTIONS, CHAIN_FILE
+from barc_blanket.flux_cache import flux_and_microxs, depletable_cells
 
 from openmc_regular_mesh_plotter import plot_mesh_tally
 from matplotlib.colors import LogNorm
 
 # Heavily based on John's stuff here: https://github.com/jlball/arc-nonproliferation/tree/master/openmc-scripts/arc-1/independent_depletion
 
-def run_independent_vessel_activation(model:openmc.Model, days=365, num_timesteps=50, times=None, source_rate=3.6e20):
+def run_independent_vessel_activation(model:openmc.Model, days=365, num_timesteps=50, times=None, source_rate=3.6e20, cells=None):
     """ Run the vessel activation after a certain number of days.
 
     Parameters:
@@ -30,50 +31,20 @@ def run_independent_vessel_activation(model:openmc.Model, days=365, num_timestep
         The times to evaluate activation. Default is None. If not none, it will override days and num_timesteps.
     source_rate : float
         The source rate of neutrons in the model. Default is 3.6e20 (for 1 GW fusion power)
+    cells : list of openmc.Cell
+        The cells to activate. Default is every cell with a depletable material.
     """
 
-    # Obtain a pointer to the vacuum vessel cell
-    first_wall_cell = next(iter(model._cells_by_name["first_wall_cell"]))
-    cooling_vessel_cell = next(iter(model._cells_by_name["cooling_vessel_cell"]))
-    vacuum_vessel_cell = next(iter(model._cells_by_name["vacuum_vessel_cell"]))
-    blanket_vessel_cell = next(iter(model._cells_by_name["blanket_vessel_cell"]))
-
-    # Check if flux and microscopic cross sections are present.
-    # If not, calculate them
-    # Otherwise, load them from file
-    fluxes_file = 'fluxes.npy'
-    # TODO: should be able to programmatically put all the microxs in one file, but for now we'll just do it separately
-    first_wall_microxs_file = 'first_wall_microxs.csv'
-    cooling_vessel_microxs_file = 'cooling_vessel_microxs.csv'
-    vacuum_vessel_microxs_file = 'vacuum_vessel_microxs.csv'
-    blanket_vessel_microxs_file = 'blanket_vessel_microxs.csv'
-    if os.path.exists(fluxes_file) and os.path.exists(first_wall_microxs_file) and os.path.exists(cooling_vessel_microxs_file) and os.path.exists(vacuum_vessel_microxs_file) and os.path.exists(blanket_vessel_microxs_file):
-        with open(fluxes_file, 'rb') as f:
-            fluxes = np.load(fluxes_file)
-        with open(first_wall_microxs_file, 'rb') as f:
-            first_wall_microxs = openmc.deplete.MicroXS.from_csv(first_wall_microxs_file)
-        with open(cooling_vessel_microxs_file, 'rb') as f:
-            cooling_vessel_microxs = openmc.deplete.MicroXS.from_csv(cooling_vessel_microxs_file)
-        with open(vacuum_vessel_microxs_file, 'rb') as f:
-            vacuum_vessel_microxs = openmc.deplete.MicroXS.from_csv(vacuum_vessel_microxs_file)
-        with open(blanket_vessel_microxs_file, 'rb') as f:
-            blanket_vessel_microxs = openmc.deplete.MicroXS.from_csv(blanket_vessel_microxs_file)
-    else:
-        fluxes, microxs = openmc.deplete.get_microxs_and_flux(model, [first_wall_cell, cooling_vessel_cell, vacuum_vessel_cell, blanket_vessel_cell])
-        np.save(fluxes_file, fluxes)
-        first_wall_microxs = microxs[0]
-        cooling_vessel_microxs = microxs[1]
-        vacuum_vessel_microxs = microxs[2]
-        blanket_vessel_microxs = microxs[3]
-        first_wall_microxs.to_csv(first_wall_microxs_file)
-        cooling_vessel_microxs.to_csv(cooling_vessel_microxs_file)
-        vacuum_vessel_microxs.to_csv(vacuum_vessel_microxs_file)
-        blanket_vessel_microxs.to_csv(blanket_vessel_microxs_file)
+    if cells is None:
+        cells = depletable_cells(model)
+
+    # Flux and microscopic cross sections are only calculated if this model hasn't been run before
+    fluxes, micros = flux_and_microxs(model, cells)
 
     # Perform depletion (CHECK NORMALIZATION MODE)
-    operator = openmc.deplete.IndependentOperator(openmc.Materials([first_wall_cell.fill, cooling_vessel_cell.fill, vacuum_vessel_cell.fill, blanket_vessel_cell.fill]),
+    operator = openmc.deplete.IndependentOperator(openmc.Materials([cell.fill for cell in cells]),
                                                     fluxes,
-                                                    [first_wall_microxs, cooling_vessel_microxs, vacuum_vessel_microxs, blanket_vessel_microxs],
+                                                    micros,
                                                     normalization_mode='source-rate',
                                                     reduce_chain=True,
                                                     reduce_chain_level=5) # TODO: figure out what this does and why we set to 5
@@ -93,69 +64,23 @@ def run_independent_vessel_activation(model:openmc.Model, days=365, num_timestep
     
     integrator.integrate()
 
-def run_independent_vessel_decay(model:openmc.Model, results, days=365, num_timesteps=50, times=None):
-    """ Run the vessel decay after a certain number of days.
+def depleted_cells(model:openmc.Model, results):
+    """ Get the cells of a model whose materials are in depletion results,
+    e.g. to leave out cells that have been refilled since the activation
 
     Parameters:
     -----------
     model : openmc.Model
-        The model to get the vessel activation from.
-    days : int
-        The number of days to run the model for.
-    num_timesteps : int
-        The number of timesteps to run the model for.
-    times : list
-        The times to evaluate activation. If not none, it will override days and num_timesteps.
-    """
-
-    # Obtain a pointer to the vessel cells
-    first_wall_cell = next(iter(model._cells_by_name["first_wall_cell"]))
-    cooling_vessel_cell = next(iter(model._cells_by_name["cooling_vessel_cell"]))
-    vacuum_vessel_cell = next(iter(model._cells_by_name["vacuum_vessel_cell"]))
-    blanket_vessel_cell = next(iter(model._cells_by_name["blanket_vessel_cell"]))
-
-    # This is a hack until I can figure out how to make it actually work
-    fluxes_file = '../independent_vessel_activation/fluxes.npy'
-    # TODO: should be able to programmatically put all the microxs in one file, but for now we'll just do it separately
-    first_wall_microxs_file = '../independent_vessel_activation/first_wall_microxs.csv'
-    cooling_vessel_microxs_file = '../independent_vessel_activation/cooling_vessel_microxs.csv'
-    vacuum_vessel_microxs_file = '../independent_vessel_activation/vacuum_vessel_microxs.csv'
-    blanket_vessel_microxs_file = '../independent_vessel_activation/blanket_vessel_microxs.csv'
-    if os.path.exists(fluxes_file) and os.path.exists(first_wall_microxs_file) and os.path.exists(vacuum_vessel_microxs_file) and os.path.exists(blanket_vessel_microxs_file):
-        with open(fluxes_file, 'rb') as f:
-            fluxes = np.load(fluxes_file)
-        with open(first_wall_microxs_file, 'rb') as f:
-            first_wall_microxs = openmc.deplete.MicroXS.from_csv(first_wall_microxs_file)
-        with open(cooling_vessel_microxs_file, 'rb') as f:
-            cooling_vessel_microxs = openmc.deplete.MicroXS.from_csv(cooling_vessel_microxs_file)
-        with open(vacuum_vessel_microxs_file, 'rb') as f:
-            vacuum_vessel_microxs = openmc.deplete.MicroXS.from_csv(vacuum_vessel_microxs_file)
-        with open(blanket_vessel_microxs_file, 'rb') as f:
-            blanket_vessel_microxs = openmc.deplete.MicroXS.from_csv(blanket_vessel_microxs_file)
-
-    fluxes = np.zeros(fluxes.shape)
-
-    # Perform depletion (CHECK NORMALIZATION MODE)
-    operator = openmc.deplete.IndependentOperator(openmc.Materials([first_wall_cell.fill, cooling_vessel_cell.fill, vacuum_vessel_cell.fill, blanket_vessel_cell.fill]),
-                                                    fluxes,
-                                                    [first_wall_microxs, cooling_vessel_microxs, vacuum_vessel_microxs, blanket_vessel_microxs],
-                                                    normalization_mode='source-rate',
-                                                    prev_results=results,
-                                                    reduce_chain=True,
-                                                    reduce_chain_level=5) # TODO: figure out what this does and why we set to 5
-    
-    if times is None:
-        timesteps = [days/num_timesteps] * num_timesteps
-    else:
-        timesteps = np.diff(times)
-    source_rates = np.ones(len(timesteps)) # source rate is very close to 0 so decay can happen
+        The model to look in
+    results : openmc.deplete.Results
+        The depletion results
 
-    integrator = openmc.deplete.PredictorIntegrator(operator, 
-                                                       timesteps,
-                                                       source_rates=source_rates,
-                                                       timestep_units='d')
-    
-    integrator.integrate()
+    Returns:
+    --------
+    cells : list of openmc.Cell
+    """
+    depleted_material_ids = results[0].index_mat.keys()
+    return [cell for cell in model.geometry.get_all_material_cells().values() if str(cell.fill.id) in depleted_material_ids]
 
 def extract_activities(model:openmc.Model, cell_name:str="blanket_vessel_cell"):
     # Get the total activity from a specified cell
@@ -1,10 +1,28 @@
 # Run every case we are interested in.
 # To be looked at tomorrow morning
+#
+# Cases can be run at the same time with --concurrent, each in its own process
+# with the cores split between them, e.g. on a 64 core node:
+#   python run_all_cases.py --concurrent 4 --threads 16
+#
+# To compare the cases before depleting, --shared_session runs the transport of every case
+# back to back in one process, so the cross sections are only loaded into memory once:
+#   python run_all_cases.py --shared_session
+#
+# Instead of the fixed timesteps, --adaptive picks them to keep the error of each step under a tolerance:
+#   python run_all_cases.py --adaptive 1e-3
 import os
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 from barc_blanket.utilities import working_directory
-from barc_blanket.models.barc_model_final import make_model, mo
-from barc_blanket.materials.blanket_depletion import run_coupled_depletion
+from barc_blanket.models.barc_model_final import make_model
+from barc_blanket.materials.blanket_depletion import run_coupled_depletion, run_independent_depletion, run_adaptive_depletion, depletion_complete
+from barc_blanket.session import SessionEvaluator, model_nuclides
 from barc_blanket.models.materials import flibe, lid, pbli, burner_mixture
 
 CASES = {
@@ -38,23 +56,136 @@ BATCHES = 100
 PARTICLES = 1e6
 PHOTON_TRANSPORT = False
 
+FUSION_POWER = 2.2  # GW
+TIMESTEPS_YEARS = [10] * 10 # 10 year timesteps for 100 years
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Run coupled depletion for every case")
+    parser.add_argument("-c", "--concurrent", type=int, default=1, help="Number of cases to run at the same time")
+    parser.add_argument("-t", "--threads", type=int, default=None, help="OpenMP threads per case. Default splits the cores evenly between the concurrent cases.")
+    parser.add_argument("--case", type=str, default=None, choices=list(CASES.keys()), help="Run only this case, in this process")
+    parser.add_argument("--independent", action="store_true", help="Deplete with fixed cross sections, only rerunning transport when the blanket composition has drifted")
+    parser.add_argument("--adaptive", type=float, default=None, metavar="TOLERANCE", help="Choose the timesteps to keep the relative error of each step under this tolerance")
+    parser.add_argument("--shared_session", action="store_true", help="Run the transport of every case in one openmc.lib session instead of depleting")
+    return parser.parse_args()
+
+def case_config(case):
+    """Model configuration of a case, which only differ in the blanket material"""
+    return {"batches": BATCHES,
+            "particles": PARTICLES,
+            "photon_transport": PHOTON_TRANSPORT,
+            "blanket_material": CASES[case]['blanket_material']}
+
+def run_cases_in_session(threads=None):
+    """Run the transport of every case back to back in one openmc.lib session.
+    Only the blanket and cooling channel materials are swapped between cases, so the cross sections
+    (of every nuclide in any case) are loaded once. Coupled depletion starts its own session every step,
+    so this only gives the statepoint of each case, saved in its directory.
+    """
+    models = {case: make_model(case_config(case)) for case in CASES}
+    nuclides = sorted(set().union(*(model_nuclides(model) for model in models.values())))
+
+    with SessionEvaluator(directory="depletion_results/session", threads=threads, nuclides=nuclides) as session:
+        for case, model in models.items():
+            start = time.time()
+            statepoint_path = session.run(model)
+            os.makedirs(f"depletion_results/{case}", exist_ok=True)
+            shutil.copy(statepoint_path, f"depletion_results/{case}/statepoint.{BATCHES}.h5")
+            print(f"Finished {case} transport in {(time.time() - start)/60:0.1f} min")
+
+    print(f"Session was initialized {session.reinitializations} times for {len(models)} cases")
+
+def run_case(case, independent=False, tolerance=None):
+    """Run coupled depletion for one case in its own directory.
+    Finished cases are skipped and ones that were stopped part way are resumed.
+    With independent=True, run_independent_depletion is used instead, which starts over if it was stopped part way.
+    With a tolerance, run_adaptive_depletion chooses the timesteps up to the same end time."""
+    method = 'independent' if independent else 'coupled'
+    if tolerance is None and depletion_complete(TIMESTEPS_YEARS, f"depletion_results/{case}", method):
+        print(f"{case} is already done, skipping")
+        return
+
+    # create a working directory for each case
+    os.makedirs(f"depletion_results/{case}", exist_ok=True)
+    with working_directory(f"depletion_results/{case}"):
+        model = make_model(case_config(case))
+        model.export_to_model_xml()
+
+        if independent:
+            run_independent_depletion(model, TIMESTEPS_YEARS, FUSION_POWER)
+        elif tolerance is not None:
+            run_adaptive_depletion(model, sum(TIMESTEPS_YEARS), FUSION_POWER, tolerance)
+        else:
+            run_coupled_depletion(model, TIMESTEPS_YEARS, FUSION_POWER)
+
+def launch_case(case, threads, independent=False, tolerance=None):
+    """Run one case in a separate process with its own share of the cores, logging to the case directory
+
+    Returns:
+    -------
+    summary : dict
+        'case', 'threads', 'return_code', 'wall_time' [s] and 'log' file
+    """
+    os.makedirs(f"depletion_results/{case}", exist_ok=True)
+    log_path = f"depletion_results/{case}/run.log"
+    environment = {**os.environ, 'OMP_NUM_THREADS': str(threads)}
+
+    command = [sys.executable, __file__, "--case", case]
+    if independent:
+        command.append("--independent")
+    if tolerance is not None:
+        command += ["--adaptive", str(tolerance)]
+
+    start = time.time()
+    with open(log_path, 'w') as log:
+        process = subprocess.run(command,
+                                 stdout=log, stderr=subprocess.STDOUT, env=environment)
+    wall_time = time.time() - start
+
+    print(f"Finished {case} in {wall_time/3600:0.2f} h (exit code {process.returncode})")
+    return {'case': case,
+            'threads': threads,
+            'return_code': process.returncode,
+            'wall_time': wall_time,
+            'log': log_path}
+
+def print_summary(summaries):
+    """Print a table of how each case went"""
+    print(f"{'Case':<20}{'Threads':>8}{'Status':>10}{'Wall time [h]':>15}  Log")
+    for summary in summaries:
+        status = "done" if summary['return_code'] == 0 else "FAILED"
+        print(f"{summary['case']:<20}{summary['threads']:>8}{status:>10}{summary['wall_time']/3600:>15.2f}  {summary['log']}")
+
 def main():
-    for case, config in CASES.items():
-        # create a working directory for each case
-        os.makedirs(f"depletion_results/{case}", exist_ok=True)
-        with working_directory(f"depletion_results/{case}"):
-            model_config = {"batches": BATCHES,
-                            "particles": PARTICLES,
-                            "photon_transport": PHOTON_TRANSPORT,
-                            "blanket_material": config['blanket_material']}
-            
-            model = make_model(model_config)
-            model.export_to_model_xml()
-
-            fusion_power = 2.2  # GW
-            timesteps_years = [10] * 10 # 10 year timesteps for 100 years
-
-            run_coupled_depletion(model, timesteps_years, fusion_power)
+    args = _parse_args()
+
+    if args.case is not None:
+        run_case(args.case, args.independent, args.adaptive)
+        return
+
+    if args.shared_session:
+        run_cases_in_session(args.threads)
+        return
+
+    if args.concurrent == 1 and args.threads is None:
+        for case in CASES:
+            run_case(case, args.independent, args.adaptive)
+        return
+
+    # Don't start processes (and overwrite the logs) for cases that are already done
+    method = 'independent' if args.independent else 'coupled'
+    cases = [case for case in CASES if args.adaptive is not None or not depletion_complete(TIMESTEPS_YEARS, f"depletion_results/{case}", method)]
+    for case in CASES:
+        if case not in cases:
+            print(f"{case} is already done, skipping")
+
+    threads = args.threads if args.threads is not None else max(os.cpu_count() // args.concurrent, 1)
+    print(f"Running {len(cases)} cases, {args.concurrent} at a time with {threads} threads each")
+
+    with ThreadPoolExecutor(max_workers=args.concurrent) as executor:
+        summaries = list(executor.map(lambda case: launch_case(case, threads, args.independent, args.adaptive), cases))
+
+    print_summary(summaries)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,24 @@
+# Calibrate the particles per batch and thread count for this machine.
+# The results are saved as a machine profile. make_model only uses it with 'machine_profile': True,
+# running the same number of histories in batches of the recommended size.
+import argparse
+
+from barc_blanket.autotune import autotune
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Measure particles/second and memory at different settings and save the best as this machine's profile")
+    parser.add_argument("-p", "--particles", type=float, nargs="+", default=[1e4, 1e5, 1e6], help="Particles per batch to try")
+    parser.add_argument("-t", "--threads", type=int, nargs="+", default=None, help="Thread counts to try. Default is 1, half and all of the cores.")
+    parser.add_argument("-b", "--batches", type=int, default=5, help="Batches in each trial run")
+    parser.add_argument("-m", "--memory_fraction", type=float, default=0.8, help="Largest fraction of the memory a recommended setting may use")
+    return parser.parse_args()
+
+def main():
+    args = _parse_args()
+    autotune(particles_options=[int(particles) for particles in args.particles],
+             threads_options=args.threads,
+             batches=args.batches,
+             memory_fraction=args.memory_fraction)
+
+if __name__ == "__main__":
+    main()
@@ -31,7 +31,7 @@ import openmc.deplete
 import matplotlib.pyplot as plt
 from matplotlib.colors import LogNorm
 
-from barc_blanket.vessel_activation import CHAIN_FILE, CROSS_SECTIONS
+from barc_blanket.vessel_activation import CHAIN_FILE, CROSS_SECTIONS, depleted_cells
 from barc_blanket.utilities import working_directory
 from barc_blanket.models.materials import water
 
@@ -76,14 +76,12 @@ with working_directory("dose_calculation"):
     flux_tally.name = "photon_dose_on_mesh"
     tallies = openmc.Tallies([flux_tally])
 
-    #activated_cell_ids = [c.id for c in model.geometry.get_all_material_cells().values() if c.fill.depletable]
-    activated_cell_ids = [3, 4, 6]
-    cells = model.geometry.get_all_cells()
-    activated_cells = [cells[uid] for uid in activated_cell_ids]
-
     results = openmc.deplete.Results(f"../{result_directory}/depletion_results.h5")
     timesteps = results.get_times()
 
+    # Every cell that was activated and hasn't been refilled since
+    activated_cells = depleted_cells(model, results)
+
     for i_cool in range(len(timesteps)-1, len(timesteps)):
         # range starts at 1 to skip the first step as that is an irradiation step and there is no
         # decay gamma source from the stable material at that time
@@ -94,9 +92,9 @@ with working_directory("dose_calculation"):
 
         all_activated_materials_in_timestep = []
 
-        for activated_cell_id in activated_cell_ids:
+        for activated_cell in activated_cells:
             # gets the material id of the material filling the cell
-            material_id = cells[activated_cell_id].fill.id
+            material_id = activated_cell.fill.id
 
             # gets the activated material using the material id
             activated_mat = results[i_cool].get_material(str(material_id))
@@ -105,13 +103,13 @@ with working_directory("dose_calculation"):
             strength = energy.integral()
 
             if strength > 0.:  # only makes sources for 
-                space = openmc.stats.Box(*cells[activated_cell_id].bounding_box)
+                space = openmc.stats.Box(*activated_cell.bounding_box)
                 source = openmc.IndependentSource(
                     space=space,
                     energy=energy,
                     particle="photon",
                     strength=strength,
-                    domains=[cells[activated_cell_id]],
+                    domains=[activated_cell],
                 )
                 photon_sources_for_timestep.append(source)
 
@@ -4,7 +4,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 from barc_blanket.utilities import working_directory
-from barc_blanket.models.barc_model_final import make_model
+from barc_blanket.models.barc_model_final import make_model, section_correction
 from barc_blanket.materials.blanket_depletion import gw_to_neutron_rate
 
 FUSION_POWER_GW = 2.2
@@ -21,12 +21,8 @@ with working_directory("independent_vessel_activation"):
     rerun_depletion = True
     times = np.geomspace(0.01, 365, 100)
     if not os.path.exists("depletion_results.h5") or rerun_depletion:
-        for file in ["depletion_results.h5", "fluxes.npy", "blanket_vessel_microxs.csv"]:
-            try:
-                os.remove(file)
-            except FileNotFoundError:
-                pass
-        run_independent_vessel_activation(model, times=times, source_rate=gw_to_neutron_rate(FUSION_POWER_GW))
+        # Transport is only rerun if the model has changed, see barc_blanket.flux_cache
+        run_independent_vessel_activation(model, times=times, source_rate=gw_to_neutron_rate(FUSION_POWER_GW, section_correction(model_config)))
 
     nuclide_times, nuclides = extract_nuclides(model, cell_name="blanket_vessel_cell", nuclide_names=["V49"])
 
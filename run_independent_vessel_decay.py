@@ -1,24 +1,21 @@
 import openmc
 import openmc.model
 import openmc.deplete
-from barc_blanket.vessel_activation import run_independent_vessel_decay, extract_activities, extract_decay_heat
-import os
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 from barc_blanket.utilities import working_directory
-from barc_blanket.models.materials import water
-from barc_blanket.models.barc_model_final import SECTION_CORRECTION
+from barc_blanket.decay import DecaySolver
+from barc_blanket.models.barc_model_final import model_section_correction
 
 result_directory = "independent_vessel_activation"
 
-def plot_activities(decay_model):
-    # Plot the activities over time
+SECONDS_PER_DAY = 60*60*24
 
-    timesteps, first_wall_activities = extract_activities(decay_model, "first_wall_cell")
-    timesteps, vacuum_vessel_activities = extract_activities(decay_model, "vacuum_vessel_cell")
-    timesteps, blanket_vessel_activities = extract_activities(decay_model, "blanket_vessel_cell")
+def plot_activities(times_days, activities):
+    # Plot the activities over time
+    first_wall_activities, cooling_vessel_activities, vacuum_vessel_activities, blanket_vessel_activities = activities
 
     plt.figure(figsize=(8, 6))
     plt.style.use('seaborn-v0_8-poster')
@@ -27,16 +24,15 @@ def plot_activities(decay_model):
     plt.grid(True, color='w', linestyle='-', linewidth=1.5)
     plt.gca().patch.set_facecolor('0.92')
 
-    #ax.plot(timesteps, activities)
-    plt.plot(timesteps-365, first_wall_activities[1], label="First Wall")
-    plt.plot(timesteps-365, vacuum_vessel_activities[1], label="Vacuum Vessel")
-    plt.plot(timesteps-365, blanket_vessel_activities[1], label="Blanket Vessel")
+    plt.plot(times_days, first_wall_activities, label="First Wall")
+    plt.plot(times_days, vacuum_vessel_activities, label="Vacuum Vessel")
+    plt.plot(times_days, blanket_vessel_activities, label="Blanket Vessel")
     plt.legend(loc='upper right')
     plt.xlabel("Time [days]")
     plt.ylabel("Activity [Bq]")
     plt.title("Vessel Decay")
     plt.yscale('symlog', linthresh=1e12)
-    plt.xlim(0, 365)
+    plt.xlim(0, max(times_days))
     #plt.ylim(0, max(max(first_wall_activities[1]), max(vacuum_vessel_activities[1]), max(blanket_vessel_activities[1]))*1.01)
     
     # Save figure
@@ -50,56 +46,42 @@ with working_directory("independent_vessel_decay"):
 
     # Load model
     activated_model = openmc.model.Model.from_model_xml(f"../{result_directory}/model.xml")
+    results = openmc.deplete.Results(f"../{result_directory}/depletion_results.h5")
 
-    # Replace the flibe materials with water
-    blanket_cell = next(iter(activated_model._cells_by_name["blanket_cell"]))
-    blanket_cell.fill = water()
-    cooling_channel_cell = next(iter(activated_model._cells_by_name["cooling_channel_cell"]))
-    cooling_channel_cell.fill = water()
+    # Fraction of the torus in the activated model, to scale the decay heat up to the whole machine
+    activated_section_correction = model_section_correction(activated_model)
 
-    results = openmc.deplete.Results(f"../{result_directory}/depletion_results.h5")
+    # Activated materials at the end of the activation
+    cell_names = ["first_wall_cell", "cooling_vessel_cell", "vacuum_vessel_cell", "blanket_vessel_cell"]
+    activated_materials = []
+    for cell_name in cell_names:
+        cell = next(iter(activated_model._cells_by_name[cell_name]))
+        activated_materials.append(results[-1].get_material(str(cell.fill.id)))
 
-    # Replace the first wall material with activated first wall material
-    first_wall_cell = next(iter(activated_model._cells_by_name["first_wall_cell"]))
-    # Get the activated first wall material
-    #activated_first_wall_material = results[99].get_material(str(3))
-    #first_wall_cell.fill = activated_first_wall_material
+    # Decay all of them at once, straight from the chain with no transport
+    nuclides = set().union(*(material.get_nuclides() for material in activated_materials))
+    solver = DecaySolver(nuclides)
 
-    cooling_channel_cell = next(iter(activated_model._cells_by_name["cooling_channel_cell"]))
+    times = np.concatenate([[0], np.geomspace(0.01, 5, 100)])
+    atoms = solver.decay(activated_materials, times * SECONDS_PER_DAY)
+    heat_times_days = times
 
-    # Replace the vacuum vessel material with activated vacuum vessel material
-    vacuum_vessel_cell = next(iter(activated_model._cells_by_name["vacuum_vessel_cell"]))
-    # Get the activated vacuum vessel material
-    #activated_vacuum_vessel_material = results[99].get_material(str(4))
-    #vacuum_vessel_cell.fill = activated_vacuum_vessel_material
+    first_wall_decay_heat, cooling_vessel_decay_heat, vacuum_vessel_decay_heat, blanket_vessel_decay_heat = solver.decay_heat(atoms)
 
-    # Replace the blanket vessel material with activated blanket vessel material
-    blanket_vessel_cell = next(iter(activated_model._cells_by_name["blanket_vessel_cell"]))
-    # Get the activated blanket vessel material
-    #activated_blanket_vessel_material = results[99].get_material(str(8))
-    #blanket_vessel_cell.fill = activated_blanket_vessel_material
+    first_wall_decay_heat_total_MW = (np.array(first_wall_decay_heat)/1e6) / activated_section_correction
+    cooling_vessel_decay_heat_total_MW = (np.array(cooling_vessel_decay_heat)/1e6) / activated_section_correction
+    vacuum_vessel_decay_heat_total_MW = (np.array(vacuum_vessel_decay_heat)/1e6) / activated_section_correction
+    blanket_vessel_decay_heat_total_MW = (np.array(blanket_vessel_decay_heat)/1e6) / activated_section_correction
 
-    decay_model = openmc.model.Model(geometry=activated_model.geometry, 
-                                     settings=activated_model.settings)
-    
-    rerun_depletion = False
-    times = np.geomspace(0.01, 5, 100)
-    #times = [0, 0.25, 0.5, 0.75, 1, 1.5, 2, 2.5, 3]
-    if not os.path.exists("depletion_results.h5") or rerun_depletion:
-        run_independent_vessel_decay(decay_model, results, times=times)
-
-    heat_times, first_wall_decay_heat = extract_decay_heat(decay_model, "first_wall_cell")
-    heat_times, cooling_vessel_decay_heat = extract_decay_heat(decay_model, "cooling_vessel_cell")
-    heat_times, vacuum_vessel_decay_heat = extract_decay_heat(decay_model, "vacuum_vessel_cell")
-    heat_times, blanket_vessel_decay_heat = extract_decay_heat(decay_model, "blanket_vessel_cell")
-
-    # Convert times to days
-    heat_times_days = np.array(heat_times) / (60*60*24)
-
-    first_wall_decay_heat_total_MW = (np.array(first_wall_decay_heat)/1e6) / SECTION_CORRECTION
-    cooling_vessel_decay_heat_total_MW = (np.array(cooling_vessel_decay_heat)/1e6) / SECTION_CORRECTION
-    vacuum_vessel_decay_heat_total_MW = (np.array(vacuum_vessel_decay_heat)/1e6) / SECTION_CORRECTION
-    blanket_vessel_decay_heat_total_MW = (np.array(blanket_vessel_decay_heat)/1e6) / SECTION_CORRECTION
+    plot_activities(times, solver.activity(atoms))
+
+    # Decay photon spectra of each component, e.g. for shutdown dose sources
+    photon_energy_bins = np.logspace(3, 7, 101)
+    np.savez("vessel_decay_photon_spectra.npz",
+             cell_names=np.array(cell_names),
+             times_days=times,
+             energy_bins=photon_energy_bins,
+             photons_per_second=solver.photon_spectra(atoms, photon_energy_bins))
 
     # Make a dataframe of the decay heat
     df = pd.DataFrame({"Time [days]": heat_times_days, 
@@ -0,0 +1,107 @@
+# Keep track of simulation campaigns in a local job queue instead of by looking at directories.
+#
+# Queue every depletion case and the vessel activation -> decay -> dose chain, then work through
+# them with 4 jobs at a time (rerunning "campaign" doesn't add jobs that are already queued):
+#   python run_job_queue.py campaign
+#   python run_job_queue.py work --workers 4
+#   python run_job_queue.py status
+# More workers can be started from other terminals on the same machine while the first ones run.
+import sys
+import time
+import argparse
+
+from barc_blanket.job_queue import JobQueue, QUEUE_FILE, run_workers
+
+from run_all_cases import CASES, TIMESTEPS_YEARS, FUSION_POWER
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Submit, run and check on simulation jobs")
+    parser.add_argument("-q", "--queue", type=str, default=QUEUE_FILE, help="Queue file")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    subparsers.add_parser("campaign", help="Queue every depletion case and the vessel activation, decay and dose chain")
+
+    submit = subparsers.add_parser("submit", help="Queue a single command")
+    submit.add_argument("name", type=str, help="Name of the job")
+    submit.add_argument("job_command", nargs=argparse.REMAINDER, help="Command to run, after --")
+    submit.add_argument("-d", "--directory", type=str, default=".", help="Directory to run the command in")
+    submit.add_argument("-a", "--after", type=int, nargs="+", default=[], help="Ids of jobs that must finish first")
+    submit.add_argument("-o", "--outputs", type=str, nargs="+", default=[], help="Files the job must produce")
+    submit.add_argument("-r", "--retries", type=int, default=0, help="Number of times to retry the job if it fails")
+
+    work = subparsers.add_parser("work", help="Run jobs until there are none left")
+    work.add_argument("-w", "--workers", type=int, default=1, help="Number of jobs to run at the same time")
+    work.add_argument("-t", "--threads", type=int, default=None, help="OpenMP threads per job. Default splits the cores evenly between the workers.")
+
+    subparsers.add_parser("status", help="Print the status of every job")
+
+    retry = subparsers.add_parser("retry", help="Put failed jobs back in the queue")
+    retry.add_argument("ids", type=int, nargs="*", help="Jobs to retry. Default is every failed job.")
+
+    return parser.parse_args()
+
+def submit_campaign(queue):
+    """Queue every depletion case and the vessel activation -> decay -> dose chain"""
+    python = sys.executable
+
+    for case in CASES:
+        queue.submit(f"depletion {case}",
+                     [python, "run_all_cases.py", "--case", case],
+                     config={'case': case, 'timesteps_years': TIMESTEPS_YEARS, 'fusion_power': FUSION_POWER},
+                     outputs=[f"depletion_results/{case}/depletion_results.h5"],
+                     max_retries=2)
+
+    activation = queue.submit("vessel activation",
+                              [python, "run_independent_vessel_activation.py"],
+                              outputs=["independent_vessel_activation/depletion_results.h5"],
+                              max_retries=2)
+    decay = queue.submit("vessel decay",
+                         [python, "run_independent_vessel_decay.py"],
+                         outputs=["independent_vessel_decay/vessel_decay_heat.csv"],
+                         depends_on=[activation],
+                         max_retries=2)
+    queue.submit("dose",
+                 [python, "run_dose_calculation.py"],
+                 depends_on=[decay],
+                 max_retries=2)
+
+def print_status(queue):
+    """Print a table of every job in the queue"""
+    print(f"{'Id':>4}  {'Name':<32}{'Status':>9}{'Tries':>6}{'Wall time [h]':>15}{'CPU time [h]':>14}{'Memory [GB]':>13}  After")
+    for job in queue.jobs():
+        wall_time = ""
+        if job['started'] is not None:
+            end = job['finished'] if job['finished'] is not None else time.time()
+            wall_time = f"{(end - job['started'])/3600:0.2f}"
+        cpu_time = f"{job['cpu_time']/3600:0.2f}" if job['cpu_time'] is not None else ""
+        memory = f"{job['max_memory']/1e9:0.2f}" if job['max_memory'] is not None else ""
+        after = ", ".join(str(dependency) for dependency in job['depends_on'])
+        print(f"{job['id']:>4}  {job['name']:<32}{job['status']:>9}{job['attempts']:>6}{wall_time:>15}{cpu_time:>14}{memory:>13}  {after}")
+
+def main():
+    args = _parse_args()
+    queue = JobQueue(args.queue)
+
+    if args.action == "campaign":
+        submit_campaign(queue)
+        print_status(queue)
+    elif args.action == "submit":
+        command = args.job_command[1:] if args.job_command[:1] == ["--"] else args.job_command
+        if len(command) == 0:
+            raise ValueError("No command given to submit")
+        job_id = queue.submit(args.name, command, directory=args.directory, outputs=args.outputs,
+                              depends_on=args.after, max_retries=args.retries)
+        print(f"Queued job {job_id}")
+    elif args.action == "work":
+        run_workers(args.queue, workers=args.workers, threads=args.threads)
+        print_status(queue)
+    elif args.action == "status":
+        print_status(queue)
+    elif args.action == "retry":
+        ids = args.ids if len(args.ids) > 0 else [job['id'] for job in queue.jobs('failed')]
+        for job_id in ids:
+            queue.retry(job_id)
+        print(f"Put {len(ids)} jobs back in the queue")
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,9 @@ import os
 import openmc
 import pickle as pkl
 
-from barc_blanket.models.barc_model_final import make_model, SECTION_CORRECTION
-from barc_blanket.utilities import working_directory
+from barc_blanket.models.barc_model_final import make_model, mesh_heating_results, convergence_report, section_correction
+from barc_blanket.utilities import working_directory, latest_statepoint
+from barc_blanket.orchestrator import run_model
 from barc_blanket.materials.blanket_depletion import gw_to_neutron_rate
 
 JOULES_PER_EV = 1.6e-19
@@ -11,33 +12,21 @@ FUSION_POWER_GW = 2.2
 
 NUM_BATCHES = 50
 
-def print_neutron_heating(tallies, cell_name_base, tally_id, model):
+def print_neutron_heating(summary, cell_name_base, model_section_correction):
 
-    source_particles_per_second = gw_to_neutron_rate(FUSION_POWER_GW, SECTION_CORRECTION)
+    source_particles_per_second = gw_to_neutron_rate(FUSION_POWER_GW, model_section_correction)
 
     cell_name = f"{cell_name_base}_cell"
-    midpl_name = f"{cell_name_base}_midpl"
+    layer = summary.set_index('cell_name').loc[cell_name]
 
-    
-    cell_volume_m3 = next(iter(model._cells_by_name[cell_name])).fill.volume / 1e6
-    midpl_volume_m3 = next(iter(model._cells_by_name[midpl_name])).fill.volume / 1e6
-    total_volume_m3 = cell_volume_m3 + midpl_volume_m3
+    total_volume_m3 = layer['volume'] / 1e6
 
-    cell_neutron_heating_ev = tallies[tally_id].mean[0][0][0]
-    midpl_neutron_heating_ev = tallies[tally_id+20].mean[0][0][0]
+    # Heating per source particle in the section, converted to the whole torus
+    total_neutron_heating_ev = layer['average_heating'] * layer['volume']
+    total_neutron_heating_joules = total_neutron_heating_ev * JOULES_PER_EV / model_section_correction
+    total_neutron_heating_watts = total_neutron_heating_joules * source_particles_per_second
 
-    cell_neutron_heating_joules = cell_neutron_heating_ev * JOULES_PER_EV / SECTION_CORRECTION
-    midpl_neutron_heating_joules = midpl_neutron_heating_ev * JOULES_PER_EV / SECTION_CORRECTION
-
-    cell_neutron_heating_watts = cell_neutron_heating_joules * source_particles_per_second
-    midpl_neutron_heating_watts = midpl_neutron_heating_joules * source_particles_per_second
-
-    total_neutron_heating_watts = cell_neutron_heating_watts + midpl_neutron_heating_watts
-
-    midpl_neutron_heating_watts_per_m3 = midpl_neutron_heating_watts / midpl_volume_m3
-    total_neutron_heating_watts_per_m3 = total_neutron_heating_watts / total_volume_m3
-
-    peaking_factor = midpl_neutron_heating_watts_per_m3 / total_neutron_heating_watts_per_m3
+    peaking_factor = layer['heating_peaking_factor']
 
     print(f"{cell_name_base} total neutron heating: {total_neutron_heating_watts/1e6} [MW]")
     print(f"{cell_name_base} volumetric neutron heating: {(total_neutron_heating_watts/1e6) / total_volume_m3} [MW/m3]")
@@ -46,35 +35,41 @@ def print_neutron_heating(tallies, cell_name_base, tally_id, model):
     result_dict = {'total_MW': total_neutron_heating_watts/1e6,
                    'volumetric_MW_m3': (total_neutron_heating_watts/1e6) / total_volume_m3,
                    'peaking_factor': peaking_factor}
-    
+
     return result_dict
 
 with working_directory("neutron_heating_photon_transport"):
 
-    model = make_model({
+    model_config = {
         'batches': NUM_BATCHES,
         'particles': 1e6,
         'photon_transport': True,
-        'midplane_split': True
-    })
+        'heating_mesh': True,
+        # Stop as soon as the first wall and vacuum vessel heating are known to 1%
+        'tally_triggers': {'first_wall_cell': 0.01, 'vacuum_vessel_cell': 0.01},
+        'max_batches': 200
+    }
+    model = make_model(model_config)
 
     rerun_model = True
     if rerun_model is True:
-        model.run()
+        statepoint_path = run_model(model)
+    else:
+        statepoint_path = latest_statepoint()
 
-    final_statepoint = openmc.StatePoint(f"statepoint.{NUM_BATCHES}.h5")
+    final_statepoint = openmc.StatePoint(statepoint_path)
+    convergence_report(final_statepoint, model_config)
 
-    # Get tally results
-    # TODO: do this programmatically instead of hardcoded here
-    tallies = final_statepoint.tallies
+    # Peak and average heating of every layer from the heating mesh
+    summary, profiles = mesh_heating_results(final_statepoint, model, model_config)
+    summary.to_csv('neutron_heating_summary.csv', index=False)
 
     all_results = {}
 
-    all_results["first_wall"] = print_neutron_heating(tallies, "first_wall", 3, model)
-    all_results["cooling_channel"] = print_neutron_heating(tallies, "cooling_channel", 4, model)
-    all_results["cooling_vessel"] = print_neutron_heating(tallies, "cooling_vessel", 5, model)
-    all_results["vacuum_vessel"] = print_neutron_heating(tallies, "vacuum_vessel", 6, model)
-    all_results["blanket_vessel"] = print_neutron_heating(tallies, "blanket_vessel", 8, model)
+    for cell_name_base in ["first_wall", "cooling_channel", "cooling_vessel", "vacuum_vessel", "blanket_vessel"]:
+        all_results[cell_name_base] = print_neutron_heating(summary, cell_name_base, section_correction(model_config))
 
     with open('neutron_heating_results.pkl', 'wb') as f:
-        pkl.dump(all_results, f)
\ No newline at end of file
+        pkl.dump(all_results, f)
+    with open('neutron_heating_profiles.pkl', 'wb') as f:
+        pkl.dump(profiles, f)
@@ -31,7 +31,9 @@ import optuna
 import argparse
 
 from barc_blanket.models.barc_model_simple_toroidal import make_model
-from barc_blanket.optimize_model import evaluate_metric
+from barc_blanket.optimize_model import evaluate_metric, statepoint_metric
+from barc_blanket.orchestrator import run_models
+from barc_blanket.session import SessionEvaluator
 from barc_blanket.utilities import working_directory
 
 def _parse_args():
@@ -39,10 +41,14 @@ def _parse_args():
     parser = argparse.ArgumentParser(description="Run a parameter sweep using Optuna")
     parser.add_argument("sweep_directory", type=str, help="Relative path to directory where all the sweep input and output files are stored.")
     parser.add_argument("-n", "--num_trials", type=int, default=1, help="Number of trials to run. This will add num_trials to the existing trials in the sweep_results.db")
+    parser.add_argument("--session", action="store_true", help="Run all trials in one persistent openmc.lib session instead of a new OpenMC process per trial")
+    parser.add_argument("--threads", type=int, default=None, help="Number of OpenMP threads for the session, or for each trial with --concurrent. Default is all available.")
+    parser.add_argument("-c", "--concurrent", type=int, default=1, help="Number of trials to run at the same time, each in its own OpenMC process")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds to let a trial run with --concurrent before giving up on it")
     return parser.parse_args()
 
-def objective(trial, sweep_config):
-    """ Objective function for the optimization
+def suggest_config(trial, sweep_config):
+    """ Get the model configuration for a trial from the sweep parameters
 
     Parameters:
     ----------
@@ -53,8 +59,8 @@ def objective(trial, sweep_config):
 
     Returns:
     -------
-    metric_val: float
-        The value of the metric calculated for the parameters in this trial
+    model_config: dict
+        The values of the parameters chosen for this trial
     """
 
     # Obtain the values of parameters from the trial
@@ -83,10 +89,77 @@ def objective(trial, sweep_config):
         
         model_config[parameter_name] = chosen_value
 
+    return model_config
+
+def run_concurrent_trials(study, sweep_config, num_trials, concurrent, threads=None, timeout=None):
+    """ Run trials in groups of several OpenMC processes at the same time
+
+    Parameters:
+    ----------
+    study : optuna.Study
+        Study to add the trials to
+    sweep_config : dict
+        A dictionary containing the sweep configuration
+    num_trials : int
+        Number of trials to run
+    concurrent : int
+        Number of trials to run at the same time
+    threads : int, optional
+        OpenMP threads for each trial. Default splits the cores evenly between them.
+    timeout : float, optional
+        Seconds to let a trial run before pruning it. Default is no limit.
+    """
+
+    for first_trial in range(0, num_trials, concurrent):
+        trials = [study.ask() for _ in range(min(concurrent, num_trials - first_trial))]
+
+        models = {}
+        for trial in trials:
+            try:
+                models[trial.number] = make_model(suggest_config(trial, sweep_config))
+            except Exception as e:
+                print(f"Error in trial {trial.number}, pruning...")
+                print(e)
+                study.tell(trial, state=optuna.trial.TrialState.PRUNED)
+
+        runs = run_models({f"trial_{number}": model for number, model in models.items()},
+                          max_concurrent=concurrent, threads=threads, timeout=timeout)
+        runs = dict(zip(models, runs))
+
+        for trial in trials:
+            if trial.number not in runs:
+                continue
+            run = runs[trial.number]
+            if run['status'] != 'done':
+                print(f"Trial {trial.number} {run['status']}, pruning...")
+                study.tell(trial, state=optuna.trial.TrialState.PRUNED)
+                continue
+            study.tell(trial, statepoint_metric(run['statepoint'], sweep_config['metric']))
+
+def objective(trial, sweep_config, session=None):
+    """ Objective function for the optimization
+
+    Parameters:
+    ----------
+    trial : optuna.Trial
+        An optuna trial object
+    sweep_config : dict
+        A dictionary containing the sweep configuration
+    session : SessionEvaluator, optional
+        Persistent openmc.lib session to run the trials in
+
+    Returns:
+    -------
+    metric_val: float
+        The value of the metric calculated for the parameters in this trial
+    """
+
+    model_config = suggest_config(trial, sweep_config)
+
     # Create the model and evaluate the metric
     try:
         model = make_model(model_config)
-        metric_val = evaluate_metric(model, sweep_config['metric'])
+        metric_val = evaluate_metric(model, sweep_config['metric'], session=session)
     except MemoryError as e:
         print(f"Ran out of memory for trial {trial.number}")
         print(e)
@@ -127,7 +200,15 @@ def main():
             load_if_exists=True
         )
 
-        study.optimize(lambda trial: objective(trial, sweep_config), n_trials=num_trials)
+        if args.session:
+            # One session per worker, so the nuclear data is only loaded once
+            with SessionEvaluator(directory="session", threads=args.threads) as session:
+                study.optimize(lambda trial: objective(trial, sweep_config, session), n_trials=num_trials)
+            print(f"Session was initialized {session.reinitializations} times for {num_trials} trials")
+        elif args.concurrent > 1:
+            run_concurrent_trials(study, sweep_config, num_trials, args.concurrent, args.threads, args.timeout)
+        else:
+            study.optimize(lambda trial: objective(trial, sweep_config), n_trials=num_trials)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
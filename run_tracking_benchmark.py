@@ -0,0 +1,58 @@
+# Compare tracking speed of the final model with and without the bounding regions around each torus cell
+import argparse
+import openmc
+
+from barc_blanket.models.barc_model_final import make_model
+from barc_blanket.utilities import change_directory
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark particles/second with and without bounding regions")
+    parser.add_argument("-p", "--particles", type=int, default=int(1e5), help="Particles per batch")
+    parser.add_argument("-b", "--batches", type=int, default=10, help="Number of batches")
+    parser.add_argument("-t", "--threads", type=int, default=None, help="Number of OpenMP threads. Default is all available.")
+    parser.add_argument("--midplane_split", action="store_true", help="Benchmark the model with the midplane cells split out")
+    return parser.parse_args()
+
+def particles_per_second(model_config, threads=None):
+    """Run a model and measure how fast it tracks particles
+
+    Parameters:
+    ----------
+    model_config : dict
+        Configuration to build the final model with
+    threads : int, optional
+        Number of OpenMP threads
+
+    Returns:
+    -------
+    rate : float
+        Particles per second of transport time
+    """
+    model = make_model(model_config)
+
+    with change_directory(tmpdir=True):
+        statepoint_path = model.run(threads=threads, output=False)
+        with openmc.StatePoint(statepoint_path) as statepoint:
+            transport_time = statepoint.runtime['transport']
+
+    return model.settings.particles * model.settings.batches / transport_time
+
+def main():
+    args = _parse_args()
+
+    model_config = {
+        'particles': args.particles,
+        'batches': args.batches,
+        'midplane_split': args.midplane_split
+    }
+
+    rates = {}
+    for bounding_regions in [False, True]:
+        rates[bounding_regions] = particles_per_second({**model_config, 'bounding_regions': bounding_regions}, args.threads)
+
+    print(f"Without bounding regions: {rates[False]:0.1f} particles/s")
+    print(f"With bounding regions:    {rates[True]:0.1f} particles/s")
+    print(f"Speedup: {rates[True]/rates[False]:0.3f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Compare how quickly the tallies converge with and without weight windows
+import argparse
+import openmc
+import pandas as pd
+
+from barc_blanket.models.barc_model_final import make_model, figures_of_merit, fast_flux_results
+from barc_blanket.utilities import change_directory
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Report the figure of merit of each layer tally and the magnet fast flux with and without variance reduction")
+    parser.add_argument("-p", "--particles", type=int, default=int(1e5), help="Particles per batch")
+    parser.add_argument("-b", "--batches", type=int, default=20, help="Number of batches")
+    parser.add_argument("-t", "--threads", type=int, default=None, help="Number of OpenMP threads. Default is all available.")
+    return parser.parse_args()
+
+def run_figures_of_merit(model_config, threads=None):
+    """Run the final model and get the figure of merit of every bin of the layer tally
+    and of the fast (> 100 keV) flux in the magnet"""
+    model = make_model(model_config)
+
+    with change_directory(tmpdir=True):
+        statepoint_path = model.run(threads=threads, output=False)
+        with openmc.StatePoint(statepoint_path) as statepoint:
+            results = pd.concat([figures_of_merit(statepoint, model),
+                                 figures_of_merit(statepoint, model, results=fast_flux_results(statepoint, model))])
+
+    return results.set_index(['cell_name', 'score'])
+
+def main():
+    args = _parse_args()
+
+    model_config = {
+        'particles': args.particles,
+        'batches': args.batches
+    }
+
+    # Weight windows are generated (or loaded from the cache) before the timed run
+    analog = run_figures_of_merit({**model_config, 'variance_reduction': False}, args.threads)
+    weighted = run_figures_of_merit({**model_config, 'variance_reduction': True}, args.threads)
+
+    comparison = pd.DataFrame({
+        'analog_relative_error': analog['relative_error'],
+        'weighted_relative_error': weighted['relative_error'],
+        'analog_fom': analog['figure_of_merit'],
+        'weighted_fom': weighted['figure_of_merit'],
+    })
+    comparison['fom_gain'] = comparison['weighted_fom'] / comparison['analog_fom']
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(comparison)
+    comparison.to_csv("variance_reduction_comparison.csv")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import numpy as np
+import openmc.deplete
+import openmc.stats
+
+from barc_blanket.decay import DecaySolver
+
+def make_chain(path):
+    """Chain with a parent that decays to a stable daughter, and an unrelated nuclide"""
+    chain = openmc.deplete.Chain()
+
+    parent = openmc.deplete.Nuclide("Co60")
+    parent.half_life = 100.0
+    parent.decay_energy = 1e6
+    parent.add_decay_mode("beta-", "Ni60", 1.0)
+    # Two photons per decay, as emission rates per atom like openmc's decay photon sources
+    parent.sources = {'photon': openmc.stats.Discrete([1.17e6, 1.33e6], [parent.decay_constant, parent.decay_constant])}
+    chain.add_nuclide(parent)
+
+    daughter = openmc.deplete.Nuclide("Ni60")
+    chain.add_nuclide(daughter)
+
+    unrelated = openmc.deplete.Nuclide("Cs137")
+    unrelated.half_life = 50.0
+    unrelated.add_decay_mode("beta-", "Ba137", 1.0)
+    chain.add_nuclide(unrelated)
+    chain.add_nuclide(openmc.deplete.Nuclide("Ba137"))
+
+    chain.export_to_xml(path)
+
+class TestDecaySolver:
+
+    def test_parent_daughter(self, tmp_path):
+        """Ensure decay matches the analytic solution and keeps the number of atoms"""
+        chain_file = tmp_path / "chain.xml"
+        make_chain(chain_file)
+        solver = DecaySolver(["Co60"], chain_file=chain_file)
+
+        # Cs137 can't be reached from Co60
+        assert solver.nuclides == ["Co60", "Ni60"]
+
+        times = np.geomspace(1, 1000, 10)
+        atoms = solver.decay([{"Co60": 1e10}, {"Co60": 2e10, "Ni60": 1e10}], times)
+        assert atoms.shape == (2, 10, 2)
+
+        decay_constant = np.log(2) / 100.0
+        assert np.allclose(atoms[0, :, 0], 1e10 * np.exp(-decay_constant * times), rtol=1e-8)
+        assert np.allclose(atoms[1].sum(axis=1), 3e10)
+        assert np.allclose(solver.activity(atoms[0]), decay_constant * atoms[0, :, 0])
+        assert np.allclose(solver.decay_heat(atoms[0]), solver.activity(atoms[0]) * 1e6 * 1.602176634e-19)
+
+    def test_photon_spectra(self, tmp_path):
+        """Ensure the photon emission rate is two photons per decay, one in each energy bin"""
+        chain_file = tmp_path / "chain.xml"
+        make_chain(chain_file)
+        solver = DecaySolver(["Co60"], chain_file=chain_file)
+
+        times = [0, 100]
+        atoms = solver.decay([{"Co60": 1e10}], times)[0]
+        spectra = solver.photon_spectra(atoms, [0, 1.25e6, 2e6])
+
+        decay_constant = np.log(2) / 100.0
+        expected_activity = decay_constant * 1e10 * np.exp(-decay_constant * np.array(times))
+        assert spectra.shape == (2, 2)
+        assert np.allclose(spectra[:, 0], expected_activity, rtol=1e-8)
+        assert np.allclose(spectra.sum(axis=1), 2 * expected_activity, rtol=1e-8)
@@ -1,12 +1,14 @@
 import openmc
 import openmc.deplete
 import os
+import json
 import numpy as np
 import pytest
 import matplotlib.pyplot as plt
 
 from barc_blanket.utilities import working_directory
-from barc_blanket.materials.blanket_depletion import gw_to_neutron_rate
+from barc_blanket.materials.blanket_depletion import gw_to_neutron_rate, composition_drift, deplete_ensemble, depletion_complete, step_error, control_step, RESULTS_FILE, STATE_FILE
+from barc_blanket.materials import blanket_depletion
 
 class TestCoupledDepletion:
 
@@ -552,4 +554,129 @@ class TestCoupledDepletion:
             expected_final_bd = (cell_a_results[-1] + cell_c_results[-1])
 
             # Ensure the actual amount of Gd157 in cells C and D is close to the expected amount
-            assert cell_bd_results[-1] == pytest.approx(expected_final_bd, rel=0.01), f"Expected Gd157 to have an activity of {expected_final_bd:0.2e} but got {cell_bd_results[-1]:0.2e}"
\ No newline at end of file
+            assert cell_bd_results[-1] == pytest.approx(expected_final_bd, rel=0.01), f"Expected Gd157 to have an activity of {expected_final_bd:0.2e} but got {cell_bd_results[-1]:0.2e}"
+
+class TestIndependentDepletion:
+
+    def test_composition_drift(self):
+        """Ensure the drift picks up changes in the tracked nuclides and in the reaction rate"""
+        micro = openmc.deplete.MicroXS(np.array([[[2.0]], [[1.0]]]), ['Li6', 'Li7'], ['(n,Xt)'])
+        flux = np.array([1.0])
+        reference = [{'Li6': 1.0, 'Li7': 1.0}]
+
+        assert composition_drift(reference, reference, [flux], [micro]) == 0
+        # 10% less Li6 is 10% drift in Li6 but less in the reaction rate
+        assert np.isclose(composition_drift(reference, [{'Li6': 0.9, 'Li7': 1.0}], [flux], [micro]), 0.1)
+        # Li7 isn't tracked, so only the reaction rate changes
+        assert np.isclose(composition_drift(reference, [{'Li6': 1.0, 'Li7': 0.7}], [flux], [micro]), 0.1)
+
+    def test_not_complete_for_other_method(self, tmp_path):
+        """Ensure independent operator results aren't taken for a finished coupled run"""
+        with open(tmp_path / STATE_FILE, 'w') as f:
+            json.dump({'method': 'independent', 'model_hash': '', 'timesteps_days': [3650], 'source_rates': [1.0]}, f)
+        (tmp_path / RESULTS_FILE).touch()
+
+        assert not depletion_complete([10], tmp_path, method='coupled')
+
+class TestEnsembleDepletion:
+
+    def test_capture_matches_analytic(self, tmp_path):
+        """Ensure every member of the ensemble follows exp(-sigma*phi*t) with its own flux scale"""
+        chain = openmc.deplete.Chain()
+        gd157 = openmc.deplete.Nuclide("Gd157")
+        gd157.add_reaction("(n,gamma)", "Gd158", 0.0, 1.0)
+        chain.add_nuclide(gd157)
+        chain.add_nuclide(openmc.deplete.Nuclide("Gd158"))
+        chain_file = tmp_path / "chain.xml"
+        chain.export_to_xml(chain_file)
+
+        # 1e5 b at 1e17 n/cm2-s is a capture rate of 0.01 /s
+        micro = openmc.deplete.MicroXS(np.array([[[1e5]]]), ['Gd157'], ['(n,gamma)'])
+        flux = np.array([1e17])
+        timesteps_years = np.array([1, 2, 4]) * 1e-6
+        # He4 isn't in the chain and is left out instead of breaking the chain reduction
+        compositions = [{'Gd157': 1e20, 'He4': 1e18}, {'Gd157': 2e20}, {'Gd157': 1e20, 'Gd158': 1e20}]
+
+        atoms, nuclides = deplete_ensemble(compositions, flux, micro, timesteps_years, flux_scales=[1, 2, 1], chain_file=chain_file)
+        assert nuclides == ['Gd157', 'Gd158']
+        assert atoms.shape == (3, 4, 2)
+
+        times = np.concatenate([[0], np.cumsum(timesteps_years)]) * 365 * 24 * 3600
+        assert np.allclose(atoms[0, :, 0], 1e20 * np.exp(-0.01 * times), rtol=1e-8)
+        assert np.allclose(atoms[1, :, 0], 2e20 * np.exp(-0.02 * times), rtol=1e-8)
+        assert np.allclose(atoms[2].sum(axis=1), 2e20)
+
+class TestAdaptiveDepletion:
+
+    def test_step_error(self):
+        """Ensure the error is relative for real inventories and ignores traces below the absolute tolerance"""
+        index_nuc = {'Li6': 0, 'Li7': 1, 'H3': 2}
+        corrector = np.array([[1e27, 1e28, 1e20]])
+
+        # 0.1% off in Li6
+        predictor = corrector * [1.001, 1, 1]
+        assert np.isclose(step_error(predictor, corrector, index_nuc, ['Li6', 'H3']), 1e-3)
+        # Untracked nuclides don't count
+        assert step_error(corrector * [1, 2, 1], corrector, index_nuc, ['Li6', 'H3']) == 0
+
+        # 1% off in a real amount of tritium counts in full
+        assert np.isclose(step_error(corrector * [1, 1, 1.01], corrector, index_nuc, ['H3']), 1e-2)
+        # but a few hundred atoms of tritium are below 1e-12 of the material and don't control the step
+        trace = np.array([[1e27, 1e28, 100.0]])
+        assert step_error(trace * [1, 1, 2], trace, index_nuc, ['H3']) < 1e-6
+
+    def test_control_step(self):
+        """Ensure steps grow when accurate, shrink when rejected and stop at the minimum step"""
+        accepted, next_step = control_step(10, 0, 1e-3)
+        assert accepted and next_step == 40
+
+        accepted, next_step = control_step(10, 2.5e-4, 1e-3)
+        assert accepted and np.isclose(next_step, 18)
+
+        accepted, next_step = control_step(10, 4e-3, 1e-3)
+        assert not accepted and np.isclose(next_step, 4.5)
+
+        # Shrinking never goes below the minimum
+        accepted, next_step = control_step(0.02, 1.0, 1e-3, min_step_days=0.01)
+        assert not accepted and next_step == 0.01
+
+        # Error that doesn't go away at the minimum step, e.g. statistical noise, can't be fixed
+        with pytest.raises(RuntimeError):
+            control_step(0.01, 1e-2, 1e-3, min_step_days=0.01)
+
+    def test_resume_drops_unaccepted_step(self, tmp_path, monkeypatch):
+        """Ensure a step in the results that never made it into the state is thrown away on restart"""
+        class FakeResults(list):
+            def get_times(self, time_units='d'):
+                return np.array(self)
+
+        # The results files just hold their times, so no transport is needed
+        def fake_load_results(path):
+            with open(path) as f:
+                return FakeResults(json.load(f))
+
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(blanket_depletion, '_load_results', fake_load_results)
+        monkeypatch.setattr(blanket_depletion, 'model_hash', lambda model: 'model')
+
+        blanket_depletion._write_state(None, 'adaptive', [1.0, 4.0], [1e20] * 2, end_time_days=365, tolerance=1e-3)
+        with open(f"{RESULTS_FILE}.bak", 'w') as f:
+            json.dump([0.0, 1.0, 5.0], f)
+        # Stopped after the third step was run but before it was accepted
+        with open(RESULTS_FILE, 'w') as f:
+            json.dump([0.0, 1.0, 5.0, 21.0], f)
+
+        results, timesteps_days = blanket_depletion._previous_adaptive_depletion(None, 365, 1e20, 1e-3)
+        assert timesteps_days == [1.0, 4.0]
+        assert list(results) == [0.0, 1.0, 5.0]
+
+        # Results that disagree with the accepted steps can't be continued
+        with open(RESULTS_FILE, 'w') as f:
+            json.dump([0.0, 2.0, 5.0], f)
+        with pytest.raises(ValueError):
+            blanket_depletion._previous_adaptive_depletion(None, 365, 1e20, 1e-3)
+
+        # Nothing was accepted yet, so start over
+        blanket_depletion._write_state(None, 'adaptive', [], [], end_time_days=365, tolerance=1e-3)
+        assert blanket_depletion._previous_adaptive_depletion(None, 365, 1e20, 1e-3) == (None, [])
+        assert not os.path.exists(RESULTS_FILE)
@@ -1,8 +1,16 @@
 import os
+import json
+from collections import OrderedDict
+import importlib
+import numpy as np
+import pytest
 import openmc.deplete
 
-from barc_blanket.models.barc_model_final import make_model
-from barc_blanket.utilities import working_directory
+from barc_blanket.models import barc_model_final
+from barc_blanket.models.barc_model_final import make_model, machine_profile_settings, model_cache_key, section_bounding_box, check_source_bank_size, cell_volumes, geometry_hash, model_config_hash, section_extent, voxel_cell_volumes, model_section_correction, make_source
+from barc_blanket import utilities
+from barc_blanket.utilities import working_directory, model_hash
+from barc_blanket.models.materials import flibe
 from barc_blanket.models.plot_geometry import plot_geometry
 
 class TestFinalModel:
@@ -47,5 +55,182 @@ class TestFinalModel:
             # Save the figure
             fig.savefig("geometry.png")
 
-            
+    def test_cell_volumes_match_model(self):
+        """Ensure the standalone volume calculation gives the same volumes as make_model"""
+        model = make_model({'midplane_split': True})
+        volumes = cell_volumes({'midplane_split': True})
 
+        # Only check cells whose material isn't shared with another cell
+        for cell_name in ['first_wall_cell', 'first_wall_midpl', 'cooling_channel_cell', 'blanket_cell', 'blanket_vessel_midpl']:
+            cell = next(iter(model._cells_by_name[cell_name]))
+            assert cell.fill.volume == pytest.approx(volumes[cell_name]), f"Expected {cell_name} volume of {volumes[cell_name]:0.3e} but got {cell.fill.volume:0.3e}"
+
+    def test_cell_volumes_broadcast(self):
+        """Ensure volumes can be calculated for arrays of configurations at once"""
+        major_radii = np.array([400, 480, 560])
+        inboard_gaps = np.array([[80], [100]])
+        volumes = cell_volumes({'major_radius': major_radii, 'blanket_inboard_gap': inboard_gaps})
+
+        assert volumes['first_wall_cell'].shape == (3,)
+        assert volumes['blanket_cell'].shape == (2, 3)
+        assert volumes['blanket_cell'][1, 1] == pytest.approx(cell_volumes()['blanket_cell'])
+
+    def test_geometry_hash(self):
+        """Ensure the geometry hash only depends on the geometry"""
+        default_hash = geometry_hash()
+
+        assert geometry_hash({'blanket_material': flibe(li6_enrichment=90)}) == default_hash
+        assert geometry_hash({'major_radius': 481}) != default_hash
+        assert geometry_hash({'midplane_split': True}) != default_hash
+
+    def test_model_config_hash(self):
+        """Ensure identical materials hash the same, regardless of their ids"""
+        default_hash = model_config_hash()
+
+        assert model_config_hash({'blanket_material': flibe()}) == default_hash
+        assert model_config_hash({'blanket_material': flibe(li6_enrichment=90)}) != default_hash
+
+    def test_model_hash(self):
+        """Ensure rebuilding the same model gives the same hash, so depletion can be resumed"""
+        default_hash = model_hash(make_model())
+
+        assert model_hash(make_model()) == default_hash
+        assert model_hash(make_model({'blanket_material': flibe(li6_enrichment=90)})) != default_hash
+        assert model_hash(make_model({'major_radius': 481})) != default_hash
+
+    def test_bounding_regions(self):
+        """Ensure the bounding regions don't change which cell any point is in"""
+        model = make_model({'midplane_split': True})
+        bounded_model = make_model({'midplane_split': True, 'bounding_regions': True})
+        cells = {cell.name: cell for cell in model.geometry.get_all_cells().values()}
+        bounded_cells = {cell.name: cell for cell in bounded_model.geometry.get_all_cells().values()}
+
+        rng = np.random.default_rng(42)
+        r = rng.uniform(0, 1000, 2000)
+        phi = rng.uniform(0, 2*np.pi/14, 2000)
+        z = rng.uniform(-700, 700, 2000)
+        for point in zip(r*np.cos(phi), r*np.sin(phi), z):
+            for name, cell in cells.items():
+                assert (point in cell.region) == (point in bounded_cells[name].region), f"Bounding region changed {name} at {point}"
+
+    def test_consolidated_tallies(self):
+        """Ensure the layer tally covers every cell in the model"""
+        model = make_model({'midplane_split': True})
+        tallies = {tally.name: tally for tally in model.tallies}
+
+        assert set(tallies.keys()) == {'layer_tally', 'flux_spectrum'}
+        assert len(tallies['layer_tally'].filters[0].bins) == len(model.geometry.get_all_cells())
+
+    def test_voxel_cell_volumes(self):
+        """Ensure the mesh voxel volumes add up to the analytic volume of the blanket"""
+        r_min, r_max, half_height = section_extent()
+        volumes = voxel_cell_volumes(np.linspace(r_min, r_max, 201), np.linspace(-half_height, half_height, 301))
+
+        assert np.sum(volumes['blanket_cell']) == pytest.approx(cell_volumes()['blanket_cell'], rel=1e-3)
+
+    def test_heating_mesh_with_midplane_split(self):
+        """Ensure the heating mesh can't be combined with the midplane split"""
+        with pytest.raises(ValueError):
+            make_model({'heating_mesh': True, 'midplane_split': True})
+
+    def test_tally_triggers(self):
+        """Ensure tally triggers add a trigger tally for each target and turn on triggers"""
+        model = make_model({'tally_triggers': {'tbr': 1e-3, 'first_wall_cell': 1e-2}, 'max_batches': 500})
+        tallies = {tally.name: tally for tally in model.tallies}
+
+        assert tallies['trigger_tbr'].triggers[0].threshold == 1e-3
+        cells = model.geometry.get_all_cells()
+        tbr_cells = {cells[cell_id].name for cell_id in tallies['trigger_tbr'].filters[0].bins}
+        assert tbr_cells == {'cooling_channel_cell', 'blanket_cell'}
+        assert tallies['trigger_first_wall_cell'].triggers[0].threshold == 1e-2
+        assert model.settings.trigger_active
+        assert model.settings.trigger_max_batches == 500
+
+        with pytest.raises(ValueError):
+            make_model({'tally_triggers': {'not_a_cell': 1e-2}})
+
+    def test_section_angle(self):
+        """Ensure the section angle changes the volumes and can be read back from the model"""
+        model = make_model({'section_angle': 10})
+
+        assert model_section_correction(model) == pytest.approx(10/360)
+        assert cell_volumes({'section_angle': 10})['blanket_cell'] == pytest.approx(cell_volumes()['blanket_cell'] * 10/(360/14))
+
+    def test_make_source(self):
+        """Ensure the source follows the major radius and section angle"""
+        source = make_source({'major_radius': 500, 'section_angle': 10})
+
+        assert source.space.r.x[0] == 500
+        assert source.space.phi.b == pytest.approx(np.radians(10))
+
+    def test_import_without_nuclear_data(self, monkeypatch):
+        """Ensure the model can be imported without the cross sections and chain set,
+        and that they are only looked up when used"""
+        monkeypatch.delenv('OPENMC_CROSS_SECTIONS', raising=False)
+        monkeypatch.delenv('OPENMC_CHAIN_FILE', raising=False)
+        importlib.reload(utilities)
+
+        with pytest.raises(KeyError):
+            utilities.CHAIN_FILE
+
+        monkeypatch.setenv('OPENMC_CHAIN_FILE', 'chain.xml')
+        assert utilities.CHAIN_FILE == 'chain.xml'
+
+    def test_machine_profile(self, tmp_path, monkeypatch):
+        """Ensure a machine profile changes the batch size but keeps the number of histories, and only when asked for"""
+        monkeypatch.setattr(utilities, 'CACHE_DIRECTORY', tmp_path)
+        profile_path = utilities.machine_profile_path()
+        profile_path.parent.mkdir(parents=True)
+        with open(profile_path, 'w') as f:
+            json.dump({'recommended': {'particles': 10000, 'threads': 4}}, f)
+
+        settings = machine_profile_settings({'particles': int(1e6), 'batches': 100})
+        assert settings['particles'] == 10000
+        assert settings['batches'] == 10000
+
+        model = make_model({'batches': 20, 'machine_profile': True})
+        assert model.settings.particles == 10000
+        assert model.settings.particles * model.settings.batches == 20 * int(1e6)
+        # Still 2 statepoints, not 200
+        assert len(model.settings.statepoint['batches']) == 2
+
+        # Off by default, and an explicit particles always wins
+        assert make_model({'batches': 20}).settings.particles == int(1e6)
+        assert make_model({'particles': 500, 'machine_profile': True}).settings.particles == 500
+        assert utilities.recommended_threads() == 4
+
+    def test_model_cache(self, tmp_path, monkeypatch):
+        """Ensure cached models are keyed by the cache version and only a few are kept in memory"""
+        monkeypatch.setattr(barc_model_final, 'CACHE_DIRECTORY', tmp_path)
+        monkeypatch.setattr(barc_model_final, '_MODEL_CACHE', OrderedDict())
+        monkeypatch.setattr(barc_model_final, 'MODEL_CACHE_SIZE', 1)
+
+        config = {'batches': 5, 'cache_model': True}
+        key = model_cache_key(config)
+        make_model(config)
+        assert (tmp_path / 'models' / key / 'model.xml').exists()
+
+        make_model({'batches': 6, 'cache_model': True})
+        assert list(barc_model_final._MODEL_CACHE) == [model_cache_key({'batches': 6, 'cache_model': True})]
+
+        monkeypatch.setattr(barc_model_final, 'MODEL_CACHE_VERSION', barc_model_final.MODEL_CACHE_VERSION + 1)
+        assert model_cache_key(config) != key
+
+    @pytest.mark.parametrize('section_angle', [360/14, 90, 120])
+    def test_section_bounding_box(self, section_angle):
+        """Ensure the volume sampling box holds every corner of the section, including past 90 degrees"""
+        config = {'section_angle': section_angle}
+        (x_min, y_min, z_min), (x_max, y_max, z_max) = section_bounding_box(config)
+        r_min, r_max, half_height = section_extent(config)
+
+        for r in [r_min, r_max]:
+            for phi in np.radians(np.linspace(0, section_angle, 7)):
+                assert x_min - 1e-9 <= r*np.cos(phi) <= x_max + 1e-9
+                assert y_min - 1e-9 <= r*np.sin(phi) <= y_max + 1e-9
+        assert (z_min, z_max) == (-half_height, half_height)
+
+    def test_source_bank_size(self):
+        """Ensure reusing source sites is warned about"""
+        with pytest.warns(UserWarning):
+            assert check_source_bank_size({'particles': int(1e6), 'batches': 100, 'source_bank_size': int(1e6)}) == 100
+        assert check_source_bank_size({'particles': int(1e4), 'batches': 100, 'source_bank_size': int(1e6)}) == 1
@@ -0,0 +1,32 @@
+import numpy as np
+import openmc.deplete
+
+from barc_blanket.models.barc_model_final import make_model
+from barc_blanket.models.materials import flibe
+from barc_blanket.flux_cache import cached_flux_and_microxs, flux_and_microxs, depletable_cells, _save, flux_cache_key
+
+class TestFluxCache:
+
+    def test_round_trip(self, tmp_path):
+        """Ensure cached fluxes and cross sections come back for a rebuilt model but not for a different one"""
+        cache_file = tmp_path / "flux_microxs.h5"
+        model = make_model()
+        cells = depletable_cells(model)
+
+        fluxes = [np.array([float(i + 1)]) for i in range(len(cells))]
+        micros = [openmc.deplete.MicroXS(np.full((1, 1, 1), float(i)), ['Li6'], ['(n,Xt)']) for i in range(len(cells))]
+        _save(flux_cache_key(model), cells, fluxes, micros, cache_file)
+
+        # Found without running transport
+        cached_fluxes, cached_micros = flux_and_microxs(make_model(), energies=None, cache_file=cache_file)
+        assert np.allclose(np.concatenate(cached_fluxes), np.concatenate(fluxes))
+        assert cached_micros[-1].nuclides == ['Li6']
+        assert np.allclose(cached_micros[-1].data, micros[-1].data)
+
+        assert cached_flux_and_microxs(make_model({'blanket_material': flibe(li6_enrichment=90)}), cache_file=cache_file) == {}
+
+    def test_key_includes_settings(self):
+        """Ensure a quick run doesn't share cache entries with a production run of the same model"""
+        assert flux_cache_key(make_model()) == flux_cache_key(make_model())
+        assert flux_cache_key(make_model({'particles': int(1e4)})) != flux_cache_key(make_model())
+        assert flux_cache_key(make_model({'batches': 10})) != flux_cache_key(make_model())
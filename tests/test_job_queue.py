@@ -0,0 +1,42 @@
+import sys
+
+from barc_blanket.job_queue import JobQueue
+from barc_blanket.utilities import change_directory
+
+class TestJobQueue:
+
+    def test_dependencies_and_retries(self, tmp_path):
+        """Ensure jobs wait for their dependencies and failed jobs are retried"""
+        with change_directory(tmp_path):
+            queue = JobQueue()
+            first = queue.submit("first", [sys.executable, "-c", "open('out.txt', 'w').write('done')"], outputs=["out.txt"])
+            failing = queue.submit("failing", [sys.executable, "-c", "import sys; sys.exit(1)"], depends_on=[first], max_retries=1)
+            blocked = queue.submit("blocked", [sys.executable, "-c", "pass"], depends_on=[failing])
+
+            queue.work(poll_interval=0)
+
+            jobs = {job['id']: job for job in queue.jobs()}
+            assert jobs[first]['status'] == 'done'
+            assert jobs[first]['cpu_time'] > 0
+            assert jobs[failing]['status'] == 'failed'
+            assert jobs[failing]['attempts'] == 2
+            assert jobs[blocked]['status'] == 'pending'
+
+    def test_resubmit(self, tmp_path):
+        """Ensure submitting the same job twice doesn't queue it twice"""
+        with change_directory(tmp_path):
+            queue = JobQueue()
+            job_id = queue.submit("job", ["true"], config={'case': 'pure_flibe'})
+
+            assert queue.submit("job", ["true"], config={'case': 'pure_flibe'}) == job_id
+            assert queue.submit("job", ["true"], config={'case': 'pure_lid'}) != job_id
+
+    def test_missing_output_fails(self, tmp_path):
+        """Ensure a job that doesn't write its outputs isn't marked done"""
+        with change_directory(tmp_path):
+            queue = JobQueue()
+            job_id = queue.submit("job", [sys.executable, "-c", "pass"], outputs=["missing.h5"])
+
+            queue.work(poll_interval=0)
+
+            assert queue.jobs()[0]['status'] == 'failed'
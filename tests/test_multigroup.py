@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from barc_blanket.multigroup import _layer_quantities, _fold_responses, _bias_table
+
+def make_spectrum(fluxes):
+    """Flux spectrum tally results with two groups in each cell, highest energy first like a tally might give them"""
+    rows = []
+    for cell_name, (fast, thermal) in fluxes.items():
+        rows.append({'cell_name': cell_name, 'energy_low': 1e5, 'energy_high': 2e7, 'score': 'flux', 'mean': fast})
+        rows.append({'cell_name': cell_name, 'energy_low': 0.0, 'energy_high': 1e5, 'score': 'flux', 'mean': thermal})
+    return pd.DataFrame(rows)
+
+class TestMultigroup:
+
+    def test_fold_responses(self, tmp_path):
+        """Ensure the group fluxes are folded with the responses and only the breeder counts towards the TBR"""
+        np.savez(tmp_path / "responses.npz",
+                 cell_names=np.array(['blanket_cell', 'first_wall_cell']),
+                 group_edges=np.array([0.0, 1e5, 2e7]),
+                 tritium=np.array([[1.0, 2.0], [5.0, 5.0]]),
+                 heating=np.array([[10.0, 0.0], [1.0, 1.0]]))
+        responses = np.load(tmp_path / "responses.npz")
+
+        # The plasma has no responses and is skipped
+        spectrum = make_spectrum({'blanket_cell': (3.0, 4.0), 'first_wall_cell': (1.0, 1.0), 'plasma_cell': (1.0, 1.0)})
+        results = _fold_responses(spectrum, responses)
+
+        assert results['tbr'] == pytest.approx(4.0 * 1.0 + 3.0 * 2.0)
+        assert results['heating'] == pytest.approx({'blanket_cell': 40.0, 'first_wall_cell': 2.0})
+
+        with pytest.raises(ValueError):
+            _fold_responses(spectrum[spectrum['energy_low'] > 0], responses)
+
+    def test_bias(self):
+        """Ensure the reference TBR only counts the breeder and the bias compares like with like"""
+        layer_results = pd.DataFrame([
+            {'cell_name': 'blanket_cell', 'score': '(n,Xt)', 'mean': 1.0},
+            {'cell_name': 'cooling_channel_cell', 'score': '(n,Xt)', 'mean': 0.1},
+            {'cell_name': 'first_wall_cell', 'score': '(n,Xt)', 'mean': 0.5},
+            {'cell_name': 'blanket_cell', 'score': 'heating-local', 'mean': 100.0},
+        ])
+        reference = _layer_quantities(layer_results)
+        assert reference['tbr'] == pytest.approx(1.1)
+
+        bias = _bias_table(reference, {'tbr': 1.21, 'heating': {'blanket_cell': 90.0}}).set_index('quantity')
+        assert bias.loc['tbr', 'bias_percent'] == pytest.approx(10.0)
+        assert bias.loc['heating_blanket_cell', 'bias_percent'] == pytest.approx(-10.0)
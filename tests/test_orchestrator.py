@@ -0,0 +1,91 @@
+import os
+import asyncio
+from pathlib import Path
+
+from barc_blanket.orchestrator import run_openmc, _parse_line, _progress_lines
+
+def new_run(name, directory):
+    """Run dict as made by run_models_async"""
+    return {'name': name,
+            'directory': directory,
+            'status': 'queued',
+            'batch': 0,
+            'batches': 10,
+            'keff': None,
+            'trigger': None,
+            'statepoint': None,
+            'return_code': None,
+            'wall_time': None}
+
+def fake_openmc(path, script):
+    """Put an executable called openmc that runs a shell script at the front of the PATH"""
+    path.mkdir(parents=True, exist_ok=True)
+    executable = path / "openmc"
+    executable.write_text("#!/bin/sh\n" + script)
+    executable.chmod(0o755)
+    return f"{path}{os.pathsep}{os.environ['PATH']}"
+
+class TestParseOutput:
+
+    def test_fixed_source_batch(self):
+        """Ensure the batch is read from fixed source output"""
+        run = new_run('a', '.')
+        _parse_line(" Simulating batch 7\n", run)
+        assert run['batch'] == 7
+
+    def test_eigenvalue_batch(self):
+        """Ensure the combined k-effective is only read once it is printed"""
+        run = new_run('a', '.')
+        _parse_line("        3/1    1.01234\n", run)
+        assert run['batch'] == 3 and run['keff'] is None
+        _parse_line("       12/1    1.02345    1.02100 +/- 0.00123\n", run)
+        assert run['batch'] == 12
+        assert run['keff'] == (1.021, 0.00123)
+
+    def test_triggers_and_statepoint(self):
+        """Ensure trigger progress and the statepoint name are read"""
+        run = new_run('a', '.')
+        _parse_line(" Triggers unsatisfied, max unc./thresh. is 1.52 for heating in tally 5\n", run)
+        assert run['trigger'] == "heating in tally 5 at 1.52x target"
+        _parse_line(" Triggers satisfied for batch 40\n", run)
+        assert run['trigger'] == "satisfied"
+        _parse_line(" Creating state point statepoint.40.h5...\n", run)
+        assert run['statepoint'] == "statepoint.40.h5"
+
+    def test_progress_lines(self):
+        """Ensure the summary counts every status and only running runs get their own line"""
+        running = {**new_run('running_case', '.'), 'status': 'running', 'batch': 4, 'keff': (1.0, 0.001)}
+        done = {**new_run('done_case', '.'), 'status': 'done'}
+        lines = _progress_lines([running, done])
+        assert lines[0] == "1 running, 1 done"
+        assert len(lines) == 2
+        assert "running_case" in lines[1] and "batch 4/10" in lines[1] and "k = 1.00000" in lines[1]
+
+class TestRunOpenMC:
+
+    def test_statepoint_in_relative_directory(self, tmp_path, monkeypatch):
+        """Ensure a statepoint that isn't named in the output is found in the run directory without doubling it"""
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv('PATH', fake_openmc(tmp_path / "bin", 'echo " Simulating batch 10"\ntouch statepoint.10.h5\n'))
+        Path("run_a").mkdir()
+
+        run = new_run('a', 'run_a')
+        asyncio.run(run_openmc(run, asyncio.Semaphore(1)))
+
+        assert run['status'] == 'done'
+        assert run['batch'] == 10
+        assert run['statepoint'] == (tmp_path / "run_a" / "statepoint.10.h5").resolve()
+        assert (tmp_path / "run_a" / "openmc.log").exists()
+
+    def test_timeout(self, tmp_path, monkeypatch):
+        """Ensure a run that goes past the timeout is killed and marked as timed out"""
+        monkeypatch.setenv('PATH', fake_openmc(tmp_path / "bin", 'echo " Simulating batch 3"\nexec sleep 30\n'))
+        (tmp_path / "run_a").mkdir()
+
+        run = new_run('a', tmp_path / "run_a")
+        asyncio.run(run_openmc(run, asyncio.Semaphore(1), timeout=2))
+
+        assert run['status'] == 'timeout'
+        assert run['batch'] == 3
+        assert run['statepoint'] is None
+        assert run['wall_time'] < 10
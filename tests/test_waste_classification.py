@@ -1,7 +1,9 @@
+import numpy as np
 import openmc
 import pytest
 
-from barc_blanket.materials.waste_classification import check_class_c, sum_of_fractions, separate_nuclides, make_activity_volume_density
+from barc_blanket.materials.waste_classification import check_class_c, sum_of_fractions, separate_nuclides, make_activity_volume_density, \
+    max_waste_loading, vitrification_waste_loading, vitrify_waste, optimize_separation, group_removal_efficiencies
 
 class TestCheckClassC:
 
@@ -132,4 +134,74 @@ class TestMakeActivityVolumeDensity:
             assert activity_Ci_per_m3 == pytest.approx(target_activity, rel=0.01), f"Expected {nuclide} to have an activity of {target_activity:0.2f} Ci/m3 but got {activity_Ci_per_m3:0.2f} Ci/m3"
 
 
-        
\ No newline at end of file
+class TestVitrification:
+
+    def test_max_waste_loading(self):
+        """Ensure the closed form waste loading works element-wise on arrays"""
+        waste_loading = max_waste_loading(np.array([0.5, 2.0, 4.0]), 0.0, 1.0)
+        assert waste_loading == pytest.approx([1.0, 0.5, 0.25]), f"Expected waste loadings of [1, 0.5, 0.25] but got {waste_loading}"
+
+        # If the diluent alone is over the limit, no waste can be added
+        waste_loading = max_waste_loading(2.0, 1.5, 1.0)
+        assert waste_loading == 0.0, f"Expected a waste loading of 0 but got {waste_loading}"
+
+    def test_half_loading(self):
+        """Waste at twice the class C limit for Sr90 should need to be diluted by half
+        with a non-radioactive glass of the same density"""
+
+        waste = make_activity_volume_density({'Sr90': 14000})
+        waste_density = waste.get_mass_density()
+
+        glass = openmc.Material(name='inert_glass')
+        glass.add_nuclide('O16', 1.0)
+        glass.set_density('g/cm3', waste_density)
+
+        waste_loadings = vitrification_waste_loading([waste, waste], glass=glass, waste_form_density=waste_density)
+        assert waste_loadings['C'].shape == (2,)
+        assert waste_loadings['C'] == pytest.approx([0.5, 0.5], rel=0.01), f"Expected a class C waste loading of 0.5 but got {waste_loadings['C']}"
+
+        # Ensure mixing at that loading actually lands on the class C limit
+        vitrified = vitrify_waste(waste, waste_loadings['C'][0], glass=glass, waste_form_density=waste_density)
+        sum_of_fractions_result, _ = sum_of_fractions(vitrified, 2, 3)
+        assert sum_of_fractions_result == pytest.approx(1.0, rel=0.01), f"Expected sum of fractions to be about 1 but got {sum_of_fractions_result:0.2f}"
+
+    def test_remove_C14(self):
+        """Waste that is only over the limit because of C14 needs no glass if C14 is left out"""
+
+        waste = make_activity_volume_density({'C14': 16})
+        waste_density = waste.get_mass_density()
+
+        glass = openmc.Material(name='inert_glass')
+        glass.add_nuclide('O16', 1.0)
+        glass.set_density('g/cm3', waste_density)
+
+        with_C14 = vitrification_waste_loading(waste, glass=glass, waste_form_density=waste_density, waste_classes=["C"])["C"]
+        without_C14 = vitrification_waste_loading(waste, glass=glass, waste_form_density=waste_density, waste_classes=["C"], remove_C14=True)["C"]
+        assert with_C14 == pytest.approx(0.5, rel=0.01), f"Expected a class C waste loading of 0.5 but got {with_C14}"
+        assert without_C14 == pytest.approx(1.0), f"Expected no glass to be needed without C14 but got {without_C14}"
+
+
+class TestOptimizeSeparation:
+
+    def test_only_needed_group_is_separated(self):
+        """A material that is only over the class C limit because of Sr90 should only need Sr removed,
+        and removing it with the optimized efficiency should make it class C"""
+
+        # About twice the column 3 limit of Sr90
+        material = openmc.Material(name='strontium_waste')
+        material.add_nuclide('O16', 99.99, 'wo')
+        material.add_nuclide('Sr90', 0.01, 'wo')
+        material.add_nuclide('H3', 1e-6, 'wo')
+        material.set_density('g/cm3', 1.0)
+        assert check_class_c(material) == False
+
+        group_efficiencies = optimize_separation(material)
+
+        assert 0.4 < group_efficiencies['Sr'] < 0.6, f"Expected about half the Sr to be removed but got {group_efficiencies['Sr']:0.2f}"
+        for group_name, efficiency in group_efficiencies.items():
+            if group_name != 'Sr':
+                assert efficiency == pytest.approx(0, abs=1e-3), f"Expected no {group_name} removal but got {efficiency:0.2f}"
+
+        nuclide_removal_efficiencies = group_removal_efficiencies(material.get_nuclides(), group_efficiencies)
+        separated_material = separate_nuclides(material, nuclide_removal_efficiencies)
+        assert check_class_c(separated_material) == True, "Expected the separated material to be class C"